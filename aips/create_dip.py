@@ -22,14 +22,18 @@ import shutil
 import uuid
 
 import amclient
-import metsrw
+import requests
+
+from transfers import circuitbreaker, profiling
 
 THIS_DIR = os.path.abspath(os.path.dirname(__file__))
 LOGGER = logging.getLogger("create_dip")
 
 
 def setup_logger(log_file, log_level="INFO"):
-    """Configures the logger to output to console and log file"""
+    """Configures the logger to output to console and log file, and returns
+    the path of the log file.
+    """
     if not log_file:
         log_file = os.path.join(THIS_DIR, "create_dip.log")
 
@@ -58,6 +62,7 @@ def setup_logger(log_file, log_level="INFO"):
     }
 
     logging.config.dictConfig(CONFIG)
+    return log_file
 
 
 def main(ss_url, ss_user, ss_api_key, aip_uuid, tmp_dir, output_dir):
@@ -92,7 +97,17 @@ def main(ss_url, ss_user, ss_api_key, aip_uuid, tmp_dir, output_dir):
         directory=tmp_dir,
     )
 
-    aip_file = am_client.download_aip()
+    breaker = circuitbreaker.get_breaker(ss_url)
+    if not breaker.allow():
+        LOGGER.error("Storage Service unavailable, not downloading the AIP")
+        return 4
+    try:
+        aip_file = am_client.download_aip()
+    except requests.exceptions.ConnectionError as err:
+        LOGGER.error("Connection error %s", err)
+        breaker.record_failure()
+        return 4
+    breaker.record_success()
 
     if not aip_file:
         LOGGER.error("Unable to download AIP")
@@ -165,6 +180,9 @@ def create_dip(aip_dir, aip_uuid, output_dir):
     :param str output_dir: absolute path to a directory to place the DIP
     :returns: absolute path to the created DIP folder
     """
+    # metsrw is slow to import and only needed once there is a DIP to create.
+    import metsrw
+
     aip_name = os.path.basename(aip_dir)[:-37]
     dip_dir = os.path.join(output_dir, "{}_{}_DIP".format(aip_name, aip_uuid))
     objects_dir = os.path.join(dip_dir, "objects")
@@ -378,6 +396,7 @@ if __name__ == "__main__":
         default=None,
         help="Set the debugging output level. This will override -q and -v",
     )
+    profiling.add_arguments(parser)
 
     args = parser.parse_args()
 
@@ -390,7 +409,8 @@ if __name__ == "__main__":
     else:
         log_level = args.log_level
 
-    setup_logger(args.log_file, log_level)
+    log_file = setup_logger(args.log_file, log_level)
+    profiling.start(args, "create_dip", log_file)
 
     sys.exit(
         main(
@@ -24,6 +24,7 @@ import amclient
 
 from aips import create_dip
 from aips import models
+from transfers import circuitbreaker, httpmetrics, profiling
 
 THIS_DIR = os.path.abspath(os.path.dirname(__file__))
 LOGGER = logging.getLogger("create_dip")
@@ -34,7 +35,9 @@ LOGGER = logging.getLogger("create_dip")
 
 
 def setup_logger(log_file, log_level="INFO"):
-    """Configures the logger to output to console and log file"""
+    """Configures the logger to output to console and log file, and returns
+    the path of the log file.
+    """
     if not log_file:
         log_file = os.path.join(THIS_DIR, "create_dip.log")
 
@@ -63,10 +66,19 @@ def setup_logger(log_file, log_level="INFO"):
     }
 
     logging.config.dictConfig(CONFIG)
+    return log_file
 
 
 def main(
-    ss_url, ss_user, ss_api_key, location_uuid, tmp_dir, output_dir, database_file
+    ss_url,
+    ss_user,
+    ss_api_key,
+    location_uuid,
+    tmp_dir,
+    output_dir,
+    database_file,
+    breaker_threshold=None,
+    breaker_timeout=None,
 ):
     LOGGER.info("Processing AIPs in SS location: %s", location_uuid)
 
@@ -77,6 +89,15 @@ def main(
         LOGGER.error("Could not create database in: %s", database_file)
         return 1
 
+    # Fail fast if the Storage Service was found unavailable by earlier runs
+    circuitbreaker.configure(
+        failure_threshold=breaker_threshold, reset_timeout=breaker_timeout
+    )
+    circuitbreaker.load(session)
+    circuitbreaker.guard_amclient()
+    httpmetrics.install()
+    breaker = circuitbreaker.get_breaker(ss_url)
+
     # Get UPLOADED and VERIFIED AIPs from the SS
     try:
         am_client = amclient.AMClient(
@@ -88,6 +109,8 @@ def main(
         aips = am_client.aips({"status__in": "UPLOADED,VERIFIED"})
     except Exception as e:
         LOGGER.error(e)
+        circuitbreaker.save(session)
+        httpmetrics.save(session)
         return 2
 
     # Get only AIPs from the specified location
@@ -95,6 +118,12 @@ def main(
 
     # Create DIPs for those AIPs
     for uuid in aip_uuids:
+        # Leave the remaining AIPs for the next run rather than record them
+        # as processed while they cannot be downloaded
+        if not breaker.available():
+            LOGGER.warning("Storage Service unavailable, stopping")
+            break
+
         try:
             # To avoid race conditions while checking for an existing AIP
             # and saving it, create the row directly and check for an
@@ -121,6 +150,9 @@ def main(
         # POSSIBLE ENHANCEMENT:
         # Save return value from create_dip.main() and update Aip status
 
+    circuitbreaker.save(session)
+    LOGGER.info(httpmetrics.summary())
+    httpmetrics.save(session)
     LOGGER.info("All AIPs have been processed")
 
 
@@ -197,6 +229,21 @@ if __name__ == "__main__":
         help="Absolute path to the directory used to place the final DIP. Default: /tmp.",
         default="/tmp",
     )
+    parser.add_argument(
+        "--breaker-threshold",
+        metavar="N",
+        type=int,
+        help="Number of failed calls after which the Storage Service is not "
+        "called again until the breaker timeout has passed. Default: %s."
+        % circuitbreaker.DEFAULT_FAILURE_THRESHOLD,
+    )
+    parser.add_argument(
+        "--breaker-timeout",
+        metavar="SECONDS",
+        type=int,
+        help="Seconds to wait before calling an unavailable Storage Service "
+        "again. Default: %s." % circuitbreaker.DEFAULT_RESET_TIMEOUT,
+    )
 
     # Logging
     parser.add_argument(
@@ -218,6 +265,7 @@ if __name__ == "__main__":
         default=None,
         help="Set the debugging output level. This will override -q and -v",
     )
+    profiling.add_arguments(parser)
 
     args = parser.parse_args()
 
@@ -230,7 +278,8 @@ if __name__ == "__main__":
     else:
         log_level = args.log_level
 
-    setup_logger(args.log_file, log_level)
+    log_file = setup_logger(args.log_file, log_level)
+    profiling.start(args, "create_dips_job", log_file)
 
     sys.exit(
         main(
@@ -241,5 +290,7 @@ if __name__ == "__main__":
             tmp_dir=args.tmp_dir,
             output_dir=args.output_dir,
             database_file=args.database_file,
+            breaker_threshold=args.breaker_threshold,
+            breaker_timeout=args.breaker_timeout,
         )
     )
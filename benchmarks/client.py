@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark the Client-side Cost of the Calls to Archivematica.
+
+Replays the VCR cassettes of the tests (``fixtures/vcr_cassettes``) in tight
+loops to measure what ``get_status``, ``get_next_transfer``,
+``approve_transfer`` and ``call_start_transfer_endpoint`` cost on the client:
+building the requests, decoding JSON and base64 paths, logging, at INFO level
+to /dev/null by default, and writing to the database. The cost of the replay
+by VCR is included, but it is the same from one run to the next, so that the
+results can be compared without network variance.
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import collections
+import logging
+import os
+import sys
+
+import vcr
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+# Allow execution as an executable and the script to be run at package level
+# by ensuring that it can see itself.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import runner
+from transfers import loggingconfig, models, transfer
+
+CASSETTES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "fixtures",
+    "vcr_cassettes",
+)
+DEFAULT_NUMBER = 1000
+
+# Settings with which the cassettes were recorded.
+AM_URL = "http://127.0.0.1"
+AM_USER = "demo"
+AM_API_KEY = "1c34274c0df0bca7edf9831dd838b4a6345ac2ef"
+SS_URL = "http://127.0.0.1:8000"
+SS_USER = "test"
+SS_API_KEY = "7016762e174c940df304e8343c659af5005b4d6b"
+TS_LOCATION_UUID = "2a3d8d39-9cee-495e-b7ee-5e629254934d"
+TRANSFER_UUID = "dfc8cf5f-b5b1-408c-88b1-34215964e9d6"
+SIP_UUID = "f2248e2a-b593-43db-b60c-fa8513021785"
+
+
+def get_status(unit_uuid, unit_type):
+    return transfer.get_status(
+        AM_URL, AM_USER, AM_API_KEY, SS_URL, SS_USER, SS_API_KEY, unit_uuid, unit_type
+    )
+
+
+def get_next_transfer(processed):
+    return transfer.get_next_transfer(
+        SS_URL,
+        SS_USER,
+        SS_API_KEY,
+        TS_LOCATION_UUID,
+        b"SampleTransfers",
+        1,
+        processed,
+        False,
+    )
+
+
+def approve_transfer():
+    return transfer.approve_transfer("standard_1", AM_URL, AM_API_KEY, AM_USER)
+
+
+def call_start_transfer_endpoint():
+    return transfer.call_start_transfer_endpoint(
+        AM_URL,
+        AM_USER,
+        AM_API_KEY,
+        b"standard_1",
+        b"standard",
+        b"standard_1",
+        TS_LOCATION_UUID,
+    )
+
+
+def benchmarks():
+    """Return the benchmarks as tuples of name, cassette, function and setup
+    function, or None.
+    """
+    # The transfer becomes an ingest in the database, and back in the setup.
+    unit = []
+
+    def as_transfer():
+        if not unit:
+            unit.append(models.add_new_transfer(TRANSFER_UUID, b"test1"))
+        models.update_unit_type_and_uuid(unit[0], "transfer", TRANSFER_UUID)
+
+    return [
+        (
+            "get_status[transfer]",
+            "test_transfers_get_status_transfer.yaml",
+            lambda: get_status(TRANSFER_UUID, "transfer"),
+            None,
+        ),
+        (
+            "get_status[ingest]",
+            "test_transfers_get_status_ingest.yaml",
+            lambda: get_status(SIP_UUID, "ingest"),
+            None,
+        ),
+        (
+            "get_status[transfer to ingest]",
+            "test_transfers_get_status_transfer_to_ingest.yaml",
+            lambda: get_status(TRANSFER_UUID, "transfer"),
+            as_transfer,
+        ),
+        (
+            "get_next_transfer[first run]",
+            "test_transfers_get_next_transfer_first_run.yaml",
+            lambda: get_next_transfer(set()),
+            None,
+        ),
+        (
+            "get_next_transfer[existing set]",
+            "test_transfers_get_next_transfer_existing_set.yaml",
+            lambda: get_next_transfer({b"SampleTransfers/BagTransfer"}),
+            None,
+        ),
+        (
+            "approve_transfer",
+            "test_transfers_approve_transfer.yaml",
+            approve_transfer,
+            None,
+        ),
+        (
+            "call_start_transfer_endpoint",
+            "test_transfers_call_start_transfer_endpoint.yaml",
+            call_start_transfer_endpoint,
+            None,
+        ),
+    ]
+
+
+def run(number=DEFAULT_NUMBER, repeat=runner.DEFAULT_REPEAT, memory=True):
+    """Return the results of the benchmarks, keyed by name."""
+    results = collections.OrderedDict()
+    models.init_session(":memory:")
+    # approve_transfer waits for Archivematica to list the transfer first.
+    sleep = mock.patch("transfers.transfer.time.sleep")
+    sleep.start()
+    try:
+        for name, cassette, func, setup in benchmarks():
+            with vcr.use_cassette(
+                os.path.join(CASSETTES_DIR, cassette),
+                record_mode="none",
+                allow_playback_repeats=True,
+            ):
+                results[name] = runner.measure(func, repeat, memory, number, setup)
+    finally:
+        sleep.stop()
+        models.cleanup_session()
+        models.Session = models.transfer_session = None
+    return results
+
+
+def setup_logging(log_level):
+    """Log the records of the transfer scripts as they do, but to /dev/null."""
+    handler = logging.StreamHandler(open(os.devnull, "w"))
+    handler.setFormatter(
+        logging.Formatter(loggingconfig.TEXT_FORMAT, loggingconfig.DATE_FORMAT)
+    )
+    logger = logging.getLogger("transfers")
+    logger.addHandler(handler)
+    logger.setLevel(log_level)
+    logger.propagate = False
+
+
+def main(args):
+    setup_logging(args.log_level)
+    results = run(args.number, args.repeat, not args.no_memory)
+    return runner.report(results, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--number",
+        type=int,
+        default=DEFAULT_NUMBER,
+        help="Number of calls of each round. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=["ERROR", "WARNING", "INFO", "DEBUG"],
+        default="INFO",
+        help="Level of the records logged to /dev/null. Default: %(default)s",
+    )
+    runner.add_arguments(parser)
+    args = parser.parse_args()
+
+    sys.exit(main(args))
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark the Discovery of the Next Transfer Source.
+
+Measures ``get_next_transfer``, given the processed paths, and the selection
+of ``start_transfer``, which first reads the processed paths from the ``unit``
+table, against transfer sources of 1k to 1M entries at depths 1 to 3, served
+by the simulator (``simulator.server``). In each scenario, the first share of
+the entries, in the order they are started, have been processed.
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import collections
+import itertools
+import logging
+import os
+import sys
+
+# Allow execution as an executable and the script to be run at package level
+# by ensuring that it can see itself.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import runner
+from simulator import server
+from transfers import models, transfer
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_DEPTHS = (1, 2, 3)
+DEFAULT_PROCESSED = (0, 0.5, 0.99)
+
+
+def breadth(size, depth):
+    """Return the number of entries per directory of a tree of ``depth``
+    levels with about ``size`` entries at the last one.
+    """
+    entries = int(round(size ** (1 / depth)))
+    while entries**depth < size:
+        entries += 1
+    return entries
+
+
+def processed_paths(entries, depth, count):
+    """Return the paths of the first ``count`` transfer sources of the
+    simulated tree.
+    """
+    names = ["dir-{:06d}".format(number).encode() for number in range(entries)]
+    return set(
+        b"/".join(parts)
+        for parts in itertools.islice(itertools.product(names, repeat=depth), count)
+    )
+
+
+def record_processed(paths):
+    """Replace the units of the database by completed units from ``paths``."""
+    models.transfer_session.query(models.Unit).delete()
+    if paths:
+        models.transfer_session.execute(
+            models.Unit.__table__.insert(),
+            [
+                {
+                    "path": path,
+                    "unit_type": "ingest",
+                    "status": "COMPLETE",
+                    "current": False,
+                }
+                for path in paths
+            ],
+        )
+    models.transfer_session.commit()
+
+
+def run(sizes, depths, shares, repeat, memory):
+    """Return the results of the benchmarks of the scenarios, keyed by name."""
+    results = collections.OrderedDict()
+    models.init_session(":memory:")
+    try:
+        for size, depth in itertools.product(sizes, depths):
+            entries = breadth(size, depth)
+            simulated = server.serve_in_thread(
+                {"entries": entries, "levels": depth, "files": 1, "aips": 0}
+            )
+            try:
+                for share in shares:
+                    total = entries**depth
+                    processed = processed_paths(entries, depth, int(total * share))
+                    record_processed(processed)
+
+                    def next_transfer(processed=processed):
+                        return transfer.get_next_transfer(
+                            simulated.url,
+                            "test",
+                            "test",
+                            server.TRANSFER_SOURCE_UUID,
+                            b"",
+                            depth,
+                            processed,
+                            False,
+                        )
+
+                    def select():
+                        return next_transfer(models.get_processed_transfer_paths())
+
+                    scenario = "[entries={},depth={},processed={:g}%]".format(
+                        total, depth, share * 100
+                    )
+                    for name, func in (
+                        ("get_next_transfer", next_transfer),
+                        ("start_transfer selection", select),
+                    ):
+                        results[name + scenario] = runner.measure(func, repeat, memory)
+            finally:
+                simulated.shutdown()
+                simulated.server_close()
+    finally:
+        models.cleanup_session()
+        models.Session = models.transfer_session = None
+    return results
+
+
+def main(args):
+    # The transfer scripts log each call at INFO level.
+    logging.getLogger("transfers").setLevel(logging.WARNING)
+    results = run(
+        args.sizes, args.depths, args.processed, args.repeat, not args.no_memory
+    )
+    return runner.report(results, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="Numbers of entries of the transfer sources. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--depths",
+        type=int,
+        nargs="+",
+        default=DEFAULT_DEPTHS,
+        help="Depths of the transfer sources. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--processed",
+        type=float,
+        nargs="+",
+        default=DEFAULT_PROCESSED,
+        help="Shares of the entries already processed. Default: %(default)s",
+    )
+    runner.add_arguments(parser)
+    args = parser.parse_args()
+
+    sys.exit(main(args))
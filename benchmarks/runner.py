@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+"""Measure the benchmarks of the automation tools and compare them with
+baselines.
+
+Each benchmark is a function called in ``repeat`` rounds of ``number`` calls.
+The best average wall time of the rounds is kept, with the number of HTTP
+calls made per call, counted by ``transfers.httpmetrics``, and the peak memory
+allocated by one call, traced by tracemalloc in a separate call so that
+tracing does not slow down the timed ones.
+
+Results saved with ``--save`` are a JSON object keyed by benchmark name. Given
+a baseline with ``--compare``, the run fails if a benchmark takes more than
+``--tolerance`` more time or memory, or makes more HTTP calls, than in the
+baseline. Wall times depend on the machine, so compare with baselines saved
+on the same one.
+"""
+
+from __future__ import division, print_function
+
+import json
+import sys
+import timeit
+
+from transfers import httpmetrics
+
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 0.25
+# Differences in wall time below this number of seconds are noise.
+MIN_WALL_DIFFERENCE = 0.005
+
+
+def _peak_memory(func, setup=None):
+    try:
+        import tracemalloc
+    except ImportError:  # Python 2
+        return None
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(func, repeat=DEFAULT_REPEAT, memory=True, number=1, setup=None):
+    """Return the best wall time in seconds of a call of ``func``, the number
+    of HTTP calls per call, and the peak memory in bytes of a call, None if
+    not measured.
+
+    :param int repeat: Number of timed rounds, the best of which is kept.
+    :param int number: Number of calls per round, the wall time being the
+                       average of a round.
+    :param setup: Function called before each call, outside of the timing.
+    """
+    httpmetrics.install()
+    httpmetrics.reset()
+    times = []
+    for _ in range(repeat):
+        elapsed = 0
+        for _ in range(number):
+            if setup:
+                setup()
+            start = timeit.default_timer()
+            func()
+            elapsed += timeit.default_timer() - start
+        times.append(elapsed / number)
+    calls = sum(stat.calls for stat in httpmetrics.get_stats().values())
+    httpmetrics.reset()
+    return {
+        "wall": min(times),
+        "calls": calls // (repeat * number),
+        "peak": _peak_memory(func, setup) if memory else None,
+    }
+
+
+def _format_bytes(size):
+    if size is None:
+        return "-"
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = "GiB"
+    return "{:.1f} {}".format(size, unit)
+
+
+def format_results(results):
+    """Return the lines of a table of ``results``, keyed by benchmark name."""
+    width = max([len(name) for name in results] + [9])
+    lines = [
+        "{:<{width}}  {:>10}  {:>6}  {:>10}".format(
+            "benchmark", "wall (ms)", "calls", "peak", width=width
+        )
+    ]
+    for name, result in results.items():
+        lines.append(
+            "{:<{width}}  {:>10.2f}  {:>6}  {:>10}".format(
+                name,
+                result["wall"] * 1000,
+                result["calls"],
+                _format_bytes(result["peak"]),
+                width=width,
+            )
+        )
+    return lines
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Return the descriptions of the regressions of ``results`` from
+    ``baseline``. Benchmarks missing from either are ignored.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if (
+            result["wall"] > base["wall"] * (1 + tolerance)
+            and result["wall"] - base["wall"] > MIN_WALL_DIFFERENCE
+        ):
+            regressions.append(
+                "{}: {:.2f} ms instead of {:.2f} ms".format(
+                    name, result["wall"] * 1000, base["wall"] * 1000
+                )
+            )
+        if result["calls"] > base["calls"]:
+            regressions.append(
+                "{}: {} HTTP calls instead of {}".format(
+                    name, result["calls"], base["calls"]
+                )
+            )
+        if result["peak"] and base.get("peak"):
+            if result["peak"] > base["peak"] * (1 + tolerance):
+                regressions.append(
+                    "{}: {} peak memory instead of {}".format(
+                        name, _format_bytes(result["peak"]), _format_bytes(base["peak"])
+                    )
+                )
+    return regressions
+
+
+def add_arguments(parser):
+    """Add the options of the benchmark runners to ``parser``."""
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=DEFAULT_REPEAT,
+        help="Number of timed calls of each benchmark. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="Do not measure the peak memory, which takes an extra call.",
+    )
+    parser.add_argument("--save", metavar="FILE", help="Save the results as JSON.")
+    parser.add_argument(
+        "--compare", metavar="FILE", help="Compare the results with a baseline."
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Share of time or memory over the baseline counted as a "
+        "regression. Default: %(default)s",
+    )
+
+
+def report(results, args, out=sys.stdout):
+    """Print ``results``, save them and compare them with a baseline as asked
+    with ``args``.
+
+    :returns: Exit code, 1 if there are regressions.
+    """
+    for line in format_results(results):
+        print(line, file=out)
+    if args.save:
+        with open(args.save, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print("Regression: {}".format(regression), file=out)
+        if regressions:
+            return 1
+    return 0
@@ -16,13 +16,17 @@ import sys
 
 import requests
 
+from transfers import httpmetrics, profiling
+
 
 THIS_DIR = os.path.abspath(os.path.dirname(__file__))
 LOGGER = logging.getLogger("atom_upload")
 
 
 def setup_logger(log_file, log_level="INFO"):
-    """Configures the logger to output to console and log file"""
+    """Configures the logger to output to console and log file, and returns
+    the path of the log file.
+    """
     if not log_file:
         log_file = os.path.join(THIS_DIR, "atom_upload.log")
 
@@ -51,6 +55,7 @@ def setup_logger(log_file, log_level="INFO"):
     }
 
     logging.config.dictConfig(CONFIG)
+    return log_file
 
 
 def main(atom_url, atom_email, atom_password, atom_slug, rsync_target, dip_path):
@@ -65,11 +70,14 @@ def main(atom_url, atom_email, atom_password, atom_slug, rsync_target, dip_path)
 
     LOGGER.info("DIP folder sent to: %s", rsync_target)
 
+    httpmetrics.install()
     try:
         deposit(atom_url, atom_email, atom_password, atom_slug, dip_path)
     except Exception as e:
         LOGGER.error("Deposit request to AtoM failed: %s", e)
         return 2
+    finally:
+        LOGGER.info(httpmetrics.summary())
 
     LOGGER.info("DIP deposited in AtoM")
 
@@ -200,6 +208,7 @@ if __name__ == "__main__":
         default=None,
         help="Set the debugging output level. This will override -q and -v",
     )
+    profiling.add_arguments(parser)
 
     args = parser.parse_args()
 
@@ -212,7 +221,8 @@ if __name__ == "__main__":
     else:
         log_level = args.log_level
 
-    setup_logger(args.log_file, log_level)
+    log_file = setup_logger(args.log_file, log_level)
+    profiling.start(args, "atom_upload", log_file)
 
     sys.exit(
         main(
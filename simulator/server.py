@@ -0,0 +1,701 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Simulate Archivematica, the Storage Service and AtoM.
+
+Serves, on a single port, the endpoints of Archivematica, the Storage Service
+and AtoM used by the automation tools, so that they can be run end to end and
+their throughput measured on one machine:
+
+* Storage Service: locations and their browsing, packages, AIP download,
+  reingest and pipelines.
+* Archivematica: ``start_transfer``, unapproved transfers and their approval,
+  transfer and ingest status, ``v2beta`` packages and jobs, processing
+  configurations and the deletion of units.
+* AtoM: SWORD deposits.
+
+Point the scripts to it as both the Archivematica and the Storage Service URL.
+The transfer source location lists a synthetic tree of ``--entries``
+directories per level over ``--levels`` levels, the directories of the last
+level holding ``--files`` files. Units take ``--transfer-duration`` and then
+``--ingest-duration`` seconds to complete, a ``--unit-failure-rate`` share of
+them failing at ingest, and completed ingests are stored as AIPs. Each request
+is answered after ``--latency`` seconds plus up to ``--jitter`` seconds, a
+``--failure-rate`` share of them failing with a server error.
+
+``/simulator/stats/`` returns the number of requests made to each endpoint and
+of units processed, with the rates per hour since the server started.
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+import argparse
+import base64
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlsplit
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlsplit
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 62080
+
+PIPELINE_UUID = "88050c7f-36a3-4900-9294-5a0411d69303"
+TRANSFER_SOURCE_UUID = "2a3d8d39-9cee-495e-b7ee-5e629254934d"
+AIP_STORE_UUID = "d1184f7f-d755-4c8d-831a-a3793b88f760"
+
+WATCHED_DIRECTORY = (
+    "/var/archivematica/sharedDirectory/watchedDirectories/activeTransfers/"
+    "standardTransfer/"
+)
+
+# Settings of the simulation, see the command line options.
+DEFAULTS = {
+    "latency": 0.0,
+    "jitter": 0.0,
+    "failure_rate": 0.0,
+    "unit_failure_rate": 0.0,
+    "approval_delay": 1.0,
+    "transfer_duration": 5.0,
+    "ingest_duration": 5.0,
+    "entries": 100,
+    "levels": 1,
+    "files": 3,
+    "entry_size": 10**6,
+    "aips": 10,
+    "aip_size": 10**6,
+    "page_size": 20,
+    "seed": None,
+}
+
+# Endpoints, by method and pattern of their path.
+ROUTES = [
+    ("GET", r"/api/v2/location/(?P<uuid>[^/]+)/browse/", "browse"),
+    ("GET", r"/api/v2/location/(?P<uuid>[^/]+)/", "location"),
+    ("GET", r"/api/v2/location/", "locations"),
+    ("GET", r"/api/v2/pipeline/", "pipelines"),
+    ("GET", r"/api/v2/file/(?P<uuid>[^/]+)/download/", "download"),
+    ("POST", r"/api/v2/file/(?P<uuid>[^/]+)/reingest/", "reingest"),
+    ("GET", r"/api/v2/file/(?P<uuid>[^/]+)/?", "package"),
+    ("GET", r"/api/v2/file/", "packages"),
+    ("POST", r"/api/transfer/start_transfer/", "start_transfer"),
+    ("GET", r"/api/transfer/unapproved/?", "unapproved"),
+    ("POST", r"/api/transfer/approve/?", "approve"),
+    ("GET", r"/api/(?P<type>transfer|ingest)/status/(?P<uuid>[^/]+)/", "status"),
+    ("DELETE", r"/api/(?P<type>transfer|ingest)/(?P<uuid>[^/]+)/delete/", "delete"),
+    ("POST", r"/api/v2beta/package/", "create_package"),
+    ("GET", r"/api/v2beta/jobs/(?P<uuid>[^/]+)/", "jobs"),
+    ("POST", r"/mcp/execute/", "execute"),
+    ("GET", r"/api/processing-configuration/(?P<name>[^/]+)", "processing_config"),
+    ("POST", r"/sword/deposit/(?P<slug>[^/]+)", "deposit"),
+    ("GET", r"/simulator/stats/", "stats"),
+]
+ROUTES = [(method, re.compile(pattern + "$"), name) for method, pattern, name in ROUTES]
+
+PROCESSING_CONFIG = b"<processingMCP><preconfiguredChoices/></processingMCP>\n"
+
+
+class Response(object):
+    """Status, headers and body of a response. A body which is neither bytes
+    nor a string is sent as JSON.
+    """
+
+    def __init__(self, body=None, status=200, headers=None):
+        self.status = status
+        self.headers = dict(headers or {})
+        if isinstance(body, bytes):
+            self.body = body
+        elif isinstance(body, type("")):
+            self.body = body.encode("utf-8")
+        else:
+            self.body = json.dumps(body).encode("utf-8")
+            self.headers.setdefault("Content-Type", "application/json")
+        self.headers.setdefault("Content-Type", "text/plain")
+
+
+def _error(message, status=400, **fields):
+    fields.update(error=True, message=message)
+    return Response(fields, status=status)
+
+
+def _b64(value):
+    if not isinstance(value, bytes):
+        value = value.encode("utf-8")
+    return base64.b64encode(value).decode("ascii")
+
+
+class Transfer(object):
+    """A transfer and the ingest it becomes."""
+
+    def __init__(self, name, directory, transfer_type, created, sip_uuid=None):
+        self.uuid = str(uuid.uuid4())
+        self.sip_uuid = sip_uuid or str(uuid.uuid4())
+        self.name = name
+        self.directory = directory
+        self.type = transfer_type
+        self.created = created
+        self.approved = None
+        self.failed = False
+        self.stored = False
+
+
+class Simulator(object):
+    """State of the simulated services.
+
+    :param dict settings: Settings overriding ``DEFAULTS``.
+    :param clock: Function returning the current time in seconds.
+    """
+
+    def __init__(self, settings=None, clock=time.time):
+        self.settings = dict(DEFAULTS)
+        self.settings.update(settings or {})
+        self.clock = clock
+        self.random = random.Random(self.settings["seed"])
+        self.lock = threading.Lock()
+        self.started = clock()
+        self.transfers = {}
+        self.sips = {}
+        self.stored_packages = {}
+        self.requests = {}
+        self.counts = {
+            "transfers started": 0,
+            "reingests started": 0,
+            "aips stored": 0,
+            "aips downloaded": 0,
+            "deposits": 0,
+        }
+        self._listings = {}
+        for number in range(self.settings["aips"]):
+            self._store(str(uuid.uuid4()), "aip-{:06d}".format(number))
+
+    # Helpers
+
+    def _store(self, package_uuid, name):
+        self.stored_packages[package_uuid] = {
+            "uuid": package_uuid,
+            "package_type": "AIP",
+            "status": "UPLOADED",
+            "size": self.settings["aip_size"],
+            "current_full_path": "/var/archivematica/aips/{}-{}.7z".format(
+                name, package_uuid
+            ),
+            "current_location": "/api/v2/location/{}/".format(AIP_STORE_UUID),
+            "current_path": "{}-{}.7z".format(name, package_uuid),
+            "origin_pipeline": "/api/v2/pipeline/{}/".format(PIPELINE_UUID),
+            "resource_uri": "/api/v2/file/{}/".format(package_uuid),
+        }
+
+    def _add_transfer(self, name, transfer_type, sip_uuid=None, approved=False):
+        now = self.clock()
+        directory = name
+        taken = {
+            transfer.directory
+            for transfer in self.transfers.values()
+            if transfer.approved is None
+        }
+        suffix = 1
+        while directory in taken:
+            directory = "{}_{}".format(name, suffix)
+            suffix += 1
+        transfer = Transfer(name, directory, transfer_type, now, sip_uuid)
+        transfer.failed = self.random.random() < self.settings["unit_failure_rate"]
+        if approved:
+            transfer.approved = now
+        self.transfers[transfer.uuid] = transfer
+        self.sips[transfer.sip_uuid] = transfer
+        return transfer
+
+    def _visible(self, transfer, now):
+        return transfer.approved is not None or (
+            now - transfer.created >= self.settings["approval_delay"]
+        )
+
+    def _stages(self, transfer, now):
+        """Return the statuses of the transfer and of its ingest, None if the
+        ingest has not started.
+        """
+        if transfer.approved is None:
+            return "USER_INPUT", None
+        elapsed = now - transfer.approved
+        if elapsed < self.settings["transfer_duration"]:
+            return "PROCESSING", None
+        elapsed -= self.settings["transfer_duration"]
+        if elapsed < self.settings["ingest_duration"]:
+            return "COMPLETE", "PROCESSING"
+        if transfer.failed:
+            return "COMPLETE", "FAILED"
+        if not transfer.stored:
+            transfer.stored = True
+            self.counts["aips stored"] += 1
+            if transfer.sip_uuid not in self.stored_packages:
+                self._store(transfer.sip_uuid, transfer.name)
+        return "COMPLETE", "COMPLETE"
+
+    def _store_completed(self, now):
+        for transfer in list(self.transfers.values()):
+            if not transfer.stored and transfer.approved is not None:
+                self._stages(transfer, now)
+
+    def _listing(self, level):
+        """Return the JSON of the listing of a directory at ``level``, the
+        same for all the directories of a level.
+        """
+        listing = self._listings.get(level)
+        if listing is not None:
+            return listing
+        levels, entries = self.settings["levels"], self.settings["entries"]
+        if level < levels:
+            names = ["dir-{:06d}".format(number) for number in range(entries)]
+            size = self.settings["entry_size"] * entries ** (levels - level - 1)
+            directories = names
+        else:
+            names = ["file-{:03d}.txt".format(n) for n in range(self.settings["files"])]
+            size = self.settings["entry_size"] // max(self.settings["files"], 1)
+            directories = []
+        encoded = [_b64(name) for name in names]
+        listing = json.dumps(
+            {
+                "entries": encoded,
+                "directories": [_b64(name) for name in directories],
+                "properties": {name: {"size": size} for name in encoded},
+            }
+        ).encode("utf-8")
+        self._listings[level] = listing
+        return listing
+
+    def _level(self, path):
+        """Return the level of the directory ``path`` of the synthetic tree,
+        or None if it is not one of its directories.
+        """
+        parts = [part for part in path.split("/") if part]
+        if len(parts) > self.settings["levels"]:
+            return None
+        for part in parts:
+            match = re.match(r"dir-(\d{6})$", part)
+            if not match or int(match.group(1)) >= self.settings["entries"]:
+                return None
+        return len(parts)
+
+    def _location(self, location_uuid):
+        purpose = "TS" if location_uuid == TRANSFER_SOURCE_UUID else "AS"
+        return {
+            "uuid": location_uuid,
+            "purpose": purpose,
+            "path": "/home" if purpose == "TS" else "/var/archivematica/aips",
+            "relative_path": "home" if purpose == "TS" else "aips",
+            "description": "Simulated location",
+            "enabled": True,
+            "pipeline": ["/api/v2/pipeline/{}/".format(PIPELINE_UUID)],
+            "resource_uri": "/api/v2/location/{}/".format(location_uuid),
+        }
+
+    # Storage Service
+
+    def browse(self, match, params):
+        try:
+            path = base64.b64decode(params.get("path", "")).decode("utf-8")
+        except (TypeError, ValueError):
+            return _error("Invalid path")
+        level = self._level(path)
+        if level is None:
+            return _error("Path does not exist", status=404)
+        return Response(
+            self._listing(level), headers={"Content-Type": "application/json"}
+        )
+
+    def location(self, match, params):
+        return Response(self._location(match.group("uuid")))
+
+    def locations(self, match, params):
+        objects = [self._location(TRANSFER_SOURCE_UUID), self._location(AIP_STORE_UUID)]
+        return Response({"meta": {"next": None, "total_count": 2}, "objects": objects})
+
+    def pipelines(self, match, params):
+        return Response(
+            {
+                "meta": {"next": None, "total_count": 1},
+                "objects": [
+                    {
+                        "uuid": PIPELINE_UUID,
+                        "description": "Simulated pipeline",
+                        "resource_uri": "/api/v2/pipeline/{}/".format(PIPELINE_UUID),
+                    }
+                ],
+            }
+        )
+
+    def packages(self, match, params):
+        self._store_completed(self.clock())
+        packages = sorted(
+            self.stored_packages.values(), key=lambda package: package["uuid"]
+        )
+        if params.get("package_type"):
+            packages = [
+                package
+                for package in packages
+                if package["package_type"] == params["package_type"]
+            ]
+        if params.get("status__in"):
+            statuses = params["status__in"].split(",")
+            packages = [
+                package for package in packages if package["status"] in statuses
+            ]
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or self.settings["page_size"])
+        next_page = None
+        if offset + limit < len(packages):
+            query = dict(params, offset=offset + limit, limit=limit)
+            next_page = "/api/v2/file/?" + "&".join(
+                "{}={}".format(key, value) for key, value in sorted(query.items())
+            )
+        return Response(
+            {
+                "meta": {
+                    "limit": limit,
+                    "offset": offset,
+                    "next": next_page,
+                    "total_count": len(packages),
+                },
+                "objects": packages[offset : offset + limit],
+            }
+        )
+
+    def package(self, match, params):
+        package = self.stored_packages.get(match.group("uuid"))
+        if package is None:
+            transfer = self.sips.get(match.group("uuid"))
+            if transfer is not None:
+                self._stages(transfer, self.clock())
+                package = self.stored_packages.get(match.group("uuid"))
+        if package is None:
+            return _error("Package not found", status=404)
+        return Response(package)
+
+    def download(self, match, params):
+        package = self.stored_packages.get(match.group("uuid"))
+        if package is None:
+            return _error("Package not found", status=404)
+        self.counts["aips downloaded"] += 1
+        return Response(
+            b"\0" * self.settings["aip_size"],
+            headers={
+                "Content-Type": "application/x-7z-compressed",
+                "Content-Disposition": 'attachment; filename="{}"'.format(
+                    package["current_path"]
+                ),
+            },
+        )
+
+    def reingest(self, match, params):
+        package = self.stored_packages.get(match.group("uuid"))
+        if package is None:
+            return _error("Package not found", status=404)
+        if params.get("pipeline") != PIPELINE_UUID:
+            return _error("Pipeline not found", status=404)
+        name = package["current_path"].rsplit("-", 5)[0]
+        transfer = self._add_transfer(name, "standard", sip_uuid=package["uuid"])
+        self.counts["reingests started"] += 1
+        return Response(
+            {
+                "error": False,
+                "message": "Package {} set up for reingest.".format(package["uuid"]),
+                "reingest_uuid": transfer.uuid,
+            }
+        )
+
+    # Archivematica
+
+    def start_transfer(self, match, params):
+        if not params.get("name") or not params.get("paths[]"):
+            return _error("Missing name or paths")
+        transfer = self._add_transfer(params["name"], params.get("type", "standard"))
+        self.counts["transfers started"] += 1
+        return Response(
+            {
+                "message": "Copy successful.",
+                "path": WATCHED_DIRECTORY + transfer.directory + "/",
+            }
+        )
+
+    def create_package(self, match, params):
+        if not params.get("name") or not params.get("path"):
+            return _error("Missing name or path")
+        transfer = self._add_transfer(
+            params["name"], params.get("type", "standard"), approved=True
+        )
+        self.counts["transfers started"] += 1
+        return Response({"id": transfer.uuid}, status=202)
+
+    def unapproved(self, match, params):
+        now = self.clock()
+        results = [
+            {
+                "type": transfer.type,
+                "directory": transfer.directory,
+                "uuid": transfer.uuid,
+            }
+            for transfer in self.transfers.values()
+            if transfer.approved is None and self._visible(transfer, now)
+        ]
+        return Response(
+            {
+                "message": "Fetched unapproved transfers successfully.",
+                "results": results,
+            }
+        )
+
+    def approve(self, match, params):
+        now = self.clock()
+        for transfer in self.transfers.values():
+            if (
+                transfer.approved is None
+                and transfer.directory == params.get("directory")
+                and self._visible(transfer, now)
+            ):
+                transfer.approved = now
+                return Response(
+                    {"message": "Approval successful.", "uuid": transfer.uuid}
+                )
+        return _error("Unable to find unapproved transfer directory.", status=500)
+
+    def status(self, match, params):
+        unit_type, unit_uuid = match.group("type"), match.group("uuid")
+        now = self.clock()
+        transfer = (self.transfers if unit_type == "transfer" else self.sips).get(
+            unit_uuid
+        )
+        if transfer is not None:
+            transfer_status, ingest_status = self._stages(transfer, now)
+            if unit_type == "transfer" and self._visible(transfer, now):
+                status = {
+                    "status": transfer_status,
+                    "name": transfer.name,
+                    "directory": transfer.directory,
+                    "microservice": (
+                        "Approve standard transfer"
+                        if transfer_status == "USER_INPUT"
+                        else "Simulated microservice"
+                    ),
+                }
+                if transfer_status == "COMPLETE":
+                    status["sip_uuid"] = transfer.sip_uuid
+                return Response(
+                    dict(
+                        status,
+                        type="transfer",
+                        uuid=unit_uuid,
+                        path=WATCHED_DIRECTORY + transfer.directory + "/",
+                        message="Fetched status for {} successfully.".format(unit_uuid),
+                    )
+                )
+            if unit_type == "ingest" and ingest_status:
+                return Response(
+                    {
+                        "status": ingest_status,
+                        "name": transfer.name,
+                        "directory": "{}-{}".format(transfer.name, unit_uuid),
+                        "microservice": "Simulated microservice",
+                        "type": "SIP",
+                        "uuid": unit_uuid,
+                        "path": "/var/archivematica/sharedDirectory/"
+                        "currentlyProcessing/{}-{}/".format(transfer.name, unit_uuid),
+                        "message": "Fetched status for {} successfully.".format(
+                            unit_uuid
+                        ),
+                    }
+                )
+        return _error(
+            "Cannot fetch unit{} with UUID {}".format(
+                "Transfer" if unit_type == "transfer" else "SIP", unit_uuid
+            ),
+            type=unit_type,
+        )
+
+    def delete(self, match, params):
+        return Response({"removed": match.group("uuid")})
+
+    def jobs(self, match, params):
+        return Response([])
+
+    def execute(self, match, params):
+        return Response("")
+
+    def processing_config(self, match, params):
+        return Response(PROCESSING_CONFIG, headers={"Content-Type": "text/xml"})
+
+    # AtoM
+
+    def deposit(self, match, params):
+        self.counts["deposits"] += 1
+        return Response(
+            "",
+            status=302,
+            headers={"Location": "/sword/statement/{}".format(match.group("slug"))},
+        )
+
+    # Simulator
+
+    def stats(self, match, params):
+        now = self.clock()
+        self._store_completed(now)
+        hours = max(now - self.started, 1e-6) / 3600
+        return Response(
+            {
+                "uptime": now - self.started,
+                "requests": self.requests,
+                "counts": self.counts,
+                "per_hour": {
+                    name: count / hours for name, count in self.counts.items()
+                },
+            }
+        )
+
+    def handle(self, method, path, params):
+        """Answer a request.
+
+        :param dict params: Parameters of the query string and body.
+        :returns: Response.
+        """
+        for route_method, pattern, name in ROUTES:
+            match = pattern.match(path)
+            if route_method == method and match:
+                break
+        else:
+            return _error("Not found: {} {}".format(method, path), status=404)
+        with self.lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+            failed = (
+                name != "stats" and self.random.random() < self.settings["failure_rate"]
+            )
+            delay = self.settings["latency"] + self.random.uniform(
+                0, self.settings["jitter"]
+            )
+        if name != "stats" and delay:
+            time.sleep(delay)
+        if failed:
+            return _error("Simulated failure", status=500)
+        with self.lock:
+            try:
+                return getattr(self, name)(match, params)
+            except Exception as err:  # Answer rather than drop the connection.
+                return _error("Simulator error: {!r}".format(err), status=500)
+
+
+def _parse_params(query, body):
+    params = {}
+    for key, values in parse_qs(query, keep_blank_values=True).items():
+        params[key] = values if key.endswith("[]") else values[-1]
+    if body:
+        body = body.decode("utf-8")
+        if body.lstrip().startswith("{"):
+            params.update(json.loads(body))
+        else:
+            for key, values in parse_qs(body, keep_blank_values=True).items():
+                params[key] = values if key.endswith("[]") else values[-1]
+    return params
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Pass the requests to the simulator of the server."""
+
+    protocol_version = "HTTP/1.1"
+
+    def _handle(self):
+        parts = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        try:
+            params = _parse_params(parts.query, body)
+        except ValueError:
+            response = _error("Invalid parameters")
+        else:
+            response = self.server.simulator.handle(self.command, parts.path, params)
+        self.send_response(response.status)
+        for name, value in response.headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(response.body)))
+        self.end_headers()
+        self.wfile.write(response.body)
+
+    do_GET = do_POST = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # Accept the bursts of connections of concurrent clients.
+    request_queue_size = 128
+
+    def __init__(self, simulator, address, verbose=False):
+        HTTPServer.__init__(self, address, Handler)
+        self.simulator = simulator
+        self.verbose = verbose
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.server_address[:2])
+
+
+def serve_in_thread(settings=None, host=DEFAULT_HOST, port=0):
+    """Start a simulator in a background thread, on a free port by default.
+
+    :returns: Server, whose ``url`` is that of the simulated services. Stop it
+              with ``shutdown`` and ``server_close``.
+    """
+    server = Server(Simulator(settings), (host, port))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main(host=DEFAULT_HOST, port=DEFAULT_PORT, verbose=False, **settings):
+    server = Server(Simulator(settings), (host, port), verbose=verbose)
+    print("Simulating Archivematica and the Storage Service at {}".format(server.url))
+    print("Transfer source location: {}".format(TRANSFER_SOURCE_UUID))
+    print("Pipeline: {}".format(PIPELINE_UUID))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Default: %(default)s")
+    parser.add_argument(
+        "--port", type=int, default=DEFAULT_PORT, help="Default: %(default)s"
+    )
+    parser.add_argument(
+        "--verbose", "-v", action="store_true", help="Log each request."
+    )
+    for name, default in sorted(DEFAULTS.items()):
+        parser.add_argument(
+            "--" + name.replace("_", "-"),
+            type=int if isinstance(default, int) or name == "seed" else float,
+            default=default,
+            help="Default: %(default)s",
+        )
+    args = parser.parse_args()
+
+    sys.exit(main(**vars(args)))
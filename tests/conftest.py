@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from transfers import models
+
+
+@pytest.fixture
+def setup_session():
+    """Initialize an in-memory database and session, removed afterwards."""
+    models.init_session(":memory:")
+    yield
+    models.cleanup_session()
+    models.Session = models.transfer_session = None
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import datetime
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from transfers import archive, config, models
+
+
+@pytest.fixture
+def database(tmpdir):
+    path = str(tmpdir.join("transfers.db"))
+    models.init_session(path)
+    yield path
+    models.cleanup_session()
+    models.Session = models.transfer_session = None
+
+
+def _add_units(days_ago):
+    finished = datetime.datetime.utcnow() - datetime.timedelta(days=days_ago)
+    done = models.add_new_transfer(uuid=str(uuid4()), path=b"done")
+    models.update_unit_status(done, "COMPLETE")
+    models.update_unit_current(done, False)
+    done.finished = finished
+    models.transfer_failed_to_start(b"failed")
+    failed = models.transfer_session.query(models.Unit).filter_by(path=b"failed").one()
+    failed.finished = finished
+    models.add_new_transfer(uuid=str(uuid4()), path=b"current")
+    models.transfer_session.commit()
+    return done
+
+
+def test_archive_units(database):
+    done = _add_units(days_ago=60)
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=30)
+    assert models.archive_units(cutoff, batch_size=1) == 2
+    # Only the current unit is left to go through on each run.
+    assert models.get_processed_transfer_paths() == {b"current"}
+    assert models.get_archived_paths([b"done", b"failed", b"new"]) == {
+        b"done",
+        b"failed",
+    }
+    archived = models.transfer_session.query(models.ArchivedUnit).all()
+    assert {unit.uuid for unit in archived} == {done.uuid, ""}
+    models.compact()
+
+
+def test_held_units_kept(database):
+    """Test that held and rejected units are not archived, so that a held
+    transfer source can still be released afterwards.
+    """
+    _add_units(days_ago=60)
+    held = models.transfer_held(b"held")
+    rejected = models.transfer_rejected(b"rejected")
+    held.finished = rejected.finished = datetime.datetime(2000, 1, 1)
+    models.transfer_session.commit()
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=30)
+    assert models.archive_units(cutoff) == 2
+    assert models.get_processed_transfer_paths() == {b"current", b"held", b"rejected"}
+    assert models.get_archived_paths([b"held", b"rejected"]) == set()
+    assert models.release_held(b"held")
+    assert models.get_processed_transfer_paths() == {b"current", b"rejected"}
+
+
+def test_recent_units_kept(database):
+    _add_units(days_ago=10)
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=30)
+    assert models.archive_units(cutoff) == 0
+    assert models.get_processed_transfer_paths() == {b"current", b"done", b"failed"}
+
+
+def test_archive_to_other_database(database, tmpdir):
+    _add_units(days_ago=60)
+    archive_path = str(tmpdir.join("archive.db"))
+    settings = tmpdir.join("transfers.conf")
+    settings.write(
+        "[transfers]\n"
+        "databasefile = {}\n"
+        "pidfile = {}\n"
+        "logfile = {}\n".format(
+            database, tmpdir.join("pid.lck"), tmpdir.join("transfers.log")
+        )
+    )
+    try:
+        assert (
+            archive.main(
+                str(settings), max_age=30, archive_url="sqlite:///" + archive_path
+            )
+            == 0
+        )
+    finally:
+        config._CONFIGS.clear()
+    models.init_session(database)
+    assert models.get_processed_transfer_paths() == {b"current"}
+    engine = create_engine("sqlite:///" + archive_path)
+    with engine.connect() as connection:
+        paths = connection.execute(text("SELECT path FROM unit_archive")).fetchall()
+    engine.dispose()
+    assert sorted(path for (path,) in paths) == [b"done", b"failed"]
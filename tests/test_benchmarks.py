@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import argparse
+import io
+import json
+
+from benchmarks import client, discovery, runner
+
+
+def _args(*args):
+    parser = argparse.ArgumentParser()
+    runner.add_arguments(parser)
+    return parser.parse_args(list(args))
+
+
+def test_discovery():
+    assert discovery.breadth(1000, 3) == 10
+    assert discovery.breadth(1001, 2) == 32
+    assert discovery.processed_paths(3, 2, 4) == {
+        b"dir-000000/dir-000000",
+        b"dir-000000/dir-000001",
+        b"dir-000000/dir-000002",
+        b"dir-000001/dir-000000",
+    }
+    results = discovery.run((9,), (1, 2), (0.5,), repeat=1, memory=False)
+    calls = {name: result["calls"] for name, result in results.items()}
+    assert calls == {
+        "get_next_transfer[entries=9,depth=1,processed=50%]": 1,
+        "start_transfer selection[entries=9,depth=1,processed=50%]": 1,
+        # The first directory holds only processed entries.
+        "get_next_transfer[entries=9,depth=2,processed=50%]": 3,
+        "start_transfer selection[entries=9,depth=2,processed=50%]": 3,
+    }
+
+
+def test_client():
+    results = client.run(number=2, repeat=2, memory=False)
+    calls = {name: result["calls"] for name, result in results.items()}
+    assert calls == {
+        "get_status[transfer]": 1,
+        "get_status[ingest]": 1,
+        "get_status[transfer to ingest]": 2,
+        "get_next_transfer[first run]": 1,
+        "get_next_transfer[existing set]": 1,
+        "approve_transfer": 2,
+        "call_start_transfer_endpoint": 1,
+    }
+
+
+def test_compare(tmpdir):
+    baseline = {
+        "a": {"wall": 0.1, "calls": 2, "peak": 1000},
+        "b": {"wall": 0.1, "calls": 2, "peak": None},
+    }
+    results = {
+        "a": {"wall": 0.2, "calls": 3, "peak": 2000},
+        "b": {"wall": 0.11, "calls": 2, "peak": 1000},
+        "c": {"wall": 1, "calls": 1, "peak": None},
+    }
+    assert runner.compare(results, baseline) == [
+        "a: 200.00 ms instead of 100.00 ms",
+        "a: 3 HTTP calls instead of 2",
+        "a: 2.0 KiB peak memory instead of 1000.0 B",
+    ]
+    baseline_file = tmpdir.join("baseline.json")
+    baseline_file.write(json.dumps(baseline))
+    out = io.StringIO()
+    assert runner.report(results, _args("--compare", str(baseline_file)), out) == 1
+    assert runner.report(baseline, _args("--compare", str(baseline_file)), out) == 0
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import pytest
+import requests
+
+from transfers import circuitbreaker, errors, models, utils
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+AM_URL = "http://127.0.0.1:62080"
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(autouse=True)
+def reset_breakers():
+    circuitbreaker.reset()
+    yield
+    circuitbreaker.reset()
+
+
+def test_states():
+    clock = Clock()
+    breaker = circuitbreaker.CircuitBreaker(
+        AM_URL, failure_threshold=2, reset_timeout=60, clock=clock
+    )
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == circuitbreaker.OPEN
+    assert not breaker.allow()
+    clock.now += 60
+    assert breaker.available()
+    # A single probe is let through once the timeout has passed.
+    assert breaker.allow()
+    assert breaker.state == circuitbreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == circuitbreaker.OPEN
+    assert not breaker.available()
+    clock.now += 60
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == circuitbreaker.CLOSED
+    assert breaker.failures == 0
+
+
+def test_endpoint():
+    assert circuitbreaker.endpoint(AM_URL + "/api/transfer/") == AM_URL
+    assert circuitbreaker.get_breaker(AM_URL + "/a/") is circuitbreaker.get_breaker(
+        AM_URL + "/b/?c=d"
+    )
+
+
+@mock.patch("requests.request")
+def test_fail_fast(mock_request):
+    """Test that calls to a server that cannot be reached are no longer made
+    once the threshold is reached.
+    """
+    circuitbreaker.configure(failure_threshold=2)
+    mock_request.side_effect = requests.exceptions.ConnectionError()
+    url = AM_URL + "/api/transfer/status/"
+    for _ in range(3):
+        assert utils._call_url_json(url) == errors.ERR_SERVER_CONN
+    assert mock_request.call_count == 2
+    # Calls to another server are still made.
+    utils._call_url_json("http://127.0.0.1:62081/api/v2/location/")
+    assert mock_request.call_count == 3
+
+
+def test_state_kept_between_runs(setup_session):
+    breaker = circuitbreaker.get_breaker(AM_URL)
+    for _ in range(circuitbreaker.DEFAULT_FAILURE_THRESHOLD):
+        breaker.record_failure()
+    opened_at = breaker.opened_at
+    circuitbreaker.save(models.transfer_session)
+
+    circuitbreaker.reset()
+    circuitbreaker.load(models.transfer_session)
+    breaker = circuitbreaker.get_breaker(AM_URL)
+    assert breaker.state == circuitbreaker.OPEN
+    assert breaker.opened_at == opened_at
+    assert not breaker.available()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from uuid import uuid4
+
+import pytest
+import requests
+
+from transfers import circuitbreaker, cleanup, defaults, models
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+AM_URL = "http://127.0.0.1"
+USER = "demo"
+API_KEY = "1c34274c0df0bca7edf9831dd838b4a6345ac2ef"
+
+
+@pytest.fixture(autouse=True)
+def breakers():
+    circuitbreaker.reset()
+    yield
+    circuitbreaker.reset()
+
+
+def _response(status_code):
+    return mock.Mock(ok=status_code < 400, status_code=status_code, reason="")
+
+
+def test_hide_units(setup_session):
+    """Test that every queued unit is hidden with its own request and that
+    failures are recorded to be retried.
+    """
+    ok, gone, failed = str(uuid4()), str(uuid4()), str(uuid4())
+    models.queue_hide(uuid=ok, unit_type="transfer")
+    models.queue_hide(uuid=gone, unit_type="ingest")
+    models.queue_hide(uuid=failed, unit_type="ingest")
+    responses = {ok: _response(200), gone: _response(404), failed: _response(500)}
+
+    def delete(url, params, timeout):
+        assert params == {"username": USER, "api_key": API_KEY}
+        assert timeout == defaults.REQUEST_TIMEOUT
+        return responses[url.split("/")[-3]]
+
+    with mock.patch("requests.Session.delete", side_effect=delete) as mock_delete:
+        assert cleanup.hide_units(AM_URL, USER, API_KEY, workers=2) == 1
+    urls = sorted(call[0][0] for call in mock_delete.call_args_list)
+    assert urls == sorted(
+        [
+            "{}/api/transfer/{}/delete/".format(AM_URL, ok),
+            "{}/api/ingest/{}/delete/".format(AM_URL, gone),
+            "{}/api/ingest/{}/delete/".format(AM_URL, failed),
+        ]
+    )
+    assert [hide.uuid for hide in models.get_pending_hides(3)] == [failed]
+
+
+def test_hide_units_nothing_queued(setup_session):
+    with mock.patch("requests.Session.delete") as mock_delete:
+        assert cleanup.hide_units(AM_URL, USER, API_KEY) == 0
+    assert not mock_delete.called
+
+
+def test_hide_units_unavailable(setup_session):
+    """Test that the units stay queued, without counting an attempt, while
+    the dashboard is unavailable.
+    """
+    uuids = [str(uuid4()) for _ in range(4)]
+    for uuid in uuids:
+        models.queue_hide(uuid=uuid, unit_type="ingest")
+    with mock.patch(
+        "requests.Session.delete",
+        side_effect=requests.exceptions.ConnectTimeout("timed out"),
+    ) as mock_delete:
+        assert cleanup.hide_units(AM_URL, USER, API_KEY, workers=1) == 4
+    # The breaker opens after three failures, leaving the last unit alone.
+    assert mock_delete.call_count == circuitbreaker.DEFAULT_FAILURE_THRESHOLD
+    assert not circuitbreaker.get_breaker(AM_URL).available()
+    attempts = {hide.uuid: hide.attempts for hide in models.get_pending_hides(3)}
+    assert attempts == {uuids[0]: 1, uuids[1]: 1, uuids[2]: 1, uuids[3]: 0}
+    with mock.patch("requests.Session.delete") as mock_delete:
+        assert cleanup.hide_units(AM_URL, USER, API_KEY) == 4
+    assert not mock_delete.called
+    assert len(models.get_pending_hides(3)) == 4
+
+
+def test_sweep(setup_session):
+    """Test that completed SIPs that were never hidden are queued once."""
+    hidden, unhidden = str(uuid4()), str(uuid4())
+    for uuid, path in ((hidden, b"/foo"), (unhidden, b"/bar")):
+        models._update_unit(
+            uuid=uuid, path=path, unit_type="ingest", status="COMPLETE", current=False
+        )
+    models._update_unit(
+        uuid=str(uuid4()),
+        path=b"/baz",
+        unit_type="ingest",
+        status="PROCESSING",
+        current=True,
+    )
+    models.queue_hide(uuid=hidden, unit_type="ingest")
+    assert cleanup.sweep() == 1
+    assert cleanup.sweep() == 0
+    assert {hide.uuid for hide in models.get_pending_hides(3)} == {hidden, unhidden}
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import pytest
+
+from transfers import config
+from transfers.transfer import get_setting
+
+
+@pytest.fixture
+def config_file(tmpdir):
+    path = tmpdir.join("transfers.conf")
+    path.write(
+        "[transfers]\n"
+        "databasefile = /tmp/transfers.db\n"
+        "busytimeout = 500\n"
+        "hide = yes\n"
+        "journalmode = WAL\n"
+    )
+    yield str(path)
+    config._CONFIGS.clear()
+
+
+def test_settings(config_file):
+    conf = config.Config(config_file)
+    assert conf.get("journalmode") == "WAL"
+    assert conf.get("missing", "default") == "default"
+    assert conf.getint("busytimeout") == 500
+    assert conf.getint("missing", 3) == 3
+    assert conf.getboolean("hide") is True
+    assert conf.getboolean("missing") is False
+    assert conf.database_options() == {
+        "databasefile": "/tmp/transfers.db",
+        "database_url": None,
+        "journal_mode": "WAL",
+        "synchronous": None,
+        "busy_timeout": 500,
+    }
+
+
+def test_no_config_file():
+    conf = config.Config()
+    assert conf.get("pidfile", "pid.lck") == "pid.lck"
+    assert "busy_timeout" not in conf.database_options()
+
+
+def test_args_take_precedence(config_file):
+    conf = config.Config(
+        config_file, args={"journalmode": "DELETE", "hide": False, "pidfile": None}
+    )
+    assert conf.get("journalmode") == "DELETE"
+    # Options not given on the command line come from the file.
+    assert conf.getboolean("hide") is True
+    assert conf.get("pidfile") is None
+
+
+def test_file_read_once(config_file):
+    """Test that the file is parsed once however many settings are read."""
+    assert get_setting(config_file, "journalmode") == "WAL"
+    with open(config_file, "a") as f:
+        f.write("synchronous = NORMAL\n")
+    assert get_setting(config_file, "synchronous") is None
+    assert config.get_config(config_file) is config.get_config(config_file)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+from uuid import uuid4
+
+import pytest
+
+from transfers import circuitbreaker, decisions, errors, models
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+AM_URL = "http://127.0.0.1"
+APPROVE = "ea65e6a4-23ae-4cc5-9d57-08c8a0e3a17f"
+REJECT = "d0bf0ac8-0cbc-4327-8154-2b0b5d54a8d0"
+
+
+@pytest.fixture(autouse=True)
+def breakers():
+    circuitbreaker.reset()
+    yield
+    circuitbreaker.reset()
+
+
+@pytest.fixture
+def rules(tmpdir):
+    path = tmpdir.join("rules.json")
+    path.write(
+        json.dumps(
+            [
+                {
+                    "microservice": "Approve normalization",
+                    "choice": REJECT,
+                    "unit_type": "SIP",
+                    "path": "/var/archivematica/*/restricted-*",
+                },
+                {"microservice": "Approve *", "choice": APPROVE},
+            ]
+        )
+    )
+    return decisions.load_rules(str(path))
+
+
+def _unit_info(microservice, unit_type="SIP", path="/var/archivematica/sips/x"):
+    return {
+        "uuid": str(uuid4()),
+        "type": unit_type,
+        "microservice": microservice,
+        "path": path,
+        "name": "x",
+    }
+
+
+def test_match(rules):
+    restricted = _unit_info(
+        "Approve normalization", path="/var/archivematica/sips/restricted-1"
+    )
+    assert decisions.match(rules, restricted) is rules[0]
+    transfer = _unit_info("Approve normalization", unit_type="transfer")
+    assert decisions.match(rules, transfer) is rules[1]
+    assert decisions.match(rules, _unit_info("Approve standard transfer")) is rules[1]
+    assert decisions.match(rules, _unit_info("Store AIP location")) is None
+
+
+def test_invalid_rules(tmpdir):
+    path = tmpdir.join("rules.json")
+    path.write(json.dumps([{"microservice": "Approve *"}]))
+    with pytest.raises(ValueError):
+        decisions.load_rules(str(path))
+
+
+def _response(status_code=200, text="", content_type="text/plain"):
+    return mock.Mock(
+        status_code=status_code,
+        reason="OK" if status_code == 200 else "Found",
+        text=text,
+        headers={"content-type": content_type},
+    )
+
+
+@mock.patch("transfers.decisions.time.sleep")
+@mock.patch("requests.post")
+@mock.patch("transfers.utils._call_url_json")
+def test_resolve(mock_call, mock_post, mock_sleep, setup_session, rules):
+    """Test that the choice of the matching rule is made for the job waiting
+    on user input and recorded once the job has moved on.
+    """
+    job_uuid = str(uuid4())
+    mock_call.side_effect = [
+        [
+            {"uuid": str(uuid4()), "status": "COMPLETE"},
+            {"uuid": job_uuid, "status": "USER_INPUT"},
+        ],
+        [{"uuid": job_uuid, "status": "USER_INPUT"}],
+        [{"uuid": job_uuid, "status": "COMPLETE"}],
+    ]
+    mock_post.return_value = _response()
+    info = _unit_info("Approve standard transfer", unit_type="transfer")
+    assert decisions.resolve(rules, AM_URL, "demo", "key", info)
+    assert mock_post.call_args[0][0] == AM_URL + "/mcp/execute/"
+    assert mock_post.call_args[1]["data"]["uuid"] == job_uuid
+    assert mock_post.call_args[1]["data"]["choice"] == APPROVE
+    assert mock_post.call_args[1]["allow_redirects"] is False
+    assert mock_call.call_count == 3
+    (decision,) = models.get_decisions(info["uuid"])
+    assert decision.status == models.DECISION_APPLIED
+    assert decision.job_uuid == job_uuid
+    assert decision.rule == 1
+
+
+@pytest.mark.parametrize(
+    "response, message",
+    [
+        (_response(302), "302 Found"),
+        (
+            _response(
+                text="<html><form>Log in</form></html>", content_type="text/html"
+            ),
+            "Unexpected HTML response, the dashboard may require a login",
+        ),
+    ],
+)
+@mock.patch("requests.post")
+@mock.patch("transfers.utils._call_url_json")
+def test_resolve_failed(mock_call, mock_post, setup_session, rules, response, message):
+    """Test that a choice the dashboard does not accept is recorded and the
+    prompt left to the user input scripts.
+    """
+    mock_call.return_value = [{"uuid": str(uuid4()), "status": "USER_INPUT"}]
+    mock_post.return_value = response
+    info = _unit_info("Approve normalization")
+    assert not decisions.resolve(rules, AM_URL, "demo", "key", info)
+    assert mock_call.call_count == 1
+    (decision,) = models.get_decisions(info["uuid"])
+    assert decision.status == models.DECISION_FAILED
+    assert decision.message == message
+
+
+@mock.patch("transfers.decisions.time.sleep")
+@mock.patch("requests.post")
+@mock.patch("transfers.utils._call_url_json")
+def test_resolve_still_waiting(mock_call, mock_post, mock_sleep, setup_session, rules):
+    """Test that a choice is recorded as failed when the job is still awaiting
+    a decision, or its jobs cannot be listed, afterwards.
+    """
+    job_uuid = str(uuid4())
+    waiting = [{"uuid": job_uuid, "status": "USER_INPUT"}]
+    mock_call.side_effect = [waiting, waiting, errors.ERR_INVALID_RESPONSE, waiting]
+    mock_post.return_value = _response()
+    info = _unit_info("Approve normalization")
+    assert not decisions.resolve(rules, AM_URL, "demo", "key", info)
+    assert mock_call.call_count == 1 + decisions.VERIFY_ATTEMPTS
+    (decision,) = models.get_decisions(info["uuid"])
+    assert decision.status == models.DECISION_FAILED
+    assert decision.message == "Job {} still awaiting a decision".format(job_uuid)
+
+
+@mock.patch("transfers.utils._call_url_json")
+def test_unmatched_prompt(mock_call, setup_session, rules):
+    info = _unit_info("Store AIP location")
+    assert not decisions.resolve(rules, AM_URL, "demo", "key", info)
+    assert mock_call.call_count == 0
+    assert models.get_decisions(info["uuid"]) == []
+
+
+@mock.patch("transfers.utils._call_url_json")
+def test_choice_already_made(mock_call, setup_session, rules):
+    """Test that a prompt whose choice was made on an earlier run is not
+    escalated while the status of the unit catches up.
+    """
+    info = _unit_info("Approve standard transfer", unit_type="transfer")
+    models.record_decision(
+        uuid=info["uuid"],
+        unit_type="transfer",
+        microservice=info["microservice"],
+        choice=APPROVE,
+        rule=1,
+        status=models.DECISION_APPLIED,
+        job_uuid=str(uuid4()),
+    )
+    mock_call.return_value = [{"uuid": str(uuid4()), "status": "COMPLETE"}]
+    assert decisions.resolve(rules, AM_URL, "demo", "key", info)
+    assert len(models.get_decisions(info["uuid"])) == 1
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+
+from transfers import deletion, models
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+def _make_tree(root):
+    """Create a small transfer-like tree with nested directories."""
+    root = root.decode()
+    for sub in ("objects/a/b", "objects/c", "metadata"):
+        os.makedirs(os.path.join(root, sub))
+    for name in ("objects/a/b/one.txt", "objects/c/two.txt", "metadata/three.txt"):
+        with open(os.path.join(root, name), "w") as f:
+            f.write(name)
+    os.symlink(os.path.join(root, "metadata"), os.path.join(root, "objects/link"))
+
+
+def test_rmtree_parallel(tmpdir):
+    """Test that a nested tree, including symlinks, is deleted."""
+    root = str(tmpdir.join("transfer")).encode()
+    _make_tree(root)
+    deletion.rmtree_parallel(root, workers=3)
+    assert not os.path.exists(root)
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_schedule_moves_to_trash(tmpdir, setup_session):
+    """Test that the source path disappears as soon as it is scheduled and
+    that the worker deletes it from the trash.
+    """
+    root = str(tmpdir.join("transfer")).encode()
+    trash_dir = str(tmpdir.join("trash"))
+    _make_tree(root)
+    queued = deletion.schedule_deletion(root, trash_dir=trash_dir)
+    assert not os.path.exists(root)
+    assert queued.path == root
+    assert os.path.isdir(queued.trash_path)
+    assert queued.status == models.DELETION_PENDING
+    assert deletion.process_queue(trash_dir=trash_dir) == 0
+    assert queued.status == models.DELETION_COMPLETE
+    assert os.listdir(trash_dir) == []
+
+
+def test_schedule_without_trash(tmpdir, setup_session):
+    """Test that the files are deleted in place without a trash directory."""
+    root = str(tmpdir.join("transfer")).encode()
+    _make_tree(root)
+    queued = deletion.schedule_deletion(root)
+    assert os.path.exists(root)
+    assert queued.trash_path is None
+    assert deletion.process_queue() == 0
+    assert not os.path.exists(root)
+
+
+def test_failed_deletion_is_retried(tmpdir, setup_session):
+    """Test that failed deletions are retried until they run out of attempts
+    and are then reported.
+    """
+    root = str(tmpdir.join("transfer")).encode()
+    _make_tree(root)
+    queued = deletion.schedule_deletion(root)
+    error = OSError(13, "Permission denied")
+    with mock.patch("transfers.deletion.rmtree_parallel", side_effect=error):
+        assert deletion.process_queue(max_attempts=2) == 1
+        assert queued.status == models.DELETION_FAILED
+        assert models.get_pending_deletions(2) == [queued]
+        assert deletion.process_queue(max_attempts=2) == 1
+    assert queued.attempts == 2
+    assert models.get_pending_deletions(2) == []
+    assert models.get_failed_deletions(2) == [queued]
+    assert "Permission denied" in queued.message
+
+
+def test_already_deleted(tmpdir, setup_session):
+    """Test that a path that no longer exists counts as deleted."""
+    queued = models.queue_deletion(str(tmpdir.join("gone")).encode())
+    assert deletion.process_queue() == 0
+    assert queued.status == models.DELETION_COMPLETE
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import datetime
+import os
+import shutil
+
+import pytest
+
+from transfers import config, fingerprint, models, transfer
+
+
+@pytest.fixture
+def source(tmpdir):
+    source = tmpdir.mkdir("source")
+    source.join("original", "objects", "a.txt").ensure().write("a" * 100000)
+    source.join("original", "objects", "b.txt").ensure().write("b")
+    # Copies keep the modification times.
+    shutil.copytree(str(source.join("original")), str(source.join("renamed")))
+    return source
+
+
+@pytest.fixture
+def settings(source, tmpdir):
+    database = str(tmpdir.join("transfers.db"))
+    models.init_session(database)
+    settings = tmpdir.join("transfers.conf")
+    settings.write(
+        "[transfers]\n"
+        "databasefile = {}\n"
+        "logfile = {}\n"
+        "preflightroot = {}\n"
+        "fingerprint = sampled\n".format(database, tmpdir.join("log"), source)
+    )
+    yield str(settings)
+    config._CONFIGS.clear()
+    models.cleanup_session()
+    models.Session = models.transfer_session = None
+
+
+def _touch_a(source, content):
+    path = str(source.join("renamed", "objects", "a.txt"))
+    stat = os.stat(path)
+    with open(path, "w") as file_:
+        file_.write(content)
+    os.utime(path, (stat.st_atime, stat.st_mtime))
+
+
+def test_fingerprints(source):
+    original, renamed = str(source.join("original")), str(source.join("renamed"))
+    assert fingerprint.quick_fingerprint(original) == fingerprint.quick_fingerprint(
+        renamed
+    )
+    for mode in (fingerprint.MODE_SAMPLED, fingerprint.MODE_FULL):
+        assert fingerprint.content_fingerprint(
+            original, mode, processes=2
+        ) == fingerprint.content_fingerprint(renamed, mode, processes=1)
+    # Same size and modification time, different content in the middle.
+    _touch_a(source, "a" * 50000 + "c" + "a" * 49999)
+    assert fingerprint.quick_fingerprint(original) == fingerprint.quick_fingerprint(
+        renamed
+    )
+    assert fingerprint.content_fingerprint(original) != fingerprint.content_fingerprint(
+        renamed
+    )
+    source.join("renamed", "objects", "b.txt").write("bb")
+    assert fingerprint.quick_fingerprint(original) != fingerprint.quick_fingerprint(
+        renamed
+    )
+
+
+def _ingest(path, status="COMPLETE"):
+    unit = models.add_new_transfer(uuid="uuid", path=path)
+    models.update_unit_type_and_uuid(unit, "ingest", "sip-uuid")
+    models.update_unit_status(unit, status)
+    models.update_unit_current(unit, False)
+    return unit
+
+
+def test_duplicate_held_and_released(settings):
+    status, _, fingerprints = transfer.check_candidate(settings, b"original")
+    assert status is None
+    models.add_fingerprint(b"original", *fingerprints, uuid="uuid")
+    _ingest(b"original")
+
+    status, reason, _ = transfer.check_candidate(settings, b"renamed")
+    assert (status, reason) == ("HELD", "duplicate of original")
+    transfer.record_unstarted_candidate(b"renamed", status, reason)
+    assert b"renamed" in models.get_processed_transfer_paths()
+
+    assert fingerprint.main(settings, release="renamed") == 0
+    models.init_session(**config.get_config(settings).database_options())
+    assert b"renamed" not in models.get_processed_transfer_paths()
+    assert transfer.check_candidate(settings, b"renamed")[0] is None
+
+
+def test_content_mismatch_started(settings, source):
+    fingerprints = transfer.check_candidate(settings, b"original")[2]
+    models.add_fingerprint(b"original", *fingerprints, uuid="uuid")
+    _ingest(b"original")
+    _touch_a(source, "a" * 99999 + "c")
+    assert transfer.check_candidate(settings, b"renamed")[0] is None
+
+
+def test_only_ingested_duplicates(settings):
+    """Test that a transfer source is only held as the duplicate of one which
+    made an AIP, before and after its unit is archived.
+    """
+    fingerprints = transfer.check_candidate(settings, b"original")[2]
+    models.add_fingerprint(b"original", *fingerprints, uuid="uuid")
+    unit = models.add_new_transfer(uuid="uuid", path=b"original")
+    assert transfer.check_candidate(settings, b"renamed")[0] is None
+    models.update_unit_status(unit, "FAILED")
+    models.update_unit_current(unit, False)
+    assert transfer.check_candidate(settings, b"renamed")[0] is None
+    tomorrow = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+    assert models.archive_units(tomorrow) == 1
+    assert transfer.check_candidate(settings, b"renamed")[0] is None
+
+    models.add_fingerprint(b"original", *fingerprints, uuid="uuid")
+    _ingest(b"original")
+    assert transfer.check_candidate(settings, b"renamed")[0] == "HELD"
+    assert models.archive_units(tomorrow) == 1
+    assert transfer.check_candidate(settings, b"renamed")[0] == "HELD"
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+from transfers import httpmetrics, models
+
+AM_URL = "http://127.0.0.1:62080"
+SS_URL = "http://127.0.0.1:62081"
+
+
+class StubAdapter(BaseAdapter):
+    """Answer every request with an empty JSON list, or a 500 error for the
+    approve endpoint.
+    """
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.status_code = 500 if request.url.endswith("/approve") else 200
+        response._content = b"[]"
+        response.request = request
+        response.url = request.url
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def session():
+    httpmetrics.install()
+    httpmetrics.reset()
+    models.init_session(":memory:")
+    session = requests.Session()
+    session.mount("http://", StubAdapter())
+    yield session
+    httpmetrics.reset()
+    models.cleanup_session()
+    models.Session = models.transfer_session = None
+
+
+def test_endpoint_name():
+    assert (
+        httpmetrics.endpoint_name(
+            "GET",
+            SS_URL + "/api/v2/location/2a3d8d39-9cee-495e-b7ee-5e629254934d/browse/",
+        )
+        == "browse"
+    )
+    assert httpmetrics.endpoint_name("GET", AM_URL + "/api/ingest/status/x/") == (
+        "status"
+    )
+    assert (
+        httpmetrics.endpoint_name(
+            "post",
+            SS_URL + "/api/v2/file/2a3d8d39-9cee-495e-b7ee-5e629254934d/reingest/",
+        )
+        == "POST /api/v2/file/<id>/reingest/"
+    )
+
+
+def test_calls_timed_and_saved(session):
+    session.get(AM_URL + "/api/transfer/unapproved")
+    session.get(AM_URL + "/api/transfer/unapproved")
+    session.post(AM_URL + "/api/transfer/approve")
+    stats = httpmetrics.get_stats()
+    assert stats["unapproved"].calls == 2
+    assert stats["unapproved"].bytes == 4
+    assert stats["approve"].errors == 1
+    assert httpmetrics.summary(run_seconds=100).startswith(
+        "HTTP calls: approve 1 in 0.00s (1 failed), unapproved 2 in"
+    )
+
+    httpmetrics.save(models.transfer_session)
+    session.get(AM_URL + "/api/transfer/unapproved")
+    httpmetrics.save(models.transfer_session)
+    assert httpmetrics.get_stats() == {}
+    query = models.transfer_session.query(httpmetrics.EndpointMetrics)
+    row = query.filter_by(endpoint="unapproved").first()
+    assert (row.calls, row.errors, row.bytes) == (3, 0, 6)
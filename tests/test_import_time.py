@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Check that the entry points run from cron start quickly.
+
+Most runs of the automation tools find the current unit still processing and
+exit, so the modules they import up front should be limited to what that path
+needs. The import time budget, in seconds, can be changed for slow hosts with
+the ``IMPORT_TIME_BUDGET`` environment variable.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+BUDGET = float(os.environ.get("IMPORT_TIME_BUDGET", 1.5))
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = """
+import json, sys, time
+start = time.time()
+__import__(sys.argv[1])
+elapsed = time.time() - start
+print(json.dumps({"elapsed": elapsed, "modules": sorted(sys.modules)}))
+"""
+
+
+@pytest.mark.parametrize(
+    "entry_point, lazy",
+    [
+        ("transfers.transfer", ["amclient", "requests", "transfers.cleanup"]),
+        ("transfers.deletion", ["amclient", "requests"]),
+        ("aips.create_dip", ["metsrw"]),
+        ("aips.create_dips_job", ["metsrw"]),
+    ],
+)
+def test_import_time(entry_point, lazy):
+    output = subprocess.check_output(
+        [sys.executable, "-c", SCRIPT, entry_point], cwd=ROOT
+    )
+    result = json.loads(output.decode("utf-8"))
+    assert not set(lazy) & set(result["modules"])
+    assert result["elapsed"] < BUDGET, "Importing {} took {:.2f}s".format(
+        entry_point, result["elapsed"]
+    )
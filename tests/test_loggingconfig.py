@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import gzip
+import json
+import logging
+import sys
+import threading
+
+import pytest
+
+from transfers import loggingconfig, models
+
+LOGGER = logging.getLogger("transfers")
+
+
+class Settings(dict):
+    def getint(self, name, default=None):
+        return int(self.get(name, default))
+
+    def getboolean(self, name, default=None):
+        return self.get(name, default) in (True, "true")
+
+
+@pytest.fixture
+def log_file(tmpdir):
+    yield tmpdir.join("transfers.log")
+    loggingconfig._stop_listeners()
+    for handler in LOGGER.handlers:
+        handler.close()
+    LOGGER.handlers = []
+
+
+def test_json_format(log_file):
+    loggingconfig.setup(
+        "INFO", str(log_file), config=Settings(logformat="json", logmaxmessage=10)
+    )
+    with loggingconfig.context(unit="uuid", stage="status"):
+        LOGGER.info("Status of %s", "unit %s" % ("x" * 20))
+    LOGGER.info("Done")
+    first, second = [json.loads(line) for line in log_file.readlines()]
+    assert first["message"] == "Status of ... [25 characters truncated]"
+    assert (first["unit"], first["stage"], first["level"]) == ("uuid", "status", "INFO")
+    assert "unit" not in second and second["message"] == "Done"
+
+
+@pytest.mark.skipif(sys.version_info < (3,), reason="requires Python 3")
+def test_queue_and_compression(log_file):
+    loggingconfig.setup(
+        "INFO",
+        str(log_file),
+        config=Settings(
+            logqueue="true", logcompress="true", logmaxbytes="100", logbackups="1"
+        ),
+    )
+    with loggingconfig.context(unit="uuid"):
+        for number in range(5):
+            LOGGER.info("Message %s", number)
+    loggingconfig._stop_listeners()
+    assert "Message 4" in log_file.read()
+    with gzip.open(str(log_file) + ".1.gz", "rt") as rotated:
+        assert "Message 3" in rotated.read()
+
+
+@pytest.mark.skipif(sys.version_info < (3,), reason="requires Python 3")
+def test_queue_truncates_in_listener(log_file, monkeypatch):
+    """Test that with ``logqueue`` the messages are truncated by the listener
+    thread rather than by the thread logging them.
+    """
+    threads = []
+    original = loggingconfig.TruncateFilter.filter
+
+    def truncate(self, record):
+        threads.append(threading.current_thread())
+        return original(self, record)
+
+    monkeypatch.setattr(loggingconfig.TruncateFilter, "filter", truncate)
+    loggingconfig.setup(
+        "INFO", str(log_file), config=Settings(logqueue="true", logmaxmessage=10)
+    )
+    LOGGER.info("Status of %s", "x" * 20)
+    loggingconfig._stop_listeners()
+    assert threads and threading.current_thread() not in threads
+    assert "Status of ... [20 characters truncated]" in log_file.read()
+
+
+@pytest.mark.skipif(sys.version_info < (3,), reason="requires Python 3")
+def test_queue_detached_instance(log_file, monkeypatch):
+    """Test that the arguments of the records are turned into strings in the
+    thread logging them, so that a model instance detached from its session
+    does not stop the listener thread.
+    """
+    # Leave the handlers of pytest, on the root logger, out of it.
+    monkeypatch.setattr(LOGGER, "propagate", False)
+    monkeypatch.setattr(logging, "raiseExceptions", False)
+    loggingconfig.setup(
+        "INFO", str(log_file), config=Settings(logformat="json", logqueue="true")
+    )
+    models.init_session(":memory:")
+    unit = models.add_new_transfer(uuid="uuid", path=b"path")
+    LOGGER.info("Current unit: %s", unit)
+    models.transfer_session.expire(unit)
+    models.cleanup_session()
+    models.Session = models.transfer_session = None
+    LOGGER.info("New transfer: %s", unit)
+    try:
+        raise ValueError("Failed")
+    except ValueError:
+        LOGGER.exception("Done")
+    loggingconfig._stop_listeners()
+    first, last = [json.loads(line) for line in log_file.readlines()]
+    assert first["message"].startswith("Current unit: <Unit(id=1, uuid=uuid")
+    assert last["message"] == "Done"
+    assert "ValueError: Failed" in last["exception"]
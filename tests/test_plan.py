@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import base64
+import datetime
+import io
+import json
+
+from transfers import config, models, plan, transfer
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+SS_URL = "http://127.0.0.1:62081"
+TS_LOCATION_UUID = "2a3d8d39-9cee-495e-b7ee-5e629254934d"
+NOW = datetime.datetime(2020, 1, 2)
+
+
+def _listing(*names):
+    encoded = [base64.b64encode(name).decode() for name in names]
+    return {
+        "entries": encoded,
+        "directories": encoded,
+        "properties": {entry: {"size": 10**9} for entry in encoded[:1]},
+    }
+
+
+def test_write_plan():
+    started = datetime.datetime(2020, 1, 1)
+    history = [
+        (started + datetime.timedelta(hours=hours), None, None) for hours in range(3)
+    ]
+    history[0] = (started, started + datetime.timedelta(seconds=100), 2 * 10**8)
+    out = io.StringIO()
+    summary = plan.write_plan([(b"a", 10), (b"b", None)], out, history, now=NOW)
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert lines == [
+        {"position": 0, "path": "a", "size": 10, "start": "2020-01-02T00:00:00"},
+        {"position": 1, "path": "b", "size": None, "start": "2020-01-02T01:00:00"},
+    ]
+    assert summary["completion"] == datetime.datetime(2020, 1, 2, 2)
+    assert plan.format_summary(summary) == [
+        "Transfers left: 2",
+        "Total size: 10 B (1 of unknown size)",
+        "  < 100 MB: 1",
+        "  unknown: 1",
+        "Processing throughput: 2 MB/s",
+        "One transfer started every 1:00:00",
+        "Projected completion: 2020-01-02 02:00 UTC",
+    ]
+
+
+@mock.patch("transfers.utils._call_url_json")
+def test_iter_candidates(mock_call_url_json, setup_session):
+    """Test that the candidates are listed in the order they are started,
+    directory after directory.
+    """
+    listings = {
+        None: _listing(b"one", b"two"),
+        b"one": _listing(b"c", b"b", b"a"),
+        b"two": _listing(b"d"),
+    }
+
+    def browse(url, params):
+        path = params.get("path")
+        return listings[base64.b64decode(path) if path else None]
+
+    mock_call_url_json.side_effect = browse
+    candidates = transfer.iter_candidates(
+        SS_URL, "test", "test", TS_LOCATION_UUID, b"", 2, {b"one/b"}, False
+    )
+    assert list(candidates) == [
+        (b"one/a", None),
+        (b"one/c", 10**9),
+        (b"two/d", 10**9),
+    ]
+
+
+@mock.patch("transfers.transfer.iter_candidates", return_value=[(b"a", 1)])
+def test_plan_mode(mock_iter_candidates, tmpdir, capsys):
+    """Test that nothing is started in plan mode."""
+    plan_file = tmpdir.join("plan.ndjson")
+    settings = tmpdir.join("transfers.conf")
+    settings.write(
+        "[transfers]\ndatabasefile = {}\nlogfile = {}\n".format(
+            tmpdir.join("transfers.db"), tmpdir.join("transfers.log")
+        )
+    )
+    try:
+        with mock.patch("transfers.transfer.run_cycle") as mock_run_cycle:
+            result = transfer.main(
+                "demo",
+                "key",
+                "test",
+                "test",
+                TS_LOCATION_UUID,
+                b"",
+                1,
+                "http://127.0.0.1:62080",
+                SS_URL,
+                "standard",
+                False,
+                config_file=str(settings),
+                plan_file=str(plan_file),
+            )
+    finally:
+        config._CONFIGS.clear()
+        models.Session = models.transfer_session = None
+    assert result == 0
+    assert not mock_run_cycle.called
+    assert json.loads(plan_file.read())["path"] == "a"
+    assert "Transfers left: 1" in capsys.readouterr().out
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import hashlib
+
+import pytest
+
+from transfers import config, models, preflight, transfer
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+def _write(directory, name, content):
+    path = directory.join(*name.split("/"))
+    path.ensure().write_binary(content)
+    return hashlib.md5(content).hexdigest()
+
+
+@pytest.fixture
+def bag(tmpdir):
+    bag = tmpdir.mkdir("bag")
+    bag.join("bagit.txt").write("BagIt-Version: 0.97\n")
+    lines = [
+        "{}  {}\n".format(_write(bag, name, content), name)
+        for name, content in [("data/a.txt", b"a"), ("data/sub/b.txt", b"b" * 10)]
+    ]
+    bag.join("manifest-md5.txt").write("".join(lines))
+    return bag
+
+
+def test_valid_bag(bag):
+    assert preflight.validate(str(bag), processes=2) == []
+
+
+@pytest.mark.parametrize("path", ["./bag", "bag/", "bag/data/../"])
+def test_relative_path(bag, tmpdir, monkeypatch, path):
+    monkeypatch.chdir(tmpdir)
+    assert preflight.validate(path, processes=1) == []
+
+
+def test_broken_bag(bag):
+    bag.join("data", "a.txt").write_binary(b"changed")
+    bag.join("data", "sub", "b.txt").remove()
+    bag.join("data", "empty.txt").write_binary(b"")
+    problems = preflight.validate(str(bag), processes=1, reject_empty_files=True)
+    assert problems == [
+        "Empty file: {}".format(bag.join("data", "empty.txt")),
+        "{} is not in the bag manifests".format(bag.join("data", "empty.txt")),
+        "Missing file listed in manifest: {}".format(bag.join("data", "sub", "b.txt")),
+        "md5 checksum mismatch: {}".format(bag.join("data", "a.txt")),
+    ]
+
+
+def test_empty_files(tmpdir):
+    """Test that empty files are accepted alongside other files, unless asked
+    otherwise, but not on their own.
+    """
+    source = tmpdir.mkdir("transfer")
+    _write(source, "objects/a.txt", b"a")
+    _write(source, "objects/.keep", b"")
+    _write(source, "logs/empty.log", b"")
+    assert preflight.validate(str(source)) == []
+    problems = preflight.validate(str(source), reject_empty_files=True)
+    assert sorted(problems) == [
+        "Empty file: {}".format(source.join("logs", "empty.log")),
+        "Empty file: {}".format(source.join("objects", ".keep")),
+    ]
+    source.join("objects", "a.txt").write_binary(b"")
+    assert preflight.validate(str(source)) == [
+        "{} contains only empty files".format(source)
+    ]
+    assert preflight.validate(str(source.join("objects", ".keep"))) == [
+        "Empty file: {}".format(source.join("objects", ".keep"))
+    ]
+
+
+def test_standard_transfer_checksums(tmpdir):
+    source = tmpdir.mkdir("transfer")
+    checksum = _write(source, "objects/a.txt", b"a")
+    _write(
+        source,
+        "metadata/checksum.md5",
+        "{}  ../objects/a.txt\n".format(checksum).encode(),
+    )
+    assert preflight.validate(str(source)) == []
+    _write(source, "metadata/checksum.md5", b"0" * 32 + b"  objects/a.txt\n")
+    assert preflight.validate(str(source)) == [
+        "md5 checksum mismatch: {}".format(source.join("objects", "a.txt"))
+    ]
+    assert preflight.validate(str(tmpdir.mkdir("empty"))) == [
+        "{} contains no files".format(tmpdir.join("empty"))
+    ]
+
+
+def test_start_transfer_skips_rejected(bag, tmpdir):
+    """Test that a transfer source failing the pre-flight validation is
+    recorded as rejected and the next candidate is started instead.
+    """
+    broken = tmpdir.mkdir("broken")
+    broken.join("bagit.txt").write("BagIt-Version: 0.97\n")
+    settings = tmpdir.join("transfers.conf")
+    settings.write("[transfers]\npreflightroot = {}\n".format(tmpdir))
+    models.init_session(":memory:")
+    try:
+        with mock.patch(
+            "transfers.transfer.get_next_transfer", side_effect=[b"broken", b"bag"]
+        ), mock.patch(
+            "transfers.transfer.call_start_transfer_endpoint",
+            return_value=(None, None),
+        ) as mock_call_start_transfer_endpoint:
+            transfer.start_transfer(
+                ss_url="http://127.0.0.1:62081",
+                ss_user="test",
+                ss_api_key="test",
+                ts_location_uuid=None,
+                ts_path="",
+                depth=1,
+                am_url="http://127.0.0.1:62090",
+                am_user="test",
+                am_api_key="test",
+                transfer_type="standard",
+                see_files=False,
+                config_file=str(settings),
+            )
+        assert mock_call_start_transfer_endpoint.call_args[1]["target"] == b"bag"
+        units = models.transfer_session.query(models.Unit).order_by(models.Unit.id)
+        assert [(unit.path, unit.status) for unit in units] == [
+            (b"broken", "REJECTED"),
+            (b"bag", "FAILED"),
+        ]
+    finally:
+        config._CONFIGS.clear()
+        models.cleanup_session()
+        models.Session = models.transfer_session = None
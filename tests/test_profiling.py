@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import argparse
+import sys
+import threading
+
+import pytest
+
+from transfers import profiling
+
+
+def _parse(*args):
+    parser = argparse.ArgumentParser()
+    profiling.add_arguments(parser)
+    return parser.parse_args(list(args))
+
+
+def _work():
+    return sorted(str(number) * 10 for number in range(10000))
+
+
+def test_no_profile():
+    assert profiling.start(_parse(), "test")() is None
+
+
+def test_cpu_profile(tmpdir):
+    args = _parse("--profile", "--profile-top", "5")
+    stop = profiling.start(args, "test", str(tmpdir.join("transfers.log")))
+    _work()
+    path = stop()
+    assert path.startswith(str(tmpdir.join("test-")))
+    assert path.endswith(".pstats")
+    assert "_work" in open(path[: -len(".pstats")] + ".txt").read()
+    # Stopping again, at exit, keeps the profile written.
+    assert stop() == path
+
+
+def _thread_work():
+    return _work()
+
+
+def test_cpu_profile_threads(tmpdir):
+    """Test that the threads started while profiling are profiled too."""
+    args = _parse("--profile", "--profile-dir", str(tmpdir))
+    stop = profiling.start(args, "test")
+    thread = threading.Thread(target=_thread_work)
+    thread.start()
+    thread.join()
+    path = stop()
+    assert "_thread_work" in open(path[: -len(".pstats")] + ".txt").read()
+
+
+@pytest.mark.skipif(sys.version_info < (3, 4), reason="requires tracemalloc")
+def test_memory_profile(tmpdir):
+    args = _parse("--profile", "memory", "--profile-dir", str(tmpdir))
+    stop = profiling.start(args, "test")
+    kept = _work()
+    path = stop()
+    assert path.endswith(".tracemalloc") and kept
+    summary = open(path[: -len(".tracemalloc")] + ".txt").read()
+    assert summary.startswith("Peak memory: ")
+    assert "test_profiling.py" in summary
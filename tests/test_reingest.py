@@ -1,11 +1,21 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import os
+import threading
+import time
+
 import pytest
+from amclient import AMClient
+from sqlalchemy import event
 
 from transfers import reingest
 from transfers import reingestmodel as reingestunit
 
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
 
 class TestReingestClass(object):
 
@@ -54,3 +64,105 @@ class TestReingestClass(object):
     )
     def test_load_db_iterable(self, aip_uuids, expected):
         assert reingest.load_db(self.session, aip_uuids) == expected
+
+    def test_start_reingest_concurrently(self):
+        aips = ["aip-{}".format(number) for number in range(6)]
+        reingest.load_db(self.session, aips)
+        reingestunit.set_status_in_progress(self.session, aips[0], "transfer-0")
+        amclient = reingest.setup_amclient(
+            AMClient(am_url="http://am.example", ss_url="http://ss.example")
+        )
+        clients = {}
+        lock = threading.Lock()
+
+        def reingest_full_and_approve(client, pipeline, aip, *args, **kwargs):
+            with lock:
+                clients.setdefault(threading.current_thread(), set()).add(id(client))
+            time.sleep(0.05)
+            if aip == aips[3]:
+                return False, "Error approving transfer."
+            return True, "transfer-" + aip
+
+        with mock.patch(
+            "transfers.reingest.reingest_full_and_approve",
+            side_effect=reingest_full_and_approve,
+        ) as mock_reingest:
+            complete = reingest.start_reingest(
+                self.session, amclient, "pipeline", "default", throttle=4, workers=2
+            )
+        assert not complete
+        # Three reingests fit within the throttle, started by two workers with
+        # a client of their own.
+        assert mock_reingest.call_count == 3
+        assert len(clients) == 2
+        assert all(len(ids) == 1 for ids in clients.values())
+        assert id(amclient) not in set.union(*clients.values())
+        statuses = {
+            item.aip_uuid: item.status for item in reingestunit.get_items(self.session)
+        }
+        assert statuses == {
+            aips[0]: reingestunit.StatusEnum.STATUS_IN_PROGRESS,
+            aips[1]: reingestunit.StatusEnum.STATUS_IN_PROGRESS,
+            aips[2]: reingestunit.StatusEnum.STATUS_IN_PROGRESS,
+            aips[3]: reingestunit.StatusEnum.STATUS_ERROR,
+            aips[4]: reingestunit.StatusEnum.STATUS_NEW,
+            aips[5]: reingestunit.StatusEnum.STATUS_NEW,
+        }
+
+    def test_update_reingest(self):
+        statuses = {
+            "aip-1": ("COMPLETE", "PROCESSING", "UPLOADED"),
+            "aip-2": ("COMPLETE", "COMPLETE", "UPLOADED"),
+            "aip-3": ("COMPLETE", "COMPLETE", "DEL_REQ"),
+            "aip-4": ("PROCESSING", None, None),
+        }
+        package_details = []
+
+        class Client(object):
+            def get_transfer_status(self):
+                time.sleep(0.01)
+                return {"status": statuses[self.sip_uuid][0]}
+
+            def get_ingest_status(self):
+                time.sleep(0.01)
+                return {"status": statuses[self.sip_uuid][1]}
+
+            def get_package_details(self):
+                package_details.append(self.package_uuid)
+                return {"status": statuses[self.sip_uuid][2]}
+
+        reingest.load_db(self.session, sorted(statuses))
+        for aip in statuses:
+            reingestunit.set_status_in_progress(self.session, aip, "transfer")
+        # The database is only queried from this thread, even when the AIPs
+        # have expired, e.g. after a commit.
+        get_items_in_progress = reingestunit.get_items_in_progress
+
+        def get_expired_items(session):
+            items = get_items_in_progress(session)
+            session.expire_all()
+            return items
+
+        threads = set()
+
+        def record_thread(*args):
+            threads.add(threading.current_thread())
+
+        engine = self.session.get_bind()
+        event.listen(engine, "before_cursor_execute", record_thread)
+        try:
+            with mock.patch(
+                "transfers.reingest.reingestunit.get_items_in_progress",
+                side_effect=get_expired_items,
+            ):
+                reingest.update_reingest(self.session, Client(), workers=3)
+        finally:
+            event.remove(engine, "before_cursor_execute", record_thread)
+        assert threads == {threading.current_thread()}
+        # The package details are only fetched for completed ingests.
+        assert sorted(package_details) == ["aip-2", "aip-3"]
+        # The completed AIPs are committed.
+        self.session.rollback()
+        assert [
+            item.aip_uuid for item in reingestunit.get_items_complete(self.session)
+        ] == ["aip-2"]
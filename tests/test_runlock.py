@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import errno
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from transfers import reingest, runlock
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+@pytest.fixture
+def lock_path(tmpdir):
+    return str(tmpdir.join("pid.lck"))
+
+
+def _dead_pid():
+    """Return the PID of a process that has exited."""
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_single_holder(lock_path):
+    """Test that the lock is only held by one instance at a time."""
+    first, second = runlock.RunLock(lock_path), runlock.RunLock(lock_path)
+    assert first.acquire()
+    assert not second.acquire()
+    holder = second.read_holder()
+    assert holder["pid"] == os.getpid()
+    assert holder["token"] == first.token
+    first.release()
+    assert second.acquire()
+    second.release()
+
+
+def test_leftover_lock_file(lock_path):
+    """Test that a lock file left behind by a process that was killed does not
+    block later runs.
+    """
+    with open(lock_path, "w") as lock_file:
+        lock_file.write(str(_dead_pid()))
+    with runlock.RunLock(lock_path) as acquired:
+        assert acquired
+
+
+def test_lock_released_when_holder_dies(lock_path):
+    """Test that the lock is free as soon as the process holding it dies."""
+    script = (
+        "import sys, time; from transfers import runlock; "
+        "runlock.RunLock(sys.argv[1]).acquire(); "
+        "sys.stdout.write('locked\\n'); sys.stdout.flush(); time.sleep(60)"
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-c", script, lock_path], stdout=subprocess.PIPE
+    )
+    try:
+        assert process.stdout.readline() == b"locked\n"
+        lock = runlock.RunLock(lock_path)
+        assert not lock.acquire()
+    finally:
+        process.kill()
+        process.wait()
+    assert lock.acquire()
+    lock.release()
+
+
+def test_heartbeat(lock_path):
+    """Test that the heartbeat is renewed while the lock is held."""
+    lock = runlock.RunLock(lock_path, lease=0.3)
+    assert lock.acquire()
+    try:
+        heartbeat = lock.read_holder()["heartbeat"]
+        time.sleep(0.5)
+        assert lock.read_holder()["heartbeat"] > heartbeat
+    finally:
+        lock.release()
+
+
+@pytest.fixture
+def no_flock():
+    error = IOError(errno.ENOLCK, "No locks available")
+    with mock.patch("fcntl.flock", side_effect=error):
+        yield
+
+
+def _write_holder(path, pid, heartbeat):
+    with open(path, "w") as lock_file:
+        json.dump(
+            {"pid": pid, "host": runlock.socket.gethostname(), "heartbeat": heartbeat},
+            lock_file,
+        )
+
+
+def test_lease_live_holder(lock_path, no_flock):
+    """Without file locks, a lock renewed by a running process is kept."""
+    _write_holder(lock_path, os.getpid(), time.time())
+    assert not runlock.RunLock(lock_path).acquire()
+
+
+@pytest.mark.parametrize(
+    "pid, age", [(None, 0), (os.getpid(), 600)], ids=["dead_pid", "expired"]
+)
+def test_lease_stale_holder(lock_path, no_flock, pid, age):
+    """Without file locks, a lock whose process is gone or whose heartbeat
+    has expired is taken over, and removed once released.
+    """
+    _write_holder(lock_path, pid or _dead_pid(), time.time() - age)
+    lock = runlock.RunLock(lock_path)
+    assert lock.acquire()
+    assert lock.read_holder()["token"] == lock.token
+    assert not runlock.RunLock(lock_path).acquire()
+    lock.release()
+    assert not os.path.exists(lock_path)
+
+
+def test_reingest_manage_process(lock_path):
+    """Test that reingest exits when another run holds the lock and only
+    releases the lock it holds.
+    """
+    config = {"process": {"pid": lock_path}}
+    other = runlock.RunLock(lock_path)
+    assert other.acquire()
+    with pytest.raises(SystemExit):
+        reingest.manage_process(config)
+    reingest.manage_process(config, remove=True)
+    assert other.read_holder()["token"] == other.token
+    other.release()
+    reingest.manage_process(config)
+    assert not runlock.RunLock(lock_path).acquire()
+    reingest.manage_process(config, remove=True)
+    assert runlock.RunLock(lock_path).acquire()
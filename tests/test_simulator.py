@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import pytest
+from amclient import AMClient
+
+from simulator import server
+from transfers import models, reingest, transfer, utils
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+@pytest.fixture
+def simulator():
+    models.init_session(":memory:")
+    simulated = server.serve_in_thread(
+        {
+            "approval_delay": 0,
+            "transfer_duration": 0,
+            "ingest_duration": 0,
+            "entries": 3,
+            "levels": 2,
+            "aips": 3,
+        }
+    )
+    yield simulated
+    simulated.shutdown()
+    simulated.server_close()
+    models.cleanup_session()
+    models.Session = models.transfer_session = None
+
+
+@mock.patch("transfers.transfer.time.sleep")
+def test_transfer_cycle(mock_sleep, simulator):
+    url = simulator.url
+    target = transfer.get_next_transfer(
+        url,
+        "test",
+        "test",
+        server.TRANSFER_SOURCE_UUID,
+        b"",
+        2,
+        {b"dir-000000/dir-000000"},
+        False,
+    )
+    assert target == b"dir-000000/dir-000001"
+    dirname, _ = transfer.call_start_transfer_endpoint(
+        url, "test", "test", target, "standard", None, server.TRANSFER_SOURCE_UUID
+    )
+    transfer_uuid = transfer.approve_transfer(dirname, url, "test", "test")
+    assert transfer_uuid
+
+    status = utils._call_url_json(
+        url + "/api/transfer/status/{}/".format(transfer_uuid)
+    )
+    assert status["status"] == "COMPLETE"
+    status = utils._call_url_json(
+        url + "/api/ingest/status/{}/".format(status["sip_uuid"])
+    )
+    assert status["status"] == "COMPLETE"
+    package = utils._call_url_json(url + "/api/v2/file/{}/".format(status["uuid"]))
+    assert package["status"] == "UPLOADED"
+
+
+def test_reingest(simulator):
+    amclient = reingest.setup_amclient(
+        AMClient(
+            ss_url=simulator.url,
+            ss_user_name="test",
+            ss_api_key="test",
+            am_url=simulator.url,
+            am_user_name="test",
+            am_api_key="test",
+        )
+    )
+    aips = amclient.get_all_compressed_aips()
+    assert len(aips) == 3
+    assert reingest.pipeline_exists(amclient, server.PIPELINE_UUID)
+    approved, _ = reingest.reingest_full_and_approve(
+        amclient, server.PIPELINE_UUID, sorted(aips)[0]
+    )
+    assert approved
+    stats = utils._call_url_json(simulator.url + "/simulator/stats/")
+    assert stats["counts"]["reingests started"] == 1
+    assert stats["requests"]["approve"] == 1
+
+
+def test_failure_injection():
+    simulated = server.Simulator({"failure_rate": 1, "seed": 1})
+    assert simulated.handle("GET", "/api/v2/pipeline/", {}).status == 500
+    assert simulated.handle("GET", "/simulator/stats/", {}).status == 200
+    simulated.settings["failure_rate"] = 0
+    response = simulated.handle("GET", "/api/transfer/status/unknown/", {})
+    assert response.status == 400
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import base64
+import datetime
+import threading
+import time
+from uuid import uuid4
+
+import pytest
+
+# The asynchronous engine requires Python 3.
+asyncio = pytest.importorskip("asyncio")
+
+from transfers import models, transfer_async
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+AM_URL = "http://127.0.0.1:62080"
+SS_URL = "http://127.0.0.1:62081"
+TS_LOCATION_UUID = "2a3d8d39-9cee-495e-b7ee-5e629254934d"
+
+
+def _response(json):
+    return mock.Mock(json=mock.Mock(return_value=json), raise_for_status=mock.Mock())
+
+
+def _run(engine, capacity, candidates, **kwargs):
+    """Run a cycle of the engine over a transfer source with ``candidates``."""
+
+    def browse(ss_url, ss_user, ss_api_key, location, path):
+        names = [base64.b64encode(name).decode() for name in candidates]
+        return {"directories": names, "entries": names}
+
+    with mock.patch("transfers.transfer._browse", side_effect=browse), mock.patch(
+        "transfers.transfer_async.get_accession_id", return_value=None
+    ):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(
+                engine.run_cycle(
+                    TS_LOCATION_UUID, b"", 1, "standard", False, capacity, **kwargs
+                )
+            )
+        finally:
+            loop.close()
+            engine.close()
+
+
+def test_start_transfers_concurrently(setup_session):
+    """Test that packages are created for as many transfers as the pipeline
+    has capacity for, with no more requests at once than allowed.
+    """
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def post(url, headers, json):
+        assert url == AM_URL + "/api/v2beta/package/"
+        with lock:
+            running.append(json["name"])
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(json["name"])
+        return _response({"id": str(uuid4())})
+
+    engine = transfer_async.Engine(
+        AM_URL, "demo", "key", SS_URL, "test", "test", concurrency=2, batch_size=2
+    )
+    candidates = [b"one", b"two", b"three", b"four", b"five"]
+    with mock.patch.object(engine.http, "post", side_effect=post):
+        assert _run(engine, 3, candidates) == 0
+    assert max(peak) == 2
+    units = models.get_current_units()
+    assert sorted(unit.path for unit in units) == [b"five", b"four", b"one"]
+
+
+def test_check_and_inspect_concurrently(setup_session):
+    """Test that the status checks of the current units, and the inspections
+    of the candidates, each run in calls of their own to the thread pool.
+    """
+    # Each call waits for the other, which it only sees if they run at once.
+    statuses = threading.Barrier(2, timeout=5)
+    inspections = threading.Barrier(2, timeout=5)
+
+    def get(url, params):
+        statuses.wait()
+        return _response({"status": "PROCESSING"})
+
+    def inspect(config_file, target):
+        inspections.wait()
+        return [], None
+
+    for path in (b"first", b"second"):
+        models.add_new_transfer(uuid=str(uuid4()), path=path)
+    engine = transfer_async.Engine(
+        AM_URL, "demo", "key", SS_URL, "test", "test", concurrency=2
+    )
+    with mock.patch.object(engine.http, "get", side_effect=get), mock.patch.object(
+        engine.http, "post", return_value=_response({"id": str(uuid4())})
+    ), mock.patch("transfers.transfer_async.inspect_candidate", side_effect=inspect):
+        assert _run(engine, 4, [b"first", b"new", b"other", b"second"]) == 0
+    assert len(models.get_current_units()) == 4
+
+
+def test_check_units(setup_session):
+    """Test that the status of the current units is checked and only the
+    units still processing count towards the capacity.
+    """
+    processing, complete, sip = str(uuid4()), str(uuid4()), str(uuid4())
+    models.add_new_transfer(uuid=processing, path=b"processing")
+    models.add_new_transfer(uuid=complete, path=b"complete")
+    statuses = {
+        "/api/transfer/status/{}/".format(processing): {"status": "PROCESSING"},
+        "/api/transfer/status/{}/".format(complete): {
+            "status": "COMPLETE",
+            "sip_uuid": sip,
+        },
+        "/api/ingest/status/{}/".format(sip): {"status": "COMPLETE"},
+    }
+
+    def get(url, params):
+        return _response(statuses[url.replace(AM_URL, "")])
+
+    engine = transfer_async.Engine(AM_URL, "demo", "key", SS_URL, "test", "test")
+    new_uuid = str(uuid4())
+    with mock.patch.object(engine.http, "get", side_effect=get), mock.patch.object(
+        engine.http, "post", return_value=_response({"id": new_uuid})
+    ) as mock_post:
+        assert _run(engine, 2, [b"complete", b"new", b"processing"]) == 0
+    assert mock_post.call_count == 1
+    current = {unit.uuid: unit for unit in models.get_current_units()}
+    assert set(current) == {processing, new_uuid}
+    done = models.retrieve_unit_by_type_and_uuid(uuid=sip, unit_type="ingest")
+    assert done.status == "COMPLETE"
+    assert not done.current
+
+
+def test_failed_package(setup_session):
+    """Test that a transfer that cannot be started is recorded as failed."""
+    engine = transfer_async.Engine(AM_URL, "demo", "key", SS_URL, "test", "test")
+    response = _response({"error": True, "message": "Invalid path"})
+    with mock.patch.object(engine.http, "post", return_value=response):
+        assert _run(engine, 1, [b"bad"]) == 1
+    assert models.get_current_units() == []
+    assert models.get_processed_transfer_paths() == {b"bad"}
+
+
+def test_package_without_id(setup_session):
+    """Test that a package created without an id counts as a failed start."""
+    engine = transfer_async.Engine(AM_URL, "demo", "key", SS_URL, "test", "test")
+    with mock.patch.object(engine.http, "post", return_value=_response({})):
+        assert _run(engine, 2, [b"bad", b"worse"]) == 1
+    assert models.get_current_units() == []
+    assert models.get_processed_transfer_paths() == {b"bad", b"worse"}
+
+
+def test_database_from_loop_thread(setup_session):
+    """Test that the database is only used from the thread of the event loop,
+    the archived paths being skipped from the pool all the same.
+    """
+    models.add_new_transfer(uuid=str(uuid4()), path=b"archived")
+    unit = models.get_current_unit()
+    models.update_unit_status(unit, "COMPLETE")
+    models.update_unit_current(unit, False)
+    tomorrow = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+    assert models.archive_units(tomorrow) == 1
+    threads = set()
+    execute = models.transfer_session.execute
+
+    def record_thread(*args, **kwargs):
+        threads.add(threading.current_thread())
+        return execute(*args, **kwargs)
+
+    engine = transfer_async.Engine(AM_URL, "demo", "key", SS_URL, "test", "test")
+    with mock.patch.object(
+        models.transfer_session, "execute", side_effect=record_thread
+    ), mock.patch.object(
+        engine.http, "post", return_value=_response({"id": str(uuid4())})
+    ):
+        assert _run(engine, 2, [b"archived", b"new"]) == 0
+    assert threads == {threading.current_thread()}
+    assert [unit.path for unit in models.get_current_units()] == [b"new"]
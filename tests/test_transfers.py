@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import base64
 import collections
 import os
 import unittest
@@ -446,3 +447,35 @@ class TestAutomateTransfers(unittest.TestCase):
                     assert unit.uuid == returned_uuid
                     assert unit.current is True
                     assert unit.unit_type == "transfer"
+
+    @mock.patch("transfers.utils._call_url_json")
+    def test_get_next_transfer_large_listing(self, mock_call_url_json):
+        """Test that the first new entry of a large listing is found going
+        through the entries once, with the archived paths looked up by chunks.
+        """
+        names = ["{:04d}".format(number).encode() for number in reversed(range(1200))]
+        encoded = [base64.b64encode(name).decode() for name in names]
+        mock_call_url_json.return_value = {
+            "entries": encoded,
+            "directories": encoded,
+            "properties": {entry: {"size": 10} for entry in encoded},
+        }
+        processed = {b"0000", b"0001"}
+        transfer.SOURCE_SIZES.clear()
+        with mock.patch(
+            "transfers.models.get_archived_paths", return_value={b"0002"}
+        ) as mock_get_archived_paths:
+            target = transfer.get_next_transfer(
+                ss_url=SS_URL,
+                ss_user=SS_USER,
+                ss_api_key=SS_KEY,
+                ts_location_uuid=TS_LOCATION_UUID,
+                path_prefix=b"",
+                depth=1,
+                processed=processed,
+                see_files=FILES,
+            )
+        assert target == b"0003"
+        assert mock_get_archived_paths.call_count == 3
+        assert transfer.SOURCE_SIZES == {b"0003": 10}
+        assert b"0003" in transfer.SOURCE_DIRECTORIES
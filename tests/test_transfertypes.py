@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import base64
+import json
+import zipfile
+
+import pytest
+
+from transfers import config, transfer, transfertypes
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+SS_URL = "http://127.0.0.1:62081"
+TS_LOCATION_UUID = "2a3d8d39-9cee-495e-b7ee-5e629254934d"
+
+
+@pytest.fixture
+def source(tmpdir):
+    source = tmpdir.mkdir("source")
+    source.join("bag", "bag-info.txt").ensure()
+    source.join("dspace", "ITEM@123-4567.zip").ensure()
+    source.join("standard", "objects", "file.txt").ensure()
+    for name, member in [("zipped.zip", "zipped/bagit.txt"), ("other.zip", "a.txt")]:
+        with zipfile.ZipFile(str(source.join(name)), "w") as zip_file:
+            zip_file.writestr(member, "")
+    source.join("broken.zip").write("not a zip")
+    yield source
+    config._CONFIGS.clear()
+
+
+def test_classify():
+    assert transfertypes.classify(b"bag", children=[b"bagit.txt", b"data"]) == (
+        transfertypes.UNZIPPED_BAG
+    )
+    assert transfertypes.classify(b"items", children=[b"ITEM@1-2.zip"]) == (
+        transfertypes.DSPACE
+    )
+    assert transfertypes.classify(b"dir", children=[b"a.zip"]) == "standard"
+    assert transfertypes.classify(b"ITEM@1-2.zip") == transfertypes.DSPACE
+    assert transfertypes.classify(b"bag.ZIP") == transfertypes.ZIPPED_BAG
+    assert transfertypes.classify(b"a.zip", members=["a/b.txt"]) == "standard"
+    assert transfertypes.classify(b"file.txt") == "standard"
+
+
+def test_inspect_local(source):
+    expected = {
+        "bag": "unzipped bag",
+        "dspace": "dspace",
+        "standard": "standard",
+        "zipped.zip": "zipped bag",
+        "other.zip": "standard",
+        "broken.zip": None,
+    }
+    for name, transfer_type in expected.items():
+        assert transfertypes.inspect_local(str(source.join(name))) == transfer_type
+
+
+def test_get_transfer_type(source, tmpdir):
+    """Test that the overrides come first, then the local inspection."""
+    overrides = tmpdir.join("overrides.json")
+    overrides.write(json.dumps([{"path": "standard*", "type": "zipped bag"}]))
+    settings = tmpdir.join("transfers.conf")
+    settings.write(
+        "[transfers]\npreflightroot = {}\ntransfertypes = {}\n".format(
+            source, overrides
+        )
+    )
+
+    def get_type(target, transfer_type="auto"):
+        return transfer.get_transfer_type(
+            str(settings),
+            SS_URL,
+            "test",
+            "test",
+            TS_LOCATION_UUID,
+            target,
+            transfer_type,
+        )
+
+    assert get_type(b"standard") == "zipped bag"
+    assert get_type(b"bag") == "unzipped bag"
+    assert get_type(b"broken.zip") == "standard"
+    assert get_type(b"bag", "dspace") == "dspace"
+
+
+@mock.patch("transfers.utils._call_url_json")
+def test_inspect_listing(mock_call_url_json):
+    mock_call_url_json.return_value = {
+        "entries": [base64.b64encode(b"bagit.txt").decode(), "ZGF0YQ=="],
+        "directories": ["ZGF0YQ=="],
+    }
+    assert (
+        transfertypes.inspect_listing(
+            SS_URL, "test", "test", TS_LOCATION_UUID, b"in/bag", is_dir=True
+        )
+        == "unzipped bag"
+    )
+    assert mock_call_url_json.call_args[0][1]["path"] == base64.b64encode(b"in/bag")
+    assert (
+        transfertypes.inspect_listing(
+            SS_URL, "test", "test", TS_LOCATION_UUID, b"in/bag.zip", is_dir=False
+        )
+        == "zipped bag"
+    )
+    assert mock_call_url_json.call_count == 1
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import datetime
+from uuid import uuid4
+
+from sqlalchemy import create_engine, inspect, text
+
+from transfers import models, watchdog
+
+
+def _completed_unit(transfer_type, size, hours):
+    unit = models.add_new_transfer(
+        uuid=str(uuid4()),
+        path=str(uuid4()).encode(),
+        transfer_type=transfer_type,
+        size=size,
+    )
+    unit.started = datetime.datetime(2020, 1, 1)
+    unit.finished = unit.started + datetime.timedelta(hours=hours)
+    unit.status = "COMPLETE"
+    unit.current = False
+    return unit
+
+
+def test_size_band():
+    assert watchdog.size_band(None) == (None, None)
+    assert watchdog.size_band(10) == (None, 10**8)
+    assert watchdog.size_band(10**9) == (10**9, 10**10)
+    assert watchdog.size_band(10**12) == (10**11, None)
+
+
+def test_percentile():
+    assert watchdog.percentile(range(1, 101), 95) == 95
+    assert watchdog.percentile([3, 1, 2], 50) == 2
+    assert watchdog.percentile([7], 99) == 7
+
+
+def test_hung_unit(setup_session):
+    """Test that a unit is compared with the units of the same type and size
+    band, and recorded as failed if hung.
+    """
+    for hours in range(1, 11):
+        _completed_unit("standard", 10**6, hours)
+        # Larger transfers take much longer.
+        _completed_unit("standard", 10**10, hours * 10)
+    unit = models.add_new_transfer(
+        uuid=str(uuid4()), path=b"current", transfer_type="standard", size=10**5
+    )
+    models.update_unit_status(unit, "PROCESSING")
+    dog = watchdog.Watchdog(percentile=90, factor=2, action=watchdog.ACTION_FAIL)
+    assert dog.threshold(unit) == 18 * 3600
+    now = unit.started + datetime.timedelta(hours=17)
+    assert not dog.check(unit, now)
+    assert unit.status == "PROCESSING"
+    now = unit.started + datetime.timedelta(hours=19)
+    assert dog.check(unit, now)
+    assert unit.status == "FAILED"
+    assert unit.finished is not None
+
+
+def test_too_few_samples(setup_session):
+    _completed_unit("zipped bag", None, 1)
+    unit = models.add_new_transfer(
+        uuid=str(uuid4()), path=b"current", transfer_type="zipped bag"
+    )
+    dog = watchdog.Watchdog(action=watchdog.ACTION_FAIL)
+    assert dog.threshold(unit) is None
+    assert not dog.check(unit, unit.started + datetime.timedelta(days=365))
+
+
+def test_add_missing_columns(tmpdir):
+    """Test that the columns added since a database was created are added to
+    it when it is opened.
+    """
+    path = str(tmpdir.join("transfers.db"))
+    engine = create_engine("sqlite:///{}".format(path))
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE unit (id INTEGER PRIMARY KEY, uuid VARCHAR(36), "
+                "path BLOB, unit_type VARCHAR(10), status VARCHAR(20), "
+                "microservice VARCHAR(50), current BOOLEAN)"
+            )
+        )
+    engine.dispose()
+    models.init_session(path)
+    try:
+        columns = {
+            c["name"] for c in inspect(models.Session.get_bind()).get_columns("unit")
+        }
+        assert {"transfer_type", "size", "started", "finished"} <= columns
+        models.add_new_transfer(uuid=str(uuid4()), path=b"new", size=1)
+    finally:
+        models.cleanup_session()
+        models.Session = models.transfer_session = None
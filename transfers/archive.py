@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Archive Finished Units.
+
+Move the units finished before a cutoff out of the unit table of the
+automation tools database, into its unit_archive table or into another
+database, then compact the database. The paths of the archived units are
+still never started again. Meant to be run from cron, e.g. weekly.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import datetime
+import logging
+import os
+import sys
+
+# Allow execution as an executable and the script to be run at package level
+# by ensuring that it can see itself.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transfers import defaults, loggingconfig, models, runlock
+from transfers.config import get_config
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__))
+
+LOGGER = logging.getLogger("transfers")
+
+# Units finished for longer than this, in days, are archived.
+DEFAULT_MAX_AGE = 30
+
+
+def main(
+    config_file=None, max_age=None, archive_url=None, vacuum=True, log_level="INFO"
+):
+    """Primary entry point for the archival of finished units."""
+    config = get_config(config_file)
+    loggingconfig.setup(
+        log_level, config.get("logfile", defaults.TRANSFER_LOG_FILE), config=config
+    )
+    if max_age is None:
+        max_age = config.getint("archiveafter", DEFAULT_MAX_AGE)
+    archive_url = archive_url or config.get("archiveurl")
+
+    # Take the lock of the automation tools so that no transfer is started
+    # while the database is being compacted.
+    lock = runlock.RunLock(
+        config.get("pidfile", os.path.join(THIS_DIR, "pid.lck")),
+        lease=config.getint("locklease", runlock.DEFAULT_LEASE),
+    )
+    if not lock.acquire():
+        LOGGER.info("The automation tools are running, see %s", lock.path)
+        return 0
+    try:
+        models.init_session(**config.database_options())
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=max_age)
+        count = models.archive_units(cutoff, archive_url=archive_url)
+        LOGGER.info("Archived %s units finished before %s", count, cutoff)
+        if vacuum:
+            models.compact()
+        models.cleanup_session()
+    finally:
+        lock.release()
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "-c",
+        "--config-file",
+        metavar="FILE",
+        help="Configuration file(log/db/PID files)",
+        default=None,
+    )
+    parser.add_argument(
+        "--older-than",
+        metavar="DAYS",
+        type=int,
+        help="Archive the units finished more than DAYS ago. Default: the "
+        "archiveafter setting, or %s." % DEFAULT_MAX_AGE,
+    )
+    parser.add_argument(
+        "--archive-url",
+        metavar="URL",
+        help="SQLAlchemy URL of the database to move the units to, e.g. "
+        "sqlite:////var/archivematica/automation-tools/archive.db. Default: the "
+        "unit_archive table of the automation tools database.",
+    )
+    parser.add_argument(
+        "--no-vacuum",
+        action="store_true",
+        help="Do not compact the database after archiving the units.",
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=["ERROR", "WARNING", "INFO", "DEBUG"],
+        default=defaults.DEFAULT_LOG_LEVEL,
+        help="Set the debugging output level.",
+    )
+    args = parser.parse_args()
+
+    sys.exit(
+        main(
+            config_file=args.config_file,
+            max_age=args.older_than,
+            archive_url=args.archive_url,
+            vacuum=not args.no_vacuum,
+            log_level=args.log_level,
+        )
+    )
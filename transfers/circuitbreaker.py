@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+"""Stop calling Archivematica or the Storage Service while they are down.
+
+Each endpoint, i.e. the scheme and host of the URLs called, has a circuit
+breaker. It is closed while the endpoint can be reached. After
+``failure_threshold`` consecutive connection failures it opens, and calls to
+the endpoint fail straight away with ``errors.ERR_SERVER_CONN`` instead of
+waiting for the connection to time out. Once ``reset_timeout`` seconds have
+passed the breaker is half-open: a single call is let through to probe the
+endpoint, closing the breaker if it succeeds or opening it again if not.
+
+The state of the breakers is kept in the database of each script between
+runs, see ``load`` and ``save``.
+"""
+
+import functools
+import logging
+import threading
+import time
+
+from sqlalchemy import Column, Float, Integer, String
+from sqlalchemy.ext.declarative import declarative_base
+
+from transfers import errors
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+LOGGER = logging.getLogger("transfers")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_RESET_TIMEOUT = 300
+
+Base = declarative_base()
+
+# Circuit breakers by endpoint, see get_breaker.
+_BREAKERS = {}
+_SETTINGS = {
+    "failure_threshold": DEFAULT_FAILURE_THRESHOLD,
+    "reset_timeout": DEFAULT_RESET_TIMEOUT,
+}
+_LOCK = threading.Lock()
+
+
+class BreakerState(Base):
+    """State of the circuit breaker of an endpoint at the end of a run."""
+
+    __tablename__ = "circuit_breaker"
+    endpoint = Column(String(255), primary_key=True)
+    state = Column(String(10), nullable=False)
+    failures = Column(Integer, nullable=False, default=0)
+    opened_at = Column(Float)
+
+    def __repr__(self):
+        return "<BreakerState(endpoint={s.endpoint}, state={s.state})>".format(s=self)
+
+
+class CircuitBreaker(object):
+    """Closed, open or half-open state of the calls to an endpoint."""
+
+    def __init__(
+        self,
+        endpoint,
+        failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout=DEFAULT_RESET_TIMEOUT,
+        clock=time.time,
+    ):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        # Calls can be made from the threads of transfer_async.
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<CircuitBreaker({s.endpoint}, {s.state})>".format(s=self)
+
+    def _probe_due(self):
+        return self.clock() - (self.opened_at or 0) >= self.reset_timeout
+
+    def available(self):
+        """Return whether a call to the endpoint would be let through,
+        without using up the probe of a half-open breaker.
+        """
+        with self._lock:
+            if self.state == OPEN:
+                return self._probe_due()
+            return self.state == CLOSED
+
+    def allow(self):
+        """Return whether a call to the endpoint can be made now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self._probe_due():
+                LOGGER.info("Checking whether %s is back", self.endpoint)
+                self.state = HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                LOGGER.info("%s is available again", self.endpoint)
+            self.state = CLOSED
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED and self.failures >= self.failure_threshold
+            ):
+                LOGGER.warning(
+                    "%s is unavailable after %s failed calls, not calling it "
+                    "for %s seconds",
+                    self.endpoint,
+                    self.failures,
+                    self.reset_timeout,
+                )
+                self.state = OPEN
+                self.opened_at = self.clock()
+
+    def restore(self, state, failures, opened_at):
+        """Set the state saved by an earlier run."""
+        with self._lock:
+            # A probe left unanswered by the earlier run is due again.
+            self.state = OPEN if state == HALF_OPEN else state
+            self.failures = failures or 0
+            self.opened_at = opened_at
+
+    def snapshot(self):
+        """Return the state to save for later runs."""
+        with self._lock:
+            return {
+                "endpoint": self.endpoint,
+                "state": self.state,
+                "failures": self.failures,
+                "opened_at": self.opened_at,
+            }
+
+
+def endpoint(url):
+    """Return the endpoint, i.e. scheme and host, of ``url``."""
+    parts = urlsplit(url)
+    if not parts.netloc:
+        return url
+    return "{}://{}".format(parts.scheme, parts.netloc)
+
+
+def configure(failure_threshold=None, reset_timeout=None):
+    """Set the thresholds of the circuit breakers. None keeps the current
+    value.
+    """
+    with _LOCK:
+        if failure_threshold is not None:
+            _SETTINGS["failure_threshold"] = failure_threshold
+        if reset_timeout is not None:
+            _SETTINGS["reset_timeout"] = reset_timeout
+        for breaker in _BREAKERS.values():
+            breaker.failure_threshold = _SETTINGS["failure_threshold"]
+            breaker.reset_timeout = _SETTINGS["reset_timeout"]
+
+
+def get_breaker(url):
+    """Return the circuit breaker of the endpoint of ``url``."""
+    key = endpoint(url)
+    with _LOCK:
+        breaker = _BREAKERS.get(key)
+        if breaker is None:
+            breaker = _BREAKERS[key] = CircuitBreaker(key, **_SETTINGS)
+        return breaker
+
+
+def reset():
+    """Forget the state and settings of all the breakers."""
+    with _LOCK:
+        _BREAKERS.clear()
+        _SETTINGS.update(
+            failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+            reset_timeout=DEFAULT_RESET_TIMEOUT,
+        )
+
+
+def guard(func):
+    """Decorate a function with the signature and error codes of
+    ``utils._call_url_json`` so that it fails fast while the endpoint of the
+    URL is unavailable.
+    """
+    if getattr(func, "circuit_breaker", False):
+        return func
+
+    @functools.wraps(func)
+    def wrapper(url, *args, **kwargs):
+        breaker = get_breaker(url)
+        if not breaker.allow():
+            LOGGER.debug(
+                "Not calling %s while %s is unavailable", url, breaker.endpoint
+            )
+            return errors.ERR_SERVER_CONN
+        result = func(url, *args, **kwargs)
+        if isinstance(result, int) and result == errors.ERR_SERVER_CONN:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return result
+
+    wrapper.circuit_breaker = True
+    return wrapper
+
+
+def guard_amclient():
+    """Guard the calls made through amclient, which all go through its own
+    ``utils._call_url_json``.
+    """
+    from amclient import utils as amclient_utils
+
+    amclient_utils._call_url_json = guard(amclient_utils._call_url_json)
+
+
+def load(session):
+    """Read the state of the breakers saved in the database by earlier runs.
+
+    :param session: SQLAlchemy session of the database of the script.
+    """
+    Base.metadata.create_all(session.get_bind())
+    for row in session.query(BreakerState):
+        get_breaker(row.endpoint).restore(row.state, row.failures, row.opened_at)
+
+
+def save(session):
+    """Save the state of the breakers in the database for later runs."""
+    Base.metadata.create_all(session.get_bind())
+    with _LOCK:
+        breakers = list(_BREAKERS.values())
+    for breaker in breakers:
+        session.merge(BreakerState(**breaker.snapshot()))
+    session.commit()
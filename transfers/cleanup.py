@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Hide Completed Units.
+
+Hide the transfers and SIPs completed by the automation tools in the
+Archivematica dashboard.
+
+``transfers.transfer --hide`` queues completed units in the automation tools
+database and hides them once the next transfer has been started. This module
+can also be run on its own, e.g. from cron, to work through the queue and,
+with ``--sweep``, to pick up completed SIPs that were never hidden.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Allow execution as an executable and the script to be run at package level
+# by ensuring that it can see itself.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transfers import circuitbreaker, defaults, loggingconfig, models
+from transfers.config import get_config
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__))
+
+LOGGER = logging.getLogger("transfers")
+
+# Number of concurrent requests made to the dashboard.
+DEFAULT_WORKERS = 8
+
+# Number of times hiding a unit is attempted before giving up on it.
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+# Result of the units not hidden because the dashboard is unavailable.
+UNAVAILABLE = "unavailable"
+
+
+def _hide(session, am_url, params, unit_type, unit_uuid, timeout):
+    """Hide a single unit in the dashboard.
+
+    :returns: None on success, ``UNAVAILABLE`` if the dashboard is known to be
+              unavailable, or a message describing the error.
+    """
+    breaker = circuitbreaker.get_breaker(am_url)
+    if not breaker.allow():
+        return UNAVAILABLE
+    url = "{}/api/{}/{}/delete/".format(am_url, unit_type, unit_uuid)
+    LOGGER.debug("Method: DELETE; URL: %s; params: %s;", url, params)
+    try:
+        response = session.delete(url, params=params, timeout=timeout)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+        breaker.record_failure()
+        return str(err)
+    except requests.exceptions.RequestException as err:
+        return str(err)
+    breaker.record_success()
+    LOGGER.debug("Response: %s", response)
+    # The dashboard no longer knowing about the unit is as good as hiding it.
+    if response.ok or response.status_code == 404:
+        return None
+    return "{} {}".format(response.status_code, response.reason)
+
+
+def sweep():
+    """Queue the completed SIPs in the database that were never hidden, e.g.
+    because they completed before ``--hide`` was used.
+    """
+    sips = models.get_unhidden_completed_sips()
+    for sip in sips:
+        models.queue_hide(uuid=sip.uuid, unit_type="ingest")
+    LOGGER.info("Queued %s completed SIPs to be hidden", len(sips))
+    return len(sips)
+
+
+def hide_units(
+    am_url,
+    am_user,
+    am_api_key,
+    workers=DEFAULT_WORKERS,
+    max_attempts=DEFAULT_MAX_ATTEMPTS,
+    timeout=defaults.REQUEST_TIMEOUT,
+):
+    """Hide the queued units in the dashboard.
+
+    Requests are made concurrently over a pool of persistent connections.
+    The results are written to the database once all requests are done. The
+    units are left in the queue, without counting an attempt, while the
+    dashboard is unavailable, see ``transfers.circuitbreaker``.
+
+    :returns: Number of units that could not be hidden.
+    """
+    hides = models.get_pending_hides(max_attempts)
+    if not hides:
+        return 0
+    if not circuitbreaker.get_breaker(am_url).available():
+        LOGGER.warning("Not hiding units while %s is unavailable", am_url)
+        return len(hides)
+    LOGGER.info("Hiding %s units in dashboard", len(hides))
+    params = {"username": am_user, "api_key": am_api_key}
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        results = list(
+            executor.map(
+                lambda hide: _hide(
+                    session, am_url, params, hide.unit_type, hide.uuid, timeout
+                ),
+                hides,
+            )
+        )
+    finally:
+        executor.shutdown(wait=True)
+        session.close()
+    failures = 0
+    with models.unit_of_work():
+        for hide, error in zip(hides, results):
+            if error is None:
+                models.update_hide_status(hide, models.HIDE_COMPLETE)
+                continue
+            failures += 1
+            if error == UNAVAILABLE:
+                continue
+            LOGGER.warning("Unable to hide %s %s: %s", hide.unit_type, hide.uuid, error)
+            models.update_hide_status(hide, models.HIDE_FAILED, message=error)
+    LOGGER.info("Hidden %s units in dashboard", len(hides) - failures)
+    return failures
+
+
+def main(
+    am_url,
+    am_user,
+    am_api_key,
+    sweep_completed=False,
+    config_file=None,
+    log_level="INFO",
+):
+    """Primary entry point for hiding completed units."""
+    config = get_config(config_file)
+    loggingconfig.setup(
+        log_level, config.get("logfile", defaults.TRANSFER_LOG_FILE), config=config
+    )
+    models.init_session(**config.database_options())
+    circuitbreaker.configure(
+        failure_threshold=config.getint("breakerthreshold"),
+        reset_timeout=config.getint("breakertimeout"),
+    )
+    circuitbreaker.load(models.transfer_session)
+    if sweep_completed:
+        sweep()
+    failures = hide_units(
+        am_url,
+        am_user,
+        am_api_key,
+        workers=config.getint("hideworkers", DEFAULT_WORKERS),
+    )
+    circuitbreaker.save(models.transfer_session)
+    models.cleanup_session()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "-u",
+        "--user",
+        metavar="USERNAME",
+        required=True,
+        help="Username of the Archivematica dashboard user to authenticate as.",
+    )
+    parser.add_argument(
+        "-k",
+        "--api-key",
+        metavar="KEY",
+        required=True,
+        help="API key of the Archivematica dashboard user.",
+    )
+    parser.add_argument(
+        "--am-url",
+        "-a",
+        metavar="URL",
+        help="Archivematica URL. Default: %s" % defaults.DEF_AM_URL,
+        default=defaults.DEF_AM_URL,
+    )
+    parser.add_argument(
+        "--sweep",
+        action="store_true",
+        help="Also hide completed SIPs that were never queued to be hidden.",
+    )
+    parser.add_argument(
+        "-c",
+        "--config-file",
+        metavar="FILE",
+        help="Configuration file(log/db/PID files)",
+        default=None,
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=["ERROR", "WARNING", "INFO", "DEBUG"],
+        default=defaults.DEFAULT_LOG_LEVEL,
+        help="Set the debugging output level.",
+    )
+    args = parser.parse_args()
+
+    sys.exit(
+        main(
+            am_url=args.am_url,
+            am_user=args.user,
+            am_api_key=args.api_key,
+            sweep_completed=args.sweep,
+            config_file=args.config_file,
+            log_level=args.log_level,
+        )
+    )
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""Configuration of the automation tools.
+
+The ``[transfers]`` section of the config file is parsed once per process and
+kept in a ``Config`` object, together with the values given on the command
+line, which take precedence over the file.
+"""
+
+import logging
+import os
+
+try:
+    from configparser import ConfigParser
+except ImportError:
+    from ConfigParser import SafeConfigParser as ConfigParser
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__))
+
+LOGGER = logging.getLogger("transfers")
+
+SECTION = "transfers"
+
+_TRUE = ("1", "yes", "true", "on")
+_FALSE = ("0", "no", "false", "off")
+
+# Config objects by config file path, see get_config.
+_CONFIGS = {}
+
+
+class Config(object):
+    """Settings read from a config file and the command line."""
+
+    def __init__(self, path=None, args=None):
+        """
+        :param str path: Path of the config file, if any.
+        :param dict args: Values given on the command line. Values of None or
+                          False are treated as not given so that the config
+                          file can set them.
+        """
+        self.path = path
+        self.args = {
+            name: value
+            for name, value in (args or {}).items()
+            if value is not None and value is not False
+        }
+        self.settings = {}
+        self.load()
+
+    def __repr__(self):
+        return "<Config {}>".format(self.path)
+
+    def load(self):
+        """Read the settings from the config file."""
+        parser = ConfigParser()
+        if self.path:
+            parser.read(self.path)
+        if parser.has_section(SECTION):
+            self.settings = dict(parser.items(SECTION))
+        else:
+            if self.path:
+                LOGGER.warning("No section: %s in %s", SECTION, self.path)
+            self.settings = {}
+        LOGGER.debug("Configuration values read from %s: %s", self.path, self.settings)
+
+    def get(self, name, default=None):
+        """Return the value of a setting, or ``default`` if it is not set."""
+        if name in self.args:
+            return self.args[name]
+        return self.settings.get(name, default)
+
+    def getint(self, name, default=None):
+        """Return the value of a setting as an integer."""
+        value = self.get(name)
+        if value is None or value == "":
+            return default
+        return int(value)
+
+    def getboolean(self, name, default=False):
+        """Return the value of a setting as a boolean."""
+        value = self.get(name)
+        if value is None or isinstance(value, bool):
+            return default if value is None else value
+        if str(value).lower() in _TRUE:
+            return True
+        if str(value).lower() in _FALSE:
+            return False
+        raise ValueError("Not a boolean for {}: {}".format(name, value))
+
+    def database_options(self):
+        """Return the keyword arguments for ``models.init_session``."""
+        options = {
+            "databasefile": self.get(
+                "databasefile", os.path.join(THIS_DIR, "transfers.db")
+            ),
+            "database_url": self.get("databaseurl"),
+            "journal_mode": self.get("journalmode"),
+            "synchronous": self.get("synchronous"),
+        }
+        if self.get("busytimeout"):
+            options["busy_timeout"] = self.getint("busytimeout")
+        return options
+
+
+def get_config(config_file=None, args=None):
+    """Return the Config for ``config_file``, reading the file the first time
+    it is used in this process.
+
+    :param config_file: Path of the config file, or a Config which is
+                        returned as is.
+    :param dict args: Command line values to merge with the file. A new Config
+                      is read when given.
+    """
+    if isinstance(config_file, Config):
+        return config_file
+    config = _CONFIGS.get(config_file)
+    if config is None or args:
+        config = _CONFIGS[config_file] = Config(config_file, args)
+    return config
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+"""Make the choices at user input prompts automatically.
+
+The rules are read from a JSON file, set with ``userinputrules`` in the config
+file, holding a list of objects with the following keys:
+
+* ``microservice``: Name of the microservice awaiting a decision, e.g.
+  ``"Approve normalization"``. Glob patterns are accepted.
+* ``choice``: UUID of the choice to make, as found in processing configuration
+  files.
+* ``unit_type`` (optional): ``"SIP"`` or ``"transfer"``.
+* ``path`` (optional): Glob pattern the absolute path of the unit has to match.
+
+The first rule matching a prompt is applied through the dashboard. A choice
+only counts as made once the job has left "Awaiting decision". Prompts no rule
+matches, and choices that could not be made, are left to the ``user-input``
+scripts.
+"""
+
+import fnmatch
+import json
+import logging
+import os
+import time
+
+from transfers import circuitbreaker, defaults, errors, models, utils
+
+LOGGER = logging.getLogger("transfers")
+
+# Number of times, and seconds between them, the jobs of a unit are listed to
+# check that a choice has been made.
+VERIFY_ATTEMPTS = 3
+VERIFY_DELAY = 2
+
+# Rules by path and modification time of the file they were read from.
+_RULES = {}
+
+
+class Rule(object):
+    """Choice to make at the user input prompts matching the rule."""
+
+    def __init__(self, index, microservice, choice, unit_type=None, path=None):
+        self.index = index
+        self.microservice = microservice
+        self.choice = choice
+        self.unit_type = unit_type
+        self.path = path
+
+    def __repr__(self):
+        return (
+            "<Rule(index={s.index}, microservice={s.microservice}, "
+            "choice={s.choice})>".format(s=self)
+        )
+
+    def matches(self, microservice, unit_type, path):
+        """Return whether the rule applies to a prompt."""
+        if not fnmatch.fnmatchcase(microservice or "", self.microservice):
+            return False
+        if self.unit_type and _normalize_type(unit_type) != _normalize_type(
+            self.unit_type
+        ):
+            return False
+        if self.path and not fnmatch.fnmatchcase(path or "", self.path):
+            return False
+        return True
+
+
+def _normalize_type(unit_type):
+    unit_type = (unit_type or "").lower()
+    return "sip" if unit_type == "ingest" else unit_type
+
+
+def load_rules(path):
+    """Read the rules from the JSON file at ``path``.
+
+    The rules are read again only if the file has changed.
+    """
+    key = (path, os.path.getmtime(path))
+    if key not in _RULES:
+        with open(path) as rules_file:
+            entries = json.load(rules_file)
+        rules = []
+        for index, entry in enumerate(entries):
+            try:
+                rules.append(
+                    Rule(
+                        index,
+                        entry["microservice"],
+                        entry["choice"],
+                        unit_type=entry.get("unit_type"),
+                        path=entry.get("path"),
+                    )
+                )
+            except (KeyError, TypeError, AttributeError):
+                raise ValueError(
+                    "Rule {} in {} needs a microservice and a choice".format(
+                        index, path
+                    )
+                )
+        LOGGER.info("Loaded %s user input rules from %s", len(rules), path)
+        _RULES[key] = rules
+    return _RULES[key]
+
+
+def match(rules, unit_info):
+    """Return the first rule matching the prompt of a unit, or None."""
+    for rule in rules:
+        if rule.matches(
+            unit_info.get("microservice"), unit_info.get("type"), unit_info.get("path")
+        ):
+            return rule
+    return None
+
+
+def get_waiting_jobs(am_url, am_user, am_api_key, unit_uuid, microservice):
+    """Return the UUIDs of the jobs of a unit awaiting a decision at
+    ``microservice``, or None if they cannot be listed.
+    """
+    url = "{}/api/v2beta/jobs/{}/".format(am_url, unit_uuid)
+    headers = {"Authorization": "ApiKey {}:{}".format(am_user, am_api_key)}
+    jobs = utils._call_url_json(url, {"microservice": microservice}, headers=headers)
+    if isinstance(jobs, int):
+        LOGGER.error(
+            "Unable to list the jobs of %s: %s", unit_uuid, errors.error_lookup(jobs)
+        )
+        return None
+    return [job.get("uuid") for job in jobs if job.get("status") == "USER_INPUT"]
+
+
+def find_waiting_job(am_url, am_user, am_api_key, unit_uuid, microservice):
+    """Return the UUID of the job of a unit awaiting a decision at
+    ``microservice``, or None.
+    """
+    jobs = get_waiting_jobs(am_url, am_user, am_api_key, unit_uuid, microservice)
+    return jobs[0] if jobs else None
+
+
+def execute_choice(am_url, am_user, am_api_key, job_uuid, choice):
+    """Make ``choice`` for the job awaiting a decision.
+
+    Redirects are not followed, as the dashboard redirects the requests it
+    does not accept to its login page.
+
+    :returns: None if the dashboard accepted the choice, or a message
+              describing the error.
+    """
+    import requests
+
+    breaker = circuitbreaker.get_breaker(am_url)
+    if not breaker.allow():
+        return "{} is unavailable".format(breaker.endpoint)
+    url = "{}/mcp/execute/".format(am_url)
+    data = {
+        "uuid": job_uuid,
+        "choice": choice,
+        "username": am_user,
+        "api_key": am_api_key,
+    }
+    headers = {"Authorization": "ApiKey {}:{}".format(am_user, am_api_key)}
+    LOGGER.debug("Method: POST; URL: %s; data: %s;", url, data)
+    try:
+        response = requests.post(
+            url,
+            data=data,
+            headers=headers,
+            allow_redirects=False,
+            timeout=defaults.REQUEST_TIMEOUT,
+        )
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+        breaker.record_failure()
+        return str(err)
+    except requests.exceptions.RequestException as err:
+        return str(err)
+    breaker.record_success()
+    LOGGER.debug("Response: %s", response)
+    if response.status_code != 200:
+        return "{} {}".format(response.status_code, response.reason)
+    content_type = response.headers.get("content-type", "")
+    if "html" in content_type or response.text.lstrip().startswith("<"):
+        LOGGER.debug("Response: %s", response.text)
+        return "Unexpected HTML response, the dashboard may require a login"
+    return None
+
+
+def verify_choice(am_url, am_user, am_api_key, unit_uuid, microservice, job_uuid):
+    """Wait for the job a choice was made for to leave "Awaiting decision".
+
+    :returns: None once it has, or a message describing the error.
+    """
+    for _ in range(VERIFY_ATTEMPTS):
+        time.sleep(VERIFY_DELAY)
+        jobs = get_waiting_jobs(am_url, am_user, am_api_key, unit_uuid, microservice)
+        if jobs is not None and job_uuid not in jobs:
+            return None
+    return "Job {} still awaiting a decision".format(job_uuid)
+
+
+def decide(rules, am_url, am_user, am_api_key, unit_info):
+    """Make the choice of the first rule matching the prompt of a unit.
+
+    Only talks to the dashboard, the outcome is recorded with ``record``.
+
+    :param dict unit_info: Status of the unit from the dashboard.
+    :returns: Dict with the rule, the job and any error, or None if no rule
+              matches the prompt.
+    """
+    rule = match(rules, unit_info)
+    if rule is None:
+        return None
+    outcome = {"rule": rule, "job_uuid": None, "error": None}
+    job_uuid = find_waiting_job(
+        am_url, am_user, am_api_key, unit_info["uuid"], unit_info["microservice"]
+    )
+    if job_uuid is None:
+        outcome["error"] = "No job awaiting a decision"
+        return outcome
+    LOGGER.info(
+        "Choosing %s at %s for %s (rule %s)",
+        rule.choice,
+        unit_info["microservice"],
+        unit_info["uuid"],
+        rule.index,
+    )
+    outcome["job_uuid"] = job_uuid
+    outcome["error"] = execute_choice(
+        am_url, am_user, am_api_key, job_uuid, rule.choice
+    ) or verify_choice(
+        am_url,
+        am_user,
+        am_api_key,
+        unit_info["uuid"],
+        unit_info["microservice"],
+        job_uuid,
+    )
+    return outcome
+
+
+def record(unit_info, outcome):
+    """Record the outcome of ``decide`` in the database.
+
+    :returns: True if the prompt has been dealt with, False if it should be
+              left to the user input scripts.
+    """
+    if outcome is None:
+        return False
+    rule = outcome["rule"]
+    if outcome["job_uuid"] is None:
+        # The choice may have been made on an earlier run and not yet be
+        # reflected in the status of the unit.
+        for decision in reversed(models.get_decisions(unit_info["uuid"])):
+            if decision.microservice == unit_info["microservice"]:
+                if decision.status == models.DECISION_APPLIED:
+                    return True
+                break
+    status = models.DECISION_FAILED if outcome["error"] else models.DECISION_APPLIED
+    models.record_decision(
+        uuid=unit_info["uuid"],
+        unit_type=unit_info.get("type"),
+        microservice=unit_info["microservice"],
+        choice=rule.choice,
+        rule=rule.index,
+        status=status,
+        job_uuid=outcome["job_uuid"],
+        message=outcome["error"],
+    )
+    if outcome["error"]:
+        LOGGER.warning(
+            "Unable to apply rule %s to %s: %s",
+            rule.index,
+            unit_info["uuid"],
+            outcome["error"],
+        )
+        return False
+    return True
+
+
+def resolve(rules, am_url, am_user, am_api_key, unit_info):
+    """Decide the prompt of a unit and record the outcome.
+
+    :returns: True if the prompt has been dealt with.
+    """
+    return record(unit_info, decide(rules, am_url, am_user, am_api_key, unit_info))
@@ -34,3 +34,11 @@ DEFAULT_REINGEST_TYPE = "full"
 
 # Default transfer type
 DEFAULT_TRANSFER_TYPE = "standard"
+
+# Default lease, in seconds, of the transfer source paths claimed by a worker
+# when several workers share the database
+WORKER_LEASE = 3600
+
+# Number of seconds after which requests made directly with requests, rather
+# than through amclient, give up on a server that does not respond
+REQUEST_TIMEOUT = 60
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Delete Transfer Source Files.
+
+Worker that deletes the source files of completed transfers queued in the
+automation tools database by ``transfers.transfer --delete-on-complete``.
+
+Deleting a large transfer can take a long time, particularly on network
+storage, so it is done here in the background rather than while the
+automation tools are checking the status of the current unit and starting the
+next transfer. Directories are walked and emptied by a pool of threads, and
+failed deletions are retried on the next run of the worker until the
+configured number of attempts is exhausted.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import errno
+import logging
+import os
+import subprocess
+import sys
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Allow execution as an executable and the script to be run at package level
+# by ensuring that it can see itself.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transfers import defaults, loggingconfig, models, runlock
+from transfers.config import get_config
+from transfers.utils import fsencode
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__))
+
+LOGGER = logging.getLogger("transfers")
+
+# Number of threads used to walk and empty a directory tree.
+DEFAULT_WORKERS = 4
+
+# Number of times a deletion is attempted before it is reported as failed.
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+def move_to_trash(path, trash_dir):
+    """Move ``path`` into ``trash_dir`` so that it disappears from its
+    original location straight away.
+
+    The move is a rename so ``trash_dir`` needs to be on the same filesystem
+    as ``path``. If it is not, or if no trash directory is configured, the
+    files are deleted from where they are.
+
+    :returns: Path the files will be deleted from.
+    """
+    if not trash_dir:
+        return path
+    trash_dir = fsencode(trash_dir)
+    trash_path = os.path.join(
+        trash_dir,
+        fsencode(uuid.uuid4().hex) + b"-" + os.path.basename(path.rstrip(b"/")),
+    )
+    try:
+        if not os.path.isdir(trash_dir):
+            os.makedirs(trash_dir)
+        os.rename(path, trash_path)
+    except OSError as err:
+        if err.errno == errno.EXDEV:
+            LOGGER.warning(
+                "Trash directory %s is not on the same filesystem as %s, "
+                "deleting in place",
+                trash_dir,
+                path,
+            )
+        else:
+            LOGGER.warning("Unable to move %s to trash: %s", path, err)
+        return path
+    LOGGER.info("Moved %s to %s", path, trash_path)
+    return trash_path
+
+
+def schedule_deletion(path, trash_dir=None):
+    """Move the source files of a transfer out of the way and queue them for
+    deletion by the worker.
+    """
+    path = os.path.abspath(fsencode(path))
+    trash_path = move_to_trash(path, trash_dir)
+    return models.queue_deletion(
+        path=path, trash_path=trash_path if trash_path != path else None
+    )
+
+
+def _clear_directory(directory):
+    """Delete the files in ``directory`` and return its subdirectories."""
+    subdirectories = []
+    for name in os.listdir(directory):
+        entry = os.path.join(directory, name)
+        if os.path.isdir(entry) and not os.path.islink(entry):
+            subdirectories.append(entry)
+        else:
+            os.remove(entry)
+    return subdirectories
+
+
+def rmtree_parallel(path, workers=DEFAULT_WORKERS):
+    """Delete the tree at ``path``, listing and emptying its directories
+    concurrently.
+
+    Each directory found is handed to the pool as soon as its parent has been
+    listed, so wide trees are walked in parallel. The emptied directories are
+    removed deepest first once the walk is complete.
+    """
+    if not os.path.isdir(path) or os.path.islink(path):
+        os.remove(path)
+        return
+    directories = [path]
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        pending = {executor.submit(_clear_directory, path)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for subdirectory in future.result():
+                    directories.append(subdirectory)
+                    pending.add(executor.submit(_clear_directory, subdirectory))
+    finally:
+        executor.shutdown(wait=True)
+    # Children are always listed after their parents.
+    for directory in reversed(directories):
+        os.rmdir(directory)
+
+
+def delete(deletion, trash_dir=None, workers=DEFAULT_WORKERS):
+    """Carry out a queued deletion and record the outcome.
+
+    :returns: True if the source files are gone, False otherwise.
+    """
+    if deletion.trash_path is None and trash_dir:
+        trash_path = move_to_trash(deletion.path, trash_dir)
+        if trash_path != deletion.path:
+            models.update_deletion_trash_path(deletion, trash_path)
+    path = deletion.trash_path or deletion.path
+    LOGGER.info("Deleting %s", path)
+    try:
+        rmtree_parallel(path, workers=workers)
+    except OSError as err:
+        if err.errno == errno.ENOENT and not os.path.lexists(path):
+            LOGGER.info("%s has already been deleted", path)
+        else:
+            LOGGER.warning("Error deleting %s: %s", path, err)
+            models.update_deletion_status(
+                deletion, models.DELETION_FAILED, message=str(err)
+            )
+            return False
+    LOGGER.info("Source files deleted: %s", deletion.path)
+    models.update_deletion_status(deletion, models.DELETION_COMPLETE)
+    return True
+
+
+def process_queue(
+    trash_dir=None, workers=DEFAULT_WORKERS, max_attempts=DEFAULT_MAX_ATTEMPTS
+):
+    """Work through the pending deletions in the database.
+
+    :returns: Number of deletions that failed in this run.
+    """
+    failures = 0
+    for deletion in models.get_pending_deletions(max_attempts):
+        if not delete(deletion, trash_dir=trash_dir, workers=workers):
+            failures += 1
+    for deletion in models.get_failed_deletions(max_attempts):
+        LOGGER.error(
+            "Giving up deleting %s after %s attempts: %s",
+            deletion.trash_path or deletion.path,
+            deletion.attempts,
+            deletion.message,
+        )
+    return failures
+
+
+def spawn_worker(config_file=None):
+    """Start the deletion worker in a separate process and return without
+    waiting for it.
+    """
+    command = [sys.executable, "-m", "transfers.deletion"]
+    if config_file:
+        command += ["--config-file", config_file]
+    LOGGER.info("Starting deletion worker: %s", command)
+    with open(os.devnull, "r+b") as devnull:
+        subprocess.Popen(
+            command,
+            cwd=os.path.dirname(THIS_DIR),
+            stdin=devnull,
+            stdout=devnull,
+            stderr=devnull,
+            close_fds=True,
+            preexec_fn=os.setsid,
+        )
+
+
+def report(max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Print the deletions that have failed and will not be retried."""
+    for deletion in models.get_failed_deletions(max_attempts):
+        print(deletion, deletion.message)
+
+
+def main(config_file=None, log_level="INFO", report_only=False):
+    """Primary entry point for the deletion worker."""
+    config = get_config(config_file)
+    loggingconfig.setup(
+        log_level, config.get("logfile", defaults.TRANSFER_LOG_FILE), config=config
+    )
+    models.init_session(**config.database_options())
+    max_attempts = config.getint("deletionattempts", DEFAULT_MAX_ATTEMPTS)
+    if report_only:
+        report(max_attempts)
+        return 0
+
+    lock = runlock.RunLock(
+        config.get("deletionpidfile", os.path.join(THIS_DIR, "deletion-pid.lck")),
+        lease=config.getint("locklease", runlock.DEFAULT_LEASE),
+    )
+    if not lock.acquire():
+        LOGGER.info("Deletion worker is already running, see %s", lock.path)
+        return 0
+    try:
+        failures = process_queue(
+            trash_dir=config.get("deletiontrashdir"),
+            workers=config.getint("deletionworkers", DEFAULT_WORKERS),
+            max_attempts=max_attempts,
+        )
+    finally:
+        lock.release()
+    models.cleanup_session()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "-c",
+        "--config-file",
+        metavar="FILE",
+        help="Configuration file(log/db/PID files)",
+        default=None,
+    )
+    parser.add_argument(
+        "--report",
+        action="store_true",
+        help="Print the deletions that have failed and exit.",
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=["ERROR", "WARNING", "INFO", "DEBUG"],
+        default=defaults.DEFAULT_LOG_LEVEL,
+        help="Set the debugging output level.",
+    )
+    args = parser.parse_args()
+
+    sys.exit(
+        main(
+            config_file=args.config_file,
+            log_level=args.log_level,
+            report_only=args.report,
+        )
+    )
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Find Duplicate Transfer Sources.
+
+The automation tools only skip the transfer sources whose path has been
+processed before, so renamed or deposited again copies of material already
+ingested go through the pipeline again. With ``fingerprint`` set in the config
+file, and the transfer source location mounted locally (``preflightroot``),
+the fingerprint of each transfer source is recorded when its transfer is
+started. A candidate whose fingerprint matches one recorded under another path
+is held for review rather than started.
+
+The quick fingerprint covers the relative paths, sizes and modification times
+of the files. With ``fingerprint = sampled`` or ``full``, a hash of samples of
+the content of the files, or of all of it, confirms a match, the files being
+hashed in a pool of processes.
+
+Run on its own, this module lists the held transfer sources, releases them
+for ingest or records the fingerprints of the transfer sources processed
+before fingerprints were recorded.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import hashlib
+import logging
+import os
+import sys
+
+# Allow execution as an executable and the script to be run at package level
+# by ensuring that it can see itself.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transfers import defaults, loggingconfig, models, preflight
+from transfers.config import get_config
+from transfers.utils import fsdecode, fsencode
+
+LOGGER = logging.getLogger("transfers")
+
+MODE_QUICK = "quick"
+MODE_SAMPLED = "sampled"
+MODE_FULL = "full"
+MODES = (MODE_QUICK, MODE_SAMPLED, MODE_FULL)
+
+# Size in bytes of the samples read at the start, middle and end of files.
+DEFAULT_SAMPLE_SIZE = 64 * 1024
+
+
+def _files(path):
+    """Return the relative paths and paths of the files of ``path``, sorted
+    by relative path. A file on its own has an empty relative path, so that
+    renamed copies match.
+    """
+    if os.path.isfile(path):
+        return [(b"", path)]
+    files = []
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            file_path = os.path.join(dirpath, name)
+            files.append((os.path.relpath(file_path, path), file_path))
+    return sorted(files)
+
+
+def quick_fingerprint(path):
+    """Return the fingerprint of the relative paths, sizes and modification
+    times of the files of ``path``.
+    """
+    digest = hashlib.sha256()
+    for relpath, file_path in _files(fsencode(path)):
+        stat = os.stat(file_path)
+        digest.update(
+            b"\0".join(
+                [relpath, str(stat.st_size).encode(), str(int(stat.st_mtime)).encode()]
+            )
+            + b"\n"
+        )
+    return digest.hexdigest()
+
+
+def sample_file(job):
+    """Hash samples of a file, or all of it if the sample size is None.
+
+    :param tuple job: Path and sample size.
+    :returns: Tuple of the path and the hex digest.
+    """
+    path, sample_size = job
+    digest = hashlib.sha256()
+    with open(path, "rb") as file_:
+        if sample_size is None:
+            for chunk in iter(lambda: file_.read(preflight.DEFAULT_BUFFER_SIZE), b""):
+                digest.update(chunk)
+        else:
+            size = os.fstat(file_.fileno()).st_size
+            middle = max(size // 2 - sample_size // 2, 0)
+            for offset in sorted({0, middle, max(size - sample_size, 0)}):
+                file_.seek(offset)
+                digest.update(file_.read(sample_size))
+    return path, digest.hexdigest()
+
+
+def content_fingerprint(
+    path, mode=MODE_SAMPLED, processes=None, sample_size=DEFAULT_SAMPLE_SIZE
+):
+    """Return the fingerprint of the content of the files of ``path``."""
+    files = _files(fsencode(path))
+    if mode == MODE_FULL:
+        sample_size = None
+    jobs = [(file_path, sample_size) for _, file_path in files]
+    digests = dict(preflight.hash_files(jobs, processes, func=sample_file))
+    digest = hashlib.sha256()
+    for relpath, file_path in files:
+        digest.update(relpath + b"\0" + digests[file_path].encode() + b"\n")
+    return digest.hexdigest()
+
+
+def fingerprint(path, mode, processes=None):
+    """Return the quick and content fingerprints of ``path``, the latter being
+    None in quick mode.
+    """
+    if mode not in MODES:
+        raise ValueError("Invalid fingerprint mode: {}".format(mode))
+    quick = quick_fingerprint(path)
+    content = None
+    if mode != MODE_QUICK:
+        content = content_fingerprint(path, mode, processes)
+    return quick, content
+
+
+def find_duplicate(target, quick, content):
+    """Return the path of a transfer source ingested before that ``target``
+    duplicates, or None.
+    """
+    if models.is_released(target):
+        return None
+    for match in models.find_fingerprints(quick, exclude_path=target):
+        # Without both content fingerprints, the quick one has to do.
+        if content is None or match.content is None or match.content == content:
+            return match.path
+    return None
+
+
+def index(config, root, mode):
+    """Record the fingerprints of the transfer sources processed before, still
+    in the transfer source location, which have none.
+
+    :returns: Number of fingerprints recorded.
+    """
+    fingerprinted = models.get_fingerprinted_paths()
+    units = models.transfer_session.query(models.Unit).filter(
+        models.Unit.status.in_(("COMPLETE", "PROCESSING", "USER_INPUT"))
+    )
+    count = 0
+    with models.unit_of_work():
+        for unit in units:
+            path = os.path.join(root, unit.path)
+            if unit.path in fingerprinted or not os.path.exists(path):
+                continue
+            quick, content = fingerprint(
+                path, mode, processes=config.getint("preflightprocesses")
+            )
+            models.add_fingerprint(unit.path, quick, content, uuid=unit.uuid)
+            fingerprinted.add(unit.path)
+            count += 1
+    return count
+
+
+def main(config_file=None, release=None, index_sources=False, log_level="INFO"):
+    """Primary entry point for the review of held transfer sources."""
+    config = get_config(config_file)
+    loggingconfig.setup(
+        log_level, config.get("logfile", defaults.TRANSFER_LOG_FILE), config=config
+    )
+    models.init_session(**config.database_options())
+    try:
+        if release:
+            if not models.release_held(fsencode(release)):
+                print("No held transfer source: {}".format(release))
+                return 1
+            print("Released {}".format(release))
+        elif index_sources:
+            mode, root = config.get("fingerprint"), config.get("preflightroot")
+            if not mode or not root:
+                print("fingerprint and preflightroot have to be set")
+                return 1
+            print(
+                "Recorded {} fingerprints".format(index(config, fsencode(root), mode))
+            )
+        else:
+            held = models.transfer_session.query(models.Unit).filter_by(status="HELD")
+            for unit in held.order_by(models.Unit.id):
+                print("{} held since {}".format(fsdecode(unit.path), unit.started))
+    finally:
+        models.cleanup_session()
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "-c",
+        "--config-file",
+        metavar="FILE",
+        help="Configuration file(log/db/PID files)",
+        default=None,
+    )
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        "--release",
+        metavar="PATH",
+        help="Start the held transfer source PATH, relative to the transfer "
+        "source location, on a later run.",
+    )
+    group.add_argument(
+        "--index",
+        action="store_true",
+        help="Record the fingerprints of the transfer sources processed before.",
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=["ERROR", "WARNING", "INFO", "DEBUG"],
+        default=defaults.DEFAULT_LOG_LEVEL,
+        help="Set the debugging output level.",
+    )
+    args = parser.parse_args()
+
+    sys.exit(
+        main(
+            config_file=args.config_file,
+            release=args.release,
+            index_sources=args.index,
+            log_level=args.log_level,
+        )
+    )
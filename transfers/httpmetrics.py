@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Time the HTTP Calls Made to Archivematica, the Storage Service and AtoM.
+
+Once ``install`` has been called, every request made through ``requests``,
+including those of amclient, is timed and counted against its logical
+endpoint, e.g. ``browse`` or ``status``, with its status code, the size of
+its response and the number of times it was retried. At the end of a run the
+scripts log a summary of the calls, with the time spent outside of them, see
+``summary``, and add them to the totals kept in their database, see ``save``.
+
+Run on its own, this module prints the totals kept in the database.
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import datetime
+import functools
+import os
+import re
+import sys
+import threading
+import timeit
+
+from sqlalchemy import BigInteger, Column, DateTime, Float, Integer, String
+from sqlalchemy.ext.declarative import declarative_base
+
+# Allow execution as an executable and the script to be run at package level
+# by ensuring that it can see itself.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+Base = declarative_base()
+
+# Logical endpoints, by pattern of the path of their URLs. The calls to the
+# other URLs are counted against their method and path, see endpoint_name.
+ENDPOINTS = (
+    (re.compile(r"/api/v2/location/[^/]+/browse/?$"), "browse"),
+    (re.compile(r"/api/(transfer|ingest)/status/[^/]+/?$"), "status"),
+    (re.compile(r"/api/transfer/start_transfer/?$"), "start_transfer"),
+    (re.compile(r"/api/v2beta/package/?$"), "create_package"),
+    (re.compile(r"/api/transfer/unapproved/?$"), "unapproved"),
+    (re.compile(r"/api/transfer/approve/?$"), "approve"),
+    (re.compile(r"/api/v2/file/[^/]+/?$"), "package details"),
+    (re.compile(r"/sword/deposit/[^/]+/?$"), "deposit"),
+)
+_ID_SEGMENT = re.compile(r"^([0-9a-fA-F]{8}(-[0-9a-fA-F]{4}){3}-[0-9a-fA-F]{12}|\d+)$")
+
+# Statistics by endpoint name since the last save.
+_STATS = {}
+_LOCK = threading.Lock()
+
+
+class EndpointMetrics(Base):
+    """Totals of the calls made to an endpoint over all runs."""
+
+    __tablename__ = "http_metrics"
+    endpoint = Column(String(255), primary_key=True)
+    calls = Column(Integer, nullable=False, default=0)
+    errors = Column(Integer, nullable=False, default=0)
+    retries = Column(Integer, nullable=False, default=0)
+    seconds = Column(Float, nullable=False, default=0)
+    max_seconds = Column(Float, nullable=False, default=0)
+    bytes = Column(BigInteger(), nullable=False, default=0)
+    updated = Column(DateTime)
+
+    def __repr__(self):
+        return "<EndpointMetrics(endpoint={s.endpoint}, calls={s.calls})>".format(
+            s=self
+        )
+
+
+class Stats(object):
+    """Calls made to an endpoint."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.bytes = 0
+        self.statuses = {}
+
+    def add(self, seconds, status=None, size=0, retries=0):
+        self.calls += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.bytes += size or 0
+        self.retries += retries
+        if status is None or status >= 400:
+            self.errors += 1
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+
+def endpoint_name(method, url):
+    """Return the logical endpoint of a call to ``url``."""
+    path = urlsplit(url).path
+    for pattern, name in ENDPOINTS:
+        if pattern.search(path):
+            return name
+    segments = [
+        "<id>" if _ID_SEGMENT.match(segment) else segment for segment in path.split("/")
+    ]
+    return "{} {}".format(method.upper(), "/".join(segments))
+
+
+def record(name, seconds, status=None, size=0, retries=0):
+    """Count a call to the endpoint ``name``.
+
+    :param int status: HTTP status code, None if no response was received.
+    """
+    with _LOCK:
+        _STATS.setdefault(name, Stats()).add(seconds, status, size, retries)
+
+
+def get_stats():
+    """Return a copy of the statistics by endpoint name since the last save."""
+    with _LOCK:
+        return dict(_STATS)
+
+
+def reset():
+    with _LOCK:
+        _STATS.clear()
+
+
+def _retries(response):
+    retries = getattr(response.raw, "retries", None)
+    return len(getattr(retries, "history", None) or ())
+
+
+def _size(response, stream):
+    if stream:
+        # Reading the content of a streamed response would defeat the purpose.
+        return int(response.headers.get("Content-Length") or 0)
+    return len(response.content or b"")
+
+
+def _timed(send):
+    @functools.wraps(send)
+    def wrapper(session, request, **kwargs):
+        name = endpoint_name(request.method, request.url)
+        start = timeit.default_timer()
+        try:
+            response = send(session, request, **kwargs)
+        except Exception:
+            record(name, timeit.default_timer() - start)
+            raise
+        record(
+            name,
+            timeit.default_timer() - start,
+            response.status_code,
+            _size(response, kwargs.get("stream")),
+            _retries(response),
+        )
+        return response
+
+    wrapper.timed = True
+    return wrapper
+
+
+def install():
+    """Time the requests sent from now on, through ``requests`` or amclient."""
+    import requests
+
+    if not getattr(requests.Session.send, "timed", False):
+        requests.Session.send = _timed(requests.Session.send)
+
+
+def summary(run_seconds=None):
+    """Return a line summing up the calls made since the last save.
+
+    :param float run_seconds: Duration of the run, to tell the time spent
+                              outside of HTTP calls.
+    """
+    stats = get_stats()
+    parts = [
+        "{} {} in {:.2f}s{}".format(
+            name,
+            stat.calls,
+            stat.seconds,
+            " ({} failed)".format(stat.errors) if stat.errors else "",
+        )
+        for name, stat in sorted(stats.items())
+    ]
+    line = "HTTP calls: {}".format(", ".join(parts) or "none")
+    if run_seconds is not None:
+        http_seconds = sum(stat.seconds for stat in stats.values())
+        line += "; {:.2f}s of the {:.2f}s run outside of HTTP calls".format(
+            max(run_seconds - http_seconds, 0), run_seconds
+        )
+    return line
+
+
+def save(session):
+    """Add the calls made since the last save to the totals kept in the
+    database.
+
+    :param session: SQLAlchemy session of the database of the script.
+    """
+    Base.metadata.create_all(session.get_bind())
+    with _LOCK:
+        stats = dict(_STATS)
+        _STATS.clear()
+    now = datetime.datetime.now()
+    for name, stat in stats.items():
+        row = session.query(EndpointMetrics).filter_by(endpoint=name).first()
+        session.merge(
+            EndpointMetrics(
+                endpoint=name,
+                calls=stat.calls + (row.calls if row else 0),
+                errors=stat.errors + (row.errors if row else 0),
+                retries=stat.retries + (row.retries if row else 0),
+                seconds=stat.seconds + (row.seconds if row else 0),
+                max_seconds=max(stat.max_seconds, row.max_seconds if row else 0),
+                bytes=stat.bytes + (row.bytes if row else 0),
+                updated=now,
+            )
+        )
+    session.commit()
+
+
+def main(config_file=None):
+    """Print the totals of the HTTP calls kept in the database."""
+    from transfers import models
+    from transfers.config import get_config
+
+    models.init_session(**get_config(config_file).database_options())
+    try:
+        Base.metadata.create_all(models.transfer_session.get_bind())
+        rows = models.transfer_session.query(EndpointMetrics).order_by(
+            EndpointMetrics.seconds.desc()
+        )
+        for row in rows:
+            print(
+                "{}: {} calls, {} failed, {} retries, {:.3f}s average, "
+                "{:.3f}s max, {} bytes".format(
+                    row.endpoint,
+                    row.calls,
+                    row.errors,
+                    row.retries,
+                    row.seconds / row.calls if row.calls else 0,
+                    row.max_seconds,
+                    row.bytes,
+                )
+            )
+    finally:
+        models.cleanup_session()
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "-c",
+        "--config-file",
+        metavar="FILE",
+        help="Configuration file(log/db/PID files)",
+        default=None,
+    )
+    args = parser.parse_args()
+
+    sys.exit(main(config_file=args.config_file))
@@ -1,37 +1,247 @@
 # -*- coding: utf-8 -*-
 
+import atexit
+import contextlib
+import datetime
+import json
 import logging
 import logging.config  # Has to be imported separately
+import logging.handlers
+import os
+import shutil
+import threading
 
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
 
-def setup(log_level, log_file_name):
-    """Configure the logging system."""
-    # Log format string for flake8 compliance
-    log_fmt = "%(levelname)-8s  %(asctime)s " "%(filename)s:%(lineno)-4s %(message)s"
+LOG_FORMAT_TEXT = "text"
+LOG_FORMAT_JSON = "json"
+
+# Format of the records in text logs.
+TEXT_FORMAT = "%(levelname)-8s  %(asctime)s %(filename)s:%(lineno)-4s %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Size in bytes past which the log file is rotated, and number of rotated
+# files kept.
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 2
+# Number of characters past which log messages are truncated.
+DEFAULT_MAX_MESSAGE = 10000
+
+# Fields added to the records logged in the current thread, see context().
+_CONTEXT = threading.local()
+# Listeners writing the records queued by the loggers, see setup().
+_LISTENERS = []
+
+
+class ContextFilter(logging.Filter):
+    """Add the unit and stage of the current thread to the records."""
+
+    def filter(self, record):
+        record.unit = getattr(_CONTEXT, "unit", None)
+        record.stage = getattr(_CONTEXT, "stage", None)
+        return True
+
+
+class TruncateFilter(logging.Filter):
+    """Truncate the messages longer than ``max_length`` characters.
+
+    It is set on the handlers, so that with ``logqueue`` the messages are
+    formatted by the listener thread. Records are only truncated once, though
+    they go through several handlers.
+    """
+
+    def __init__(self, max_length=DEFAULT_MAX_MESSAGE):
+        super(TruncateFilter, self).__init__()
+        self.max_length = max_length
+
+    def filter(self, record):
+        if not self.max_length or getattr(record, "truncated", False):
+            return True
+        message = record.getMessage()
+        if len(message) > self.max_length:
+            record.msg = "{}... [{} characters truncated]".format(
+                message[: self.max_length], len(message) - self.max_length
+            )
+            record.args = None
+        record.truncated = True
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """Format records as JSON objects, one per line."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.utcfromtimestamp(record.created).isoformat()
+            + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "location": "{}:{}".format(record.filename, record.lineno),
+            "message": record.getMessage(),
+        }
+        for field in ("unit", "stage"):
+            if getattr(record, field, None):
+                entry[field] = getattr(record, field)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def _gzip_namer(name):
+    return name + ".gz"
+
+
+def _gzip_rotator(source, dest):
+    import gzip
+
+    with open(source, "rb") as source_file:
+        with gzip.open(dest, "wb") as dest_file:
+            shutil.copyfileobj(source_file, dest_file)
+    os.remove(source)
+
+
+@contextlib.contextmanager
+def context(unit=None, stage=None):
+    """Add the UUID of the unit and the stage being worked on to the records
+    logged in the current thread within the block.
+    """
+    previous = getattr(_CONTEXT, "unit", None), getattr(_CONTEXT, "stage", None)
+    _CONTEXT.unit = unit or previous[0]
+    _CONTEXT.stage = stage or previous[1]
+    try:
+        yield
+    finally:
+        _CONTEXT.unit, _CONTEXT.stage = previous
+
+
+def _stop_listeners():
+    while _LISTENERS:
+        _LISTENERS.pop().stop()
+
+
+def _use_queue(logger_names):
+    """Hand the records of the loggers to their handlers through a queue, so
+    that they are formatted and written by a background thread.
+    """
+    for name in logger_names:
+        logger = logging.getLogger(name)
+        records = queue.Queue(-1)
+        listener = logging.handlers.QueueListener(records, *logger.handlers)
+        logger.handlers = [_QueueHandler(records)]
+        listener.start()
+        _LISTENERS.append(listener)
+
+
+if hasattr(logging.handlers, "QueueHandler"):
+
+    class _QueueHandler(logging.handlers.QueueHandler):
+        """Queue the records with their message merged with its arguments,
+        leaving their formatting, truncation and writing to the listener
+        thread.
+
+        The arguments are turned into strings in the thread logging, as they
+        may be model instances which would otherwise load their attributes
+        through the session of that thread from the listener thread.
+        """
+
+        def prepare(self, record):
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                if not record.exc_text:
+                    record.exc_text = _EXCEPTION_FORMATTER.formatException(
+                        record.exc_info
+                    )
+                record.exc_info = None
+            return record
+
+    _EXCEPTION_FORMATTER = logging.Formatter()
+
+
+def setup(log_level, log_file_name, config=None):
+    """Configure the logging system.
+
+    The following settings are read from ``config``, if given:
+
+    * ``logformat``: ``text`` (default) or ``json`` for JSON lines, with the
+      unit and stage of the records if known.
+    * ``logqueue``: Format and write the records in a background thread
+      (Python 3 only).
+    * ``logmaxbytes``, ``logbackups``: Size in bytes past which the log file
+      is rotated, and number of rotated files kept.
+    * ``logcompress``: Compress the rotated files with gzip (Python 3 only).
+    * ``logmaxmessage``: Number of characters past which messages are
+      truncated, 0 for no limit.
+    """
+    get = config.get if config is not None else lambda name, default=None: default
+    getint = config.getint if config is not None else get
+    getboolean = config.getboolean if config is not None else get
+    log_format = get("logformat", LOG_FORMAT_TEXT)
+    if log_format not in (LOG_FORMAT_TEXT, LOG_FORMAT_JSON):
+        raise ValueError("Invalid log format: {}".format(log_format))
 
     dict_config = {
         "version": 1,
         "disable_existing_loggers": False,
-        "formatters": {"default": {"format": log_fmt, "datefmt": "%Y-%m-%d %H:%M:%S"}},
+        "formatters": {
+            "default": {"format": TEXT_FORMAT, "datefmt": DATE_FORMAT},
+            "json": {"()": JSONFormatter},
+        },
+        "filters": {
+            "context": {"()": ContextFilter},
+            "truncate": {
+                "()": TruncateFilter,
+                "max_length": getint("logmaxmessage", DEFAULT_MAX_MESSAGE),
+            },
+        },
         "handlers": {
-            "console": {"class": "logging.StreamHandler", "formatter": "default"},
+            "console": {
+                "class": "logging.StreamHandler",
+                "formatter": "default",
+                "filters": ["truncate"],
+            },
             "file": {
                 "class": "logging.handlers.RotatingFileHandler",
-                "formatter": "default",
+                "formatter": "json" if log_format == LOG_FORMAT_JSON else "default",
                 "filename": log_file_name,
-                "backupCount": 2,
-                "maxBytes": 10 * 1024,
+                "backupCount": getint("logbackups", DEFAULT_BACKUP_COUNT),
+                "maxBytes": getint("logmaxbytes", DEFAULT_MAX_BYTES),
                 "delay": True,  # Ony write to file on first byte emitted.
+                "filters": ["truncate"],
             },
         },
         "loggers": {
-            "transfers": {"level": log_level, "handlers": ["console", "file"]},
-            "requests.packages.urllib3": {"level": log_level, "handlers": ["file"]},
+            "transfers": {
+                "level": log_level,
+                "handlers": ["console", "file"],
+                "filters": ["context"],
+            },
+            "requests.packages.urllib3": {
+                "level": log_level,
+                "handlers": ["file"],
+            },
         },
     }
 
+    _stop_listeners()
     logging.config.dictConfig(dict_config)
 
+    if getboolean("logcompress", False):
+        for handler in logging.getLogger("transfers").handlers:
+            if isinstance(handler, logging.handlers.RotatingFileHandler):
+                handler.namer = _gzip_namer
+                handler.rotator = _gzip_rotator
+    if getboolean("logqueue", False) and hasattr(logging.handlers, "QueueHandler"):
+        _use_queue(dict_config["loggers"])
+
+
+atexit.register(_stop_listeners)
+
 
 def set_log_level(log_level, quiet, verbose):
     log_levels = {2: "ERROR", 1: "WARNING", 0: "INFO", -1: "DEBUG"}
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+"""Plan the transfers left to start from a transfer source.
+
+The transfer sources not processed yet are written as NDJSON, one object per
+line in the order they would be started, with their projected start time. The
+projection assumes that transfers keep being started at the pace of the last
+units completed, as recorded in the automation tools database.
+"""
+
+from __future__ import division
+
+import datetime
+import json
+
+from transfers import models, watchdog
+from transfers.utils import fsdecode
+
+
+def size_label(size):
+    """Return the label of the size band of ``size``, see ``watchdog.SIZE_BANDS``."""
+    lower, upper = watchdog.size_band(size)
+    if size is None:
+        return "unknown"
+    if lower is None:
+        return "< {}".format(_format_bytes(upper))
+    if upper is None:
+        return ">= {}".format(_format_bytes(lower))
+    return "{} - {}".format(_format_bytes(lower), _format_bytes(upper))
+
+
+def _format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if size < 1000 or unit == "TB":
+            break
+        size /= 1000
+    return "{:g} {}".format(size, unit)
+
+
+def pace(history):
+    """Return the average time in seconds between the starts of the units of
+    ``history``, and the number of bytes processed per second, None if the
+    history is too short to tell.
+
+    :param list history: Start time, finish time and size of completed units,
+                         oldest first.
+    """
+    interval = throughput = None
+    if len(history) > 1:
+        elapsed = (history[-1][0] - history[0][0]).total_seconds()
+        interval = elapsed / (len(history) - 1)
+    sized = [(started, finished, size) for started, finished, size in history if size]
+    seconds = sum(
+        (finished - started).total_seconds() for started, finished, _ in sized
+    )
+    if seconds > 0:
+        throughput = sum(size for _, _, size in sized) / seconds
+    return interval, throughput
+
+
+def write_plan(candidates, out, history, now=None):
+    """Write the plan of the ``candidates`` to the file object ``out``.
+
+    :param candidates: Iterable of the paths and sizes of the transfer sources
+                       left, in the order they would be started.
+    :param list history: See ``pace``.
+    :returns: Dict summing up the plan.
+    """
+    now = now or datetime.datetime.utcnow()
+    interval, throughput = pace(history)
+    summary = {
+        "count": 0,
+        "bytes": 0,
+        "unknown_sizes": 0,
+        "sizes": {},
+        "interval": interval,
+        "throughput": throughput,
+        "completion": None,
+    }
+    for position, (path, size) in enumerate(candidates):
+        start = None
+        if interval is not None:
+            start = now + datetime.timedelta(seconds=position * interval)
+        out.write(
+            json.dumps(
+                {
+                    "position": position,
+                    "path": fsdecode(path),
+                    "size": size,
+                    "start": start.isoformat() if start else None,
+                }
+            )
+            + "\n"
+        )
+        summary["count"] += 1
+        if size is None:
+            summary["unknown_sizes"] += 1
+        else:
+            summary["bytes"] += size
+        label = size_label(size)
+        summary["sizes"][label] = summary["sizes"].get(label, 0) + 1
+    if interval is not None and summary["count"]:
+        summary["completion"] = now + datetime.timedelta(
+            seconds=summary["count"] * interval
+        )
+    return summary
+
+
+def format_summary(summary):
+    """Return the lines of a summary returned by ``write_plan``."""
+    lines = [
+        "Transfers left: {}".format(summary["count"]),
+        "Total size: {} ({} of unknown size)".format(
+            _format_bytes(summary["bytes"]), summary["unknown_sizes"]
+        ),
+    ]
+    bands = [0] + list(watchdog.SIZE_BANDS) + [None]
+    for label in [size_label(size) for size in bands]:
+        if label in summary["sizes"]:
+            lines.append("  {}: {}".format(label, summary["sizes"][label]))
+    if summary["throughput"]:
+        lines.append(
+            "Processing throughput: {}/s".format(_format_bytes(summary["throughput"]))
+        )
+    if summary["interval"] is None:
+        lines.append("Projected completion: unknown, too few units completed")
+    else:
+        lines.append(
+            "One transfer started every {}".format(
+                datetime.timedelta(seconds=int(summary["interval"]))
+            )
+        )
+        if summary["completion"]:
+            lines.append(
+                "Projected completion: {:%Y-%m-%d %H:%M} UTC".format(
+                    summary["completion"]
+                )
+            )
+    return lines
+
+
+def get_history(limit=500):
+    """Return the start time, finish time and size of the last units
+    completed, oldest first.
+    """
+    return list(reversed(models.get_completed_units(limit)))
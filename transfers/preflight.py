@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Pre-flight Validation.
+
+Check a transfer source before Archivematica copies it into the pipeline, so
+that broken bags, checksum mismatches and empty or unreadable files are found
+without spending a pipeline cycle on them. The checksums listed in the BagIt
+manifests (``manifest-<algorithm>.txt``) and in the
+``metadata/checksum.<algorithm>`` files of standard transfers are verified,
+the files being hashed in a pool of processes. Empty files are accepted as
+long as the transfer source has other files, unless asked otherwise.
+
+Run on its own, this module validates the paths given and prints the problems
+found.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import hashlib
+import logging
+import os
+import sys
+
+# Allow execution as an executable and the script to be run at package level
+# by ensuring that it can see itself.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transfers.utils import fsdecode, fsencode
+
+LOGGER = logging.getLogger("transfers")
+
+# Size in bytes of the reads when hashing files.
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+# Algorithms of the metadata/checksum.<algorithm> files of standard transfers.
+CHECKSUM_ALGORITHMS = ("md5", "sha1", "sha256", "sha512")
+
+
+def hash_file(job):
+    """Hash a file, reading it by chunks of ``buffer_size`` bytes.
+
+    :param tuple job: Path, algorithm and buffer size.
+    :returns: Tuple of the path, the algorithm, the hex digest or None and the
+              error if the file could not be read.
+    """
+    path, algorithm, buffer_size = job
+    digest = hashlib.new(algorithm)
+    try:
+        with open(path, "rb") as file_:
+            for chunk in iter(lambda: file_.read(buffer_size), b""):
+                digest.update(chunk)
+    except (IOError, OSError) as err:
+        return path, algorithm, None, str(err)
+    return path, algorithm, digest.hexdigest(), None
+
+
+def hash_files(jobs, processes=None, func=hash_file):
+    """Hash files in a pool of ``processes`` processes, the number of CPUs by
+    default, or in this process if there is only one to hash.
+
+    :param list jobs: Arguments for ``func``.
+    :param func: Module level function hashing a file.
+    :returns: Generator of the results of ``func``, in no particular order.
+    """
+    if processes == 1 or len(jobs) < 2:
+        for job in jobs:
+            yield func(job)
+        return
+    import multiprocessing
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap_unordered(func, jobs):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def read_manifest(manifest_path, base_dirs):
+    """Read the checksums of a manifest, in the ``<checksum> <path>`` format
+    of BagIt and of the md5sum family of tools.
+
+    :param list base_dirs: Directories to look for the files listed in, the
+                           first one being used for missing files.
+    :returns: Dict of the checksums by path.
+    """
+    checksums = {}
+    with open(manifest_path, "rb") as manifest:
+        for line in manifest:
+            line = line.strip()
+            if not line:
+                continue
+            checksum, _, name = line.partition(b" ")
+            # Binary mode marker of md5sum.
+            name = name.strip().lstrip(b"*")
+            candidates = [os.path.normpath(os.path.join(d, name)) for d in base_dirs]
+            path = next((c for c in candidates if os.path.exists(c)), candidates[0])
+            checksums[path] = checksum.decode("ascii", "replace").lower()
+    return checksums
+
+
+def _manifests(path):
+    """Return the manifests of ``path`` with their algorithm, and the
+    directories the files they list are relative to.
+    """
+    manifests = []
+    if os.path.isfile(os.path.join(path, b"bagit.txt")):
+        for name in sorted(os.listdir(path)):
+            if name.startswith(b"manifest-") and name.endswith(b".txt"):
+                algorithm = fsdecode(name[len(b"manifest-") : -len(b".txt")])
+                manifests.append((os.path.join(path, name), algorithm, [path]))
+    metadata = os.path.join(path, b"metadata")
+    for algorithm in CHECKSUM_ALGORITHMS:
+        checksum_file = os.path.join(metadata, fsencode("checksum." + algorithm))
+        if os.path.isfile(checksum_file):
+            manifests.append((checksum_file, algorithm, [path, metadata]))
+    return manifests
+
+
+def _walk(path, errors, reject_empty_files=False):
+    """Return the files of ``path`` and whether one of them is not empty,
+    recording those which cannot be read, or are empty if
+    ``reject_empty_files``, in ``errors``.
+    """
+    if os.path.isfile(path):
+        files = [path]
+    else:
+        files = []
+
+        def onerror(err):
+            errors.append("Cannot read {}: {}".format(fsdecode(err.filename), err))
+
+        for dirpath, _, filenames in os.walk(path, onerror=onerror):
+            files.extend(os.path.join(dirpath, name) for name in filenames)
+    content = False
+    for file_path in files:
+        try:
+            size = os.path.getsize(file_path)
+        except OSError as err:
+            errors.append("Cannot read {}: {}".format(fsdecode(file_path), err))
+            continue
+        if not os.access(file_path, os.R_OK):
+            errors.append("Cannot read {}".format(fsdecode(file_path)))
+        elif size:
+            content = True
+        elif reject_empty_files:
+            errors.append("Empty file: {}".format(fsdecode(file_path)))
+    return files, content
+
+
+def validate(
+    path, processes=None, buffer_size=DEFAULT_BUFFER_SIZE, reject_empty_files=False
+):
+    """Validate a transfer source.
+
+    :param path: Path of the directory or file to become a transfer.
+    :param int processes: Number of processes hashing the files.
+    :param int buffer_size: Size in bytes of the reads when hashing files.
+    :param bool reject_empty_files: Report every empty file, rather than only
+                                    transfer sources with nothing but empty
+                                    files.
+    :returns: List of the problems found, empty if the transfer is valid.
+    """
+    # The files listed in the manifests are normalized, so the files found
+    # have to be as well to match them.
+    path = os.path.normpath(os.path.abspath(fsencode(path)))
+    if not os.path.exists(path):
+        return ["{} does not exist".format(fsdecode(path))]
+    errors = []
+    files, content = _walk(path, errors, reject_empty_files)
+    if not files:
+        return ["{} contains no files".format(fsdecode(path))]
+    if not content and not errors:
+        if os.path.isfile(path):
+            return ["Empty file: {}".format(fsdecode(path))]
+        errors.append("{} contains only empty files".format(fsdecode(path)))
+    if os.path.isfile(path):
+        return errors
+
+    expected = {}
+    bag_listed = set()
+    bag = os.path.isfile(os.path.join(path, b"bagit.txt"))
+    for manifest_path, algorithm, base_dirs in _manifests(path):
+        if algorithm not in hashlib.algorithms_available:
+            errors.append(
+                "Unsupported algorithm in {}: {}".format(
+                    fsdecode(manifest_path), algorithm
+                )
+            )
+            continue
+        try:
+            checksums = read_manifest(manifest_path, base_dirs)
+        except (IOError, OSError) as err:
+            errors.append("Cannot read {}: {}".format(fsdecode(manifest_path), err))
+            continue
+        if bag and os.path.basename(manifest_path).startswith(b"manifest-"):
+            bag_listed.update(checksums)
+        for file_path, checksum in checksums.items():
+            expected[(file_path, algorithm)] = checksum
+    if bag:
+        if not any(name.startswith(b"manifest-") for name in os.listdir(path)):
+            errors.append("No payload manifest in bag {}".format(fsdecode(path)))
+        payload = os.path.join(path, b"data", b"")
+        for file_path in files:
+            if file_path.startswith(payload) and file_path not in bag_listed:
+                errors.append(
+                    "{} is not in the bag manifests".format(fsdecode(file_path))
+                )
+
+    jobs = []
+    for file_path, algorithm in sorted(expected):
+        if os.path.isfile(file_path):
+            jobs.append((file_path, algorithm, buffer_size))
+        else:
+            errors.append(
+                "Missing file listed in manifest: {}".format(fsdecode(file_path))
+            )
+    LOGGER.debug("Verifying %s checksums in %s", len(jobs), fsdecode(path))
+    for file_path, algorithm, checksum, error in hash_files(jobs, processes):
+        if error:
+            errors.append("Cannot read {}: {}".format(fsdecode(file_path), error))
+        elif checksum != expected[(file_path, algorithm)]:
+            errors.append(
+                "{} checksum mismatch: {}".format(algorithm, fsdecode(file_path))
+            )
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("paths", metavar="PATH", nargs="+", help="Path to validate.")
+    parser.add_argument(
+        "--processes",
+        type=int,
+        help="Number of processes hashing the files. Default: the number of CPUs.",
+    )
+    parser.add_argument(
+        "--reject-empty-files",
+        action="store_true",
+        help="Report every empty file, not only paths with no other files.",
+    )
+    args = parser.parse_args()
+    exit_code = 0
+    for arg in args.paths:
+        problems = validate(
+            arg, processes=args.processes, reject_empty_files=args.reject_empty_files
+        )
+        for problem in problems:
+            print(problem)
+        if problems:
+            exit_code = 1
+    sys.exit(exit_code)
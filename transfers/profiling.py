@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+"""Profile the runs of the scripts.
+
+The scripts take a ``--profile`` option, see ``add_arguments``, which runs them
+under cProfile, or tracemalloc with ``--profile memory``. The threads started
+from then on, such as those of the thread pools, are profiled as well. When
+the script exits, the profile is written next to its log file, or to
+``--profile-dir``, along with a text summary of the top functions or
+allocation sites:
+
+* ``<script>-<time>-<pid>.pstats`` and ``.txt`` for CPU profiles, which can be
+  browsed further with ``python -m pstats`` or snakeviz.
+* ``<script>-<time>-<pid>.tracemalloc`` and ``.txt`` for memory profiles, the
+  former being a ``tracemalloc.Snapshot`` dump.
+"""
+
+from __future__ import print_function
+
+import atexit
+import datetime
+import os
+import sys
+import threading
+
+PROFILE_CPU = "cpu"
+PROFILE_MEMORY = "memory"
+PROFILE_MODES = (PROFILE_CPU, PROFILE_MEMORY)
+
+# Number of functions or allocation sites listed in the text summaries.
+DEFAULT_TOP = 30
+# Number of frames kept for each allocation in memory profiles.
+TRACEBACK_LIMIT = 25
+
+
+def add_arguments(parser):
+    """Add the profiling options to the argument parser of a script."""
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const=PROFILE_CPU,
+        choices=PROFILE_MODES,
+        help="Profile the run, threads included, in time (cpu, the default) or "
+        "in memory allocations (memory, Python 3 only).",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        metavar="DIR",
+        help="Directory of the profiles. Default: that of the log file.",
+    )
+    parser.add_argument(
+        "--profile-top",
+        metavar="N",
+        type=int,
+        default=DEFAULT_TOP,
+        help="Number of entries of the profile summaries. Default: %s" % DEFAULT_TOP,
+    )
+
+
+def profile_prefix(name, directory):
+    """Return the path, without extension, of the profile of this run."""
+    return os.path.join(
+        directory,
+        "{}-{:%Y%m%d-%H%M%S}-{}".format(name, datetime.datetime.now(), os.getpid()),
+    )
+
+
+def _start_cpu(prefix, top):
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    # Profilers of the threads started while profiling.
+    thread_profilers = []
+    lock = threading.Lock()
+
+    def profile_thread(frame, event, arg):
+        sys.setprofile(None)
+        thread_profiler = cProfile.Profile()
+        try:
+            thread_profiler.enable()
+        except ValueError:
+            # From Python 3.12, the profiler covers every thread already.
+            return
+        with lock:
+            thread_profilers.append(thread_profiler)
+
+    threading.setprofile(profile_thread)
+    profiler.enable()
+
+    def stop():
+        profiler.disable()
+        threading.setprofile(None)
+        with lock:
+            for thread_profiler in thread_profilers:
+                thread_profiler.disable()
+        with open(prefix + ".txt", "w") as summary:
+            stats = pstats.Stats(profiler, *thread_profilers, stream=summary)
+            stats.dump_stats(prefix + ".pstats")
+            stats.sort_stats("cumulative").print_stats(top)
+            stats.sort_stats("tottime").print_stats(top)
+        return prefix + ".pstats"
+
+    return stop
+
+
+def _start_memory(prefix, top):
+    import tracemalloc
+
+    tracemalloc.start(TRACEBACK_LIMIT)
+
+    def stop():
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        snapshot = snapshot.filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            )
+        )
+        snapshot.dump(prefix + ".tracemalloc")
+        with open(prefix + ".txt", "w") as summary:
+            summary.write("Peak memory: {} bytes\n".format(peak))
+            summary.write("Memory at exit: {} bytes\n\n".format(current))
+            summary.write("Top {} allocation sites at exit:\n".format(top))
+            for stat in snapshot.statistics("lineno")[:top]:
+                summary.write("{}\n".format(stat))
+        return prefix + ".tracemalloc"
+
+    return stop
+
+
+def start(args, name, log_file=None):
+    """Start profiling the run if asked to with the options of ``args``.
+
+    The profile is written when the script exits, or when the function
+    returned is called.
+
+    :param args: Parsed arguments, see ``add_arguments``.
+    :param str name: Name of the script, used in the names of the files.
+    :param str log_file: Log file of the script, next to which the profile is
+                         written unless ``--profile-dir`` is given.
+    :returns: Function stopping the profiler and writing the profile, which
+              returns the path of the profile, or None if not profiling.
+    """
+    mode = getattr(args, "profile", None)
+    if not mode:
+        return lambda: None
+    if mode == PROFILE_MEMORY and sys.version_info < (3, 4):
+        raise ValueError("Memory profiles require Python 3.4 or later")
+    directory = args.profile_dir
+    if not directory:
+        directory = os.path.dirname(os.path.abspath(log_file)) if log_file else ""
+    directory = directory or os.getcwd()
+    prefix = profile_prefix(name, directory)
+    starter = _start_memory if mode == PROFILE_MEMORY else _start_cpu
+    stop_profiler = starter(prefix, args.profile_top)
+    stopped = []
+
+    def stop():
+        if stopped:
+            return stopped[0]
+        stopped.append(stop_profiler())
+        print("Profile written to {}".format(stopped[0]), file=sys.stderr)
+        return stopped[0]
+
+    atexit.register(stop)
+    return stop
@@ -14,11 +14,14 @@ from __future__ import print_function
 
 import argparse
 import atexit
+import copy
 import json
 import logging
 import os
+import threading
 import time
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from amclient import AMClient
 from six import string_types, text_type
@@ -27,7 +30,8 @@ from six import string_types, text_type
 # by ensuring that it can see itself.
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from transfers import errors, loggingconfig
+from transfers import circuitbreaker, errors, httpmetrics, loggingconfig, profiling
+from transfers import runlock
 from transfers import reingestmodel as reingestunit
 
 LOGGER = logging.getLogger("transfers")
@@ -40,9 +44,11 @@ ERR_PROCESSING = 1
 # reingest to happen.
 LATENCY = 0.8
 
-# If the process is running already we don't want to atexit to execute with
-# its default registered behavior. Override here.
-OVERRIDE_ATEXIT = False
+# Number of reingests started concurrently, within the throttle.
+DEFAULT_WORKERS = 4
+
+# Lock held while the script is running, see manage_process.
+PROCESS_LOCK = None
 
 
 def setup_reingest(config):
@@ -81,6 +87,8 @@ def get_am_client(config):
     of the script.
     """
     connection = config["connection"]
+    circuitbreaker.guard_amclient()
+    httpmetrics.install()
     amclient = AMClient(
         ss_url=connection["ss_url"],
         ss_user_name=connection["ss_user_name"],
@@ -93,6 +101,22 @@ def get_am_client(config):
     return setup_amclient(amclient)
 
 
+def client_per_thread(amclient):
+    """Return a function returning an AM Client of its own to each thread,
+    configured like ``amclient``, as the attributes of the client are set for
+    each call.
+    """
+    local = threading.local()
+
+    def get_client():
+        client = getattr(local, "amclient", None)
+        if client is None:
+            client = local.amclient = setup_amclient(copy.copy(amclient))
+        return client
+
+    return get_client
+
+
 def pipeline_exists(amclient, pipeline_uuid):
     """Test whether a pipeline is known to the storage service."""
     try:
@@ -168,6 +192,9 @@ def reingest_full_and_approve(
                 time.sleep(latency)  # ~latency between call and AM actioning.
             amclient.transfer_uuid = reingest_uuid
             transfer = amclient.get_transfer_status()
+            # Do not poll an unavailable pipeline until the script is killed.
+            if not circuitbreaker.get_breaker(amclient.am_url).available():
+                return False, "Archivematica is unavailable."
 
         LOGGER.info(
             "Attempting to approve transfer following the "
@@ -193,35 +220,28 @@ def reingest_full_and_approve(
 def manage_process(config_file, remove=False):
     """Manage the reingest process using a process lock.
 
-    If the PID.lck file exists then inform the user. We shouldn't try running
-    this script if it is already running elsewhere. Manage_process is the
-    default atexit behavior of this script so it will remove the process lock
-    if it is part of regular script execution. If the script is already running
-    then the default behavior is overridden and the script is allowed to exit
-    without removing the LCK file.
+    If the lock is held by another run then inform the user and exit. We
+    shouldn't try running this script if it is already running elsewhere. The
+    lock is released by the kernel if the process dies, so a PID file left
+    behind does not block later runs. Manage_process is the default atexit
+    behavior of this script so it will release the lock if it is part of
+    regular script execution. Only the process holding the lock releases it.
     """
-    pid_file = config_file["process"]["pid"]
-    global OVERRIDE_ATEXIT
-    if OVERRIDE_ATEXIT:
+    global PROCESS_LOCK
+    if remove:
+        if PROCESS_LOCK is not None:
+            LOGGER.info("Releasing lock for current process.")
+            PROCESS_LOCK.release()
+            PROCESS_LOCK = None
         return
-    if remove and os.path.isfile(pid_file):
-        LOGGER.info("Removing PID for current process.")
-        os.remove(pid_file)
-        return
-    try:
-        pidf = os.fdopen(os.open(pid_file, os.O_CREAT | os.O_EXCL | os.O_RDWR), "w")
-    except OSError:
-        LOGGER.info(
-            "This script is already running. To override this "
-            "behavior and start a new run, remove %s",
-            pid_file,
-        )
-        # By default, do not remove the PID if the process is already running.
-        OVERRIDE_ATEXIT = True
+    lock = runlock.RunLock(
+        config_file["process"]["pid"],
+        lease=config_file["process"].get("lease", runlock.DEFAULT_LEASE),
+    )
+    if not lock.acquire():
+        LOGGER.info("This script is already running, see %s", lock.path)
         sys.exit()
-    pid = os.getpid()
-    pidf.write(str(pid))
-    pidf.close()
+    PROCESS_LOCK = lock
 
 
 def db_has_aips(session):
@@ -269,33 +289,72 @@ def get_status(status):
         return None
 
 
-def update_reingest(session, amclient):
+def get_reingest_statuses(amclient, transfer_uuid, aip_uuid):
+    """Return the status of the transfer, ingest and package of a reingest.
+
+    The package details are only fetched once the ingest is complete, the
+    status of the package being None otherwise.
+    """
+    # A delta can be produced if we look at transfer status, ingest status,
+    # and the package details. If transfer is complete, and ingest is
+    # complete (and the SIP uuid can be found) and then the package is
+    # described as being uploaded, then we have reingested the AIP.
+    amclient.transfer_uuid = transfer_uuid
+    amclient.sip_uuid = aip_uuid
+    amclient.package_uuid = aip_uuid
+    transfer_status = get_status(amclient.get_transfer_status())
+    ingest_status = get_status(amclient.get_ingest_status())
+    aip_status = None
+    if ingest_status == "COMPLETE":
+        aip_status = get_status(amclient.get_package_details())
+    return transfer_status, ingest_status, aip_status
+
+
+def update_reingest(session, amclient, workers=DEFAULT_WORKERS):
     """Set the status of the AIP to COMPLETE if the transfer and ingest process
     has completed.
+
+    The statuses of the reingests in progress are fetched concurrently by up
+    to ``workers`` threads, each with its own AM Client, and the AIPs
+    completed are committed to the database at once.
     """
-    for aip in reingestunit.get_items_in_progress(session):
-        transfer_uuid = aip.transfer_uuid
-        aip_uuid = aip.aip_uuid
-
-        # A delta can be produced if we look at transfer status, ingest status,
-        # and the package details. If transfer is complete, and ingest is
-        # complete (and the SIP uuid can be found) and then the package is
-        # described as being uploaded, then we have reingested the AIP and we
-        # can set our process state to STATUS_COMPLETE.
-        amclient.transfer_uuid = transfer_uuid
-        amclient.sip_uuid = aip_uuid
-        amclient.package_uuid = aip_uuid
-        transfer_status = get_status(amclient.get_transfer_status())
-        ingest_status = get_status(amclient.get_ingest_status())
-        aip_status = get_status(amclient.get_package_details())
+    # The UUIDs are read here rather than in the threads, which would load
+    # the attributes expired by a commit through the session of this thread.
+    aips = [
+        (aip.aip_uuid, aip.transfer_uuid)
+        for aip in reingestunit.get_items_in_progress(session)
+    ]
+    if not aips:
+        return
+    get_client = client_per_thread(amclient)
+    executor = ThreadPoolExecutor(max_workers=min(workers, len(aips)))
+    try:
+        statuses = list(
+            executor.map(
+                lambda uuids: get_reingest_statuses(get_client(), uuids[1], uuids[0]),
+                aips,
+            )
+        )
+    finally:
+        executor.shutdown(wait=True)
+    for (aip_uuid, _), (transfer_status, ingest_status, aip_status) in zip(
+        aips, statuses
+    ):
         if transfer_status == "COMPLETE" and ingest_status == "PROCESSING":
             LOGGER.info("AIP %s processing is now in ingest", aip_uuid)
         elif ingest_status == "COMPLETE" and aip_status == "UPLOADED":
-            reingestunit.set_status_complete(session, aip.aip_uuid)
+            reingestunit.set_status_complete(session, aip_uuid, commit=False)
+    session.commit()
 
 
 def start_reingest(
-    session, amclient, pipeline_uuid, processing_config, throttle, approval_retries=2
+    session,
+    amclient,
+    pipeline_uuid,
+    processing_config,
+    throttle,
+    approval_retries=2,
+    workers=DEFAULT_WORKERS,
 ):
     """Begin the reingest of an AIP.
 
@@ -310,6 +369,10 @@ def start_reingest(
     The update -> start (flush -> begin) approach to running this script is
     useful when automating the reingest process where this script is called
     repeatedly via a cronjob.
+
+    The reingests are started and approved concurrently by up to ``workers``
+    threads, each with its own AM Client. Their status is written to the
+    database by the calling thread as each of them returns.
     """
     new_aips = reingestunit.get_items_new(session)
     in_progress = reingestunit.get_items_in_progress(session)
@@ -320,21 +383,45 @@ def start_reingest(
     if pool < 1:
         LOGGER.info("Pool is less than one, exiting, until next run")
         return False
-    for index in range(min(pool, len(new_aips))):
-        aip = new_aips[index].aip_uuid
-        error, message = reingest_full_and_approve(
-            amclient,
+    # Leave the AIPs alone rather than mark them as failed while Archivematica
+    # or the Storage Service cannot be reached.
+    for url in (amclient.am_url, amclient.ss_url):
+        if not circuitbreaker.get_breaker(url).available():
+            LOGGER.warning("Not starting reingests while %s is unavailable", url)
+            return False
+    aips = [aip.aip_uuid for aip in new_aips[:pool]]
+    if not aips:
+        return False
+    get_client = client_per_thread(amclient)
+
+    def start(aip):
+        return reingest_full_and_approve(
+            get_client(),
             pipeline_uuid,
             aip,
             processing_config,
             latency=LATENCY,
             approval_retries=approval_retries,
         )
-        if error is not False:
-            reingestunit.set_status_in_progress(session, aip, transfer_uuid=message)
-        else:
-            LOGGER.error("Error initiating reingest %s, %s", aip, message)
-            reingestunit.set_status_error(session, aip, message)
+
+    executor = ThreadPoolExecutor(max_workers=min(workers, len(aips)))
+    try:
+        futures = {executor.submit(start, aip): aip for aip in aips}
+        for future in as_completed(futures):
+            aip = futures[future]
+            try:
+                error, message = future.result()
+            except Exception:
+                # Left as new, to be started again by the next run.
+                LOGGER.exception("Unexpected error initiating reingest %s", aip)
+                continue
+            if error is not False:
+                reingestunit.set_status_in_progress(session, aip, transfer_uuid=message)
+            else:
+                LOGGER.error("Error initiating reingest %s, %s", aip, message)
+                reingestunit.set_status_error(session, aip, message)
+    finally:
+        executor.shutdown(wait=True)
     return False
 
 
@@ -411,6 +498,7 @@ def main():
         nargs="?",
         help="logging level, INFO, DEBUG, WARNING, ERROR",
     )
+    profiling.add_arguments(parser)
 
     if not len(sys.argv) > 2:
         parser.print_help()
@@ -433,9 +521,14 @@ def main():
         loggingconfig.setup(logging_default, logging_path)
     else:
         loggingconfig.setup(args.logging, logging_path)
+    profiling.start(args, "reingest", logging_path)
 
     # Create an AM Client instance to work with.
     amclient = get_am_client(config)
+    breaker = config.get("breaker", {})
+    circuitbreaker.configure(
+        failure_threshold=breaker.get("threshold"), reset_timeout=breaker.get("timeout")
+    )
 
     # Perform some early checks to make sure this process will work. Check now,
     # exit early.
@@ -454,6 +547,7 @@ def main():
     # grab early.
     throttle = config["reingest"]["throttle"]
     approval_retries = config["reingest"]["approval_retries"]
+    workers = config["reingest"].get("workers", DEFAULT_WORKERS)
     LOGGER.info(
         "Processing throttle set to %s, " "approval retries set to %s",
         throttle,
@@ -493,6 +587,7 @@ def main():
     dbpath = config["database"]["path"]
     reingestunit.init(dbpath)
     session = reingestunit.Session()
+    circuitbreaker.load(session)
 
     # To generate a log of everything in the database we need to get hold of
     # a database session here.
@@ -519,7 +614,7 @@ def main():
     # if there are zero in the pipeline we can call it fairly inexpensively
     # here first so that start_reingest doesn't have to be called within
     # itself.
-    update_reingest(session=session, amclient=amclient)
+    update_reingest(session=session, amclient=amclient, workers=workers)
 
     # Start as many ingests from the pool as we can per throttle.
     complete = start_reingest(
@@ -529,7 +624,11 @@ def main():
         processing_config=processing_config,
         throttle=throttle,
         approval_retries=approval_retries,
+        workers=workers,
     )
+    circuitbreaker.save(session)
+    LOGGER.info(httpmetrics.summary())
+    httpmetrics.save(session)
 
     # If there are no new AIPs and none in progress, then complete this work
     # by outputting some information about the process.
@@ -117,10 +117,13 @@ def insert(session, item):
         )
 
 
-def _set_status(session, status_enum, aip_uuid, transfer_uuid=None, message=None):
+def _set_status(
+    session, status_enum, aip_uuid, transfer_uuid=None, message=None, commit=True
+):
     """Setter for status inside the database.
 
-    This function controls various mechanisms for manipulating status.
+    This function controls various mechanisms for manipulating status. The
+    change is left to the caller to commit if ``commit`` is False.
     """
     item = get_item_by_aip_uuid(session, aip_uuid)
     if item is None:
@@ -138,7 +141,8 @@ def _set_status(session, status_enum, aip_uuid, transfer_uuid=None, message=None
         item.start_time = datetime.datetime.utcnow()
     if status_enum == StatusEnum.STATUS_COMPLETE:
         item.end_time = datetime.datetime.utcnow()
-    session.commit()
+    if commit:
+        session.commit()
     return item
 
 
@@ -155,9 +159,9 @@ def set_status_in_progress(session, aip_uuid, transfer_uuid):
     )
 
 
-def set_status_complete(session, aip_uuid):
+def set_status_complete(session, aip_uuid, commit=True):
     """Set item status to in progress and return processing time."""
-    item = _set_status(session, StatusEnum.STATUS_COMPLETE, aip_uuid)
+    item = _set_status(session, StatusEnum.STATUS_COMPLETE, aip_uuid, commit=commit)
     # Processing_time is an @property of the database item which we can use
     # here to return to the user some logging information that may be of
     # interest.
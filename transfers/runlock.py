@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+"""Run lock shared by the automation tools scripts.
+
+Only one instance of a script should run at a time, e.g. when it is invoked
+by cron more often than a run takes. The lock is an exclusive ``flock`` on a
+lock file, so it is released by the kernel however the process holding it
+ends, even after ``kill -9``, and a lock file left behind never blocks later
+runs.
+
+The lock file records the PID and host of the holder and a heartbeat that is
+renewed while the lock is held. Where ``flock`` is not supported, e.g. on some
+network filesystems, the heartbeat acts as a lease: a lock whose holder is no
+longer running on this host, or whose heartbeat is older than the lease, is
+taken over.
+"""
+
+import errno
+import fcntl
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+LOGGER = logging.getLogger("transfers")
+
+# Seconds after which a lock whose heartbeat has not been renewed is stale.
+DEFAULT_LEASE = 300
+
+# Errors raised by flock when the lock is held by somebody else.
+_LOCKED_ERRNOS = (errno.EACCES, errno.EAGAIN, errno.EWOULDBLOCK)
+
+# Errors raised by flock when the filesystem does not support it.
+_UNSUPPORTED_ERRNOS = (errno.ENOLCK, errno.EOPNOTSUPP, errno.EINVAL)
+
+
+def _pid_alive(pid):
+    """Return whether a process with ``pid`` is running on this host."""
+    try:
+        os.kill(pid, 0)
+    except OSError as err:
+        return err.errno == errno.EPERM
+    return True
+
+
+class RunLock(object):
+    """Lock making sure only one instance of a script runs at a time."""
+
+    def __init__(self, path, lease=DEFAULT_LEASE):
+        """
+        :param str path: Path of the lock file.
+        :param int lease: Seconds after which the lock is considered stale if
+                          its heartbeat has not been renewed. The heartbeat is
+                          renewed three times per lease.
+        """
+        self.path = path
+        self.lease = lease
+        self.token = uuid.uuid4().hex
+        self._fd = None
+        self._flock = True
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def _contents(self):
+        return json.dumps(
+            {
+                "pid": os.getpid(),
+                "host": socket.gethostname(),
+                "heartbeat": time.time(),
+                "token": self.token,
+            }
+        ).encode("utf-8")
+
+    def read_holder(self):
+        """Return the details recorded in the lock file as a dict, or None if
+        there are none.
+
+        Lock files written by earlier versions of the automation tools only
+        contain a PID; their modification time is used as the heartbeat.
+        """
+        try:
+            with open(self.path, "rb") as lock_file:
+                contents = lock_file.read().decode("utf-8").strip()
+            modified = os.path.getmtime(self.path)
+        except (IOError, OSError):
+            return None
+        if contents.isdigit():
+            return {"pid": int(contents), "host": None, "heartbeat": modified}
+        try:
+            return json.loads(contents)
+        except ValueError:
+            return None
+
+    def is_stale(self, holder):
+        """Return whether the lock described by ``holder`` has been abandoned,
+        i.e. its process is gone or its heartbeat has expired.
+        """
+        pid = holder.get("pid")
+        if holder.get("host") in (None, socket.gethostname()) and pid:
+            if not _pid_alive(pid):
+                return True
+        return time.time() - holder.get("heartbeat", 0) > self.lease
+
+    def acquire(self):
+        """Acquire the lock without waiting.
+
+        :returns: True if the lock is now held, False if it is held by
+                  another running instance.
+        """
+        try:
+            acquired = self._acquire_flock()
+        except (IOError, OSError) as err:
+            if err.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+            LOGGER.warning(
+                "Unable to lock %s (%s), relying on its heartbeat instead",
+                self.path,
+                err,
+            )
+            self._flock = False
+            acquired = self._acquire_lease()
+        if acquired:
+            self._stop.clear()
+            self._heartbeat = threading.Thread(target=self._beat)
+            self._heartbeat.daemon = True
+            self._heartbeat.start()
+        return acquired
+
+    def _acquire_flock(self):
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            # Keep the lock out of the scripts run by the automation tools.
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError) as err:
+                os.close(fd)
+                if err.errno in _LOCKED_ERRNOS:
+                    self._log_holder()
+                    return False
+                raise
+            # Start again if the lock file was replaced while we were locking
+            # it, otherwise we would hold a lock nobody else can see.
+            try:
+                if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                    break
+            except OSError:
+                pass
+            os.close(fd)
+        holder = self.read_holder()
+        if holder and holder.get("pid") and holder.get("pid") != os.getpid():
+            LOGGER.info("Taking over lock %s left by PID %s", self.path, holder["pid"])
+        self._fd = fd
+        self.renew()
+        return True
+
+    def _acquire_lease(self):
+        holder = self.read_holder()
+        if holder is not None:
+            if not self.is_stale(holder):
+                self._log_holder(holder)
+                return False
+            LOGGER.warning(
+                "Taking over stale lock %s held by PID %s on %s",
+                self.path,
+                holder.get("pid"),
+                holder.get("host"),
+            )
+        self.renew()
+        # If another instance took the lock over at the same time, whoever
+        # wrote the lock file last holds it.
+        holder = self.read_holder()
+        return holder is not None and holder.get("token") == self.token
+
+    def _log_holder(self, holder=None):
+        holder = holder or self.read_holder() or {}
+        if holder and self.is_stale(holder):
+            LOGGER.warning(
+                "Lock %s is held by PID %s on %s, which has not renewed it "
+                "since %s and may be hung",
+                self.path,
+                holder.get("pid"),
+                holder.get("host"),
+                time.ctime(holder.get("heartbeat", 0)),
+            )
+        else:
+            LOGGER.info(
+                "Lock %s is held by PID %s on %s",
+                self.path,
+                holder.get("pid"),
+                holder.get("host"),
+            )
+
+    def renew(self):
+        """Renew the heartbeat of the lock."""
+        contents = self._contents()
+        if self._flock:
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            os.ftruncate(self._fd, 0)
+            os.write(self._fd, contents)
+            return
+        holder = self.read_holder()
+        if holder is not None and holder.get("token") not in (None, self.token):
+            if not self.is_stale(holder):
+                LOGGER.error(
+                    "Lock %s has been taken over by another process", self.path
+                )
+                return
+        temp_path = "{}.{}".format(self.path, self.token)
+        with open(temp_path, "wb") as temp_file:
+            temp_file.write(contents)
+        os.rename(temp_path, self.path)
+
+    def _beat(self):
+        while not self._stop.wait(self.lease / 3.0):
+            try:
+                self.renew()
+            except (IOError, OSError) as err:
+                LOGGER.warning("Unable to renew lock %s: %s", self.path, err)
+
+    def release(self):
+        """Release the lock if it is held."""
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+        if self._flock:
+            if self._fd is None:
+                return
+            # The lock file is emptied rather than removed so that every
+            # instance always locks the same file.
+            os.ftruncate(self._fd, 0)
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+            return
+        holder = self.read_holder()
+        if holder is not None and holder.get("token") == self.token:
+            os.remove(self.path)
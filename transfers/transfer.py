@@ -14,21 +14,27 @@ import atexit
 import base64
 import logging
 import os
-import shutil
 import subprocess
 import sys
 import time
 
-from amclient import AMClient
-import requests
-from six.moves import configparser
-from sqlalchemy.orm.exc import NoResultFound
-
 # Allow execution as an executable and the script to be run at package level
 # by ensuring that it can see itself.
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from transfers import defaults, errors, loggingconfig, models, utils
+from transfers import (
+    circuitbreaker,
+    defaults,
+    errors,
+    httpmetrics,
+    loggingconfig,
+    models,
+    profiling,
+    runlock,
+    utils,
+    watchdog,
+)
+from transfers.config import get_config
 from transfers.transferargs import get_parser
 from transfers.utils import fsencode, fsdecode
 
@@ -38,42 +44,50 @@ THIS_DIR = os.path.abspath(os.path.dirname(__file__))
 # Setup module level logging.
 LOGGER = logging.getLogger("transfers")
 
+# Sizes in bytes of the transfer source paths returned by get_next_transfer.
+SOURCE_SIZES = {}
+# Transfer source paths returned by get_next_transfer which are directories.
+SOURCE_DIRECTORIES = set()
+
 
-def setup_automation_execution(pid_file):
+def setup_automation_execution(lock):
     """Setup procedures for transfer.py."""
-    atexit.register(manage_automation_execution, pid_file)
+    atexit.register(manage_automation_execution, lock)
 
 
-def manage_automation_execution(pid_file):
+def manage_automation_execution(lock):
     """Cleanup procedures for transfer.py."""
     LOGGER.info("Running post-execution clean-up. Exiting script")
-    os.remove(pid_file)
+    lock.release()
     models.cleanup_session()
 
 
 def create_db_session(config_file):
     """Create and return a database session."""
-    models.init_session(
-        get_setting(config_file, "databasefile", os.path.join(THIS_DIR, "transfers.db"))
-    )
+    models.init_session(**get_config(config_file).database_options())
     return models.Session()
 
 
+def setup_circuit_breakers(config_file):
+    """Apply the circuit breaker settings of the config file and read the
+    state of the breakers saved by earlier runs.
+    """
+    config = get_config(config_file)
+    circuitbreaker.configure(
+        failure_threshold=config.getint("breakerthreshold"),
+        reset_timeout=config.getint("breakertimeout"),
+    )
+    circuitbreaker.load(models.transfer_session)
+
+
 def get_setting(config_file, setting, default=None):
-    """Get an option value from the configuration file."""
-    config = configparser.SafeConfigParser()
-    section = "transfers"
-    try:
-        config.read(config_file)
-        cfg = config.get(section, setting)
-        LOGGER.info("Configuration values read for %s: %s", setting, cfg)
-        return cfg
-    except configparser.NoOptionError:
-        LOGGER.warning("No option provided for %s", setting)
-        return default
-    except configparser.NoSectionError:
-        LOGGER.warning("No section: %s in %s", section, config.sections())
-        return default
+    """Get an option value from the configuration file.
+
+    :param config_file: Path of the configuration file, or the Config
+                        returned by ``transfers.config.get_config``. The file
+                        is only read the first time it is used.
+    """
+    return get_config(config_file).get(setting, default)
 
 
 def get_status(
@@ -87,13 +101,19 @@ def get_status(
     unit_type,
     hide_on_complete=False,
     delete_on_complete=False,
+    trash_dir=None,
 ):
     """
     Get status of the SIP or Transfer with unit_uuid.
 
     :param str unit_uuid: UUID of the unit to query for.
     :param str unit_type: 'ingest' or 'transfer'
-    :param bool hide_on_complete: Hide the unit in the dashboard if COMPLETE
+    :param bool hide_on_complete: Queue the unit to be hidden in the dashboard
+                                  if COMPLETE
+    :param bool delete_on_complete: Queue the source files of the unit for
+                                    deletion once it is stored as an AIP
+    :param str trash_dir: Directory to move source files into while they wait
+                          to be deleted
     :returns: Dict with status of the unit from Archivematica or None.
     """
     # Get status
@@ -103,13 +123,10 @@ def get_status(
     if isinstance(unit_info, int):
         if errors.error_lookup(unit_info) is not None:
             return errors.error_lookup(unit_info)
-    # If complete, hide in dashboard
+    # If complete, queue to be hidden in dashboard
     if hide_on_complete and unit_info and unit_info.get("status") == "COMPLETE":
-        LOGGER.info("Hiding %s %s in dashboard", unit_type, unit_uuid)
-        url = "{}/api/{}/{}/delete/".format(am_url, unit_type, unit_uuid)
-        LOGGER.debug("Method: DELETE; URL: %s; params: %s;", url, params)
-        response = requests.delete(url, params=params)
-        LOGGER.debug("Response: %s", response)
+        LOGGER.info("Queueing %s %s to be hidden in dashboard", unit_type, unit_uuid)
+        models.queue_hide(uuid=unit_uuid, unit_type=unit_type)
     # If Transfer is complete, get the SIP's status
     if (
         unit_info
@@ -135,16 +152,18 @@ def get_status(
         if isinstance(unit_info, int):
             if errors.error_lookup(unit_info) is not None:
                 return errors.error_lookup(unit_info)
-        # If complete, hide in dashboard
+        # If complete, queue to be hidden in dashboard
         if hide_on_complete and unit_info and unit_info.get("status") == "COMPLETE":
-            LOGGER.info("Hiding SIP %s in dashboard", unit.uuid)
-            url = "{}/api/ingest/{}/delete/".format(am_url, unit.uuid)
-            LOGGER.debug("Method: DELETE; URL: %s; params: %s;", url, params)
-            response = requests.delete(url, params=params)
-            LOGGER.debug("Response: %s", response)
-        # If complete and SIP status is 'UPLOADED', delete transfer source
-        # files
+            LOGGER.info("Queueing SIP %s to be hidden in dashboard", unit.uuid)
+            models.queue_hide(uuid=unit.uuid, unit_type="ingest")
+        # If complete and SIP status is 'UPLOADED', queue the transfer source
+        # files for deletion by the deletion worker.
         if delete_on_complete and unit_info and unit_info.get("status") == "COMPLETE":
+            from amclient import AMClient
+            from transfers import deletion
+
+            circuitbreaker.guard_amclient()
+
             am = AMClient(
                 ss_url=ss_url,
                 ss_user_name=ss_user,
@@ -152,25 +171,170 @@ def get_status(
                 package_uuid=unit.uuid,
             )
             response = am.get_package_details()
-            if response.get("status") == "UPLOADED":
+            if isinstance(response, dict) and response.get("status") == "UPLOADED":
                 LOGGER.info(
-                    "Deleting source files for SIP %s from watched " "directory",
+                    "Queueing source files for SIP %s for deletion from "
+                    "watched directory",
                     unit.uuid,
                 )
-                try:
-                    shutil.rmtree(unit.path)
-                    LOGGER.info("Source files deleted for SIP %s " "deleted", unit.uuid)
-                except OSError as e:
-                    LOGGER.warning(
-                        "Error deleting source files: %s. If "
-                        "running this module remotely the "
-                        "script might not have access to the "
-                        "transfer source",
-                        e,
-                    )
+                deletion.schedule_deletion(unit.path, trash_dir=trash_dir)
     return unit_info
 
 
+def get_user_input_rules(config_file):
+    """Return the rules for user input prompts set in the config file."""
+    rules_file = get_setting(config_file, "userinputrules")
+    if not rules_file:
+        return []
+    from transfers import decisions
+
+    return decisions.load_rules(rules_file)
+
+
+def resolve_user_input(config_file, am_url, am_user, am_api_key, unit_info):
+    """Make the choice at the user input prompt of a unit if one of the rules
+    set in the config file matches it.
+
+    :returns: True if the prompt has been dealt with.
+    """
+    rules = get_user_input_rules(config_file)
+    if not rules:
+        return False
+    from transfers import decisions
+
+    return decisions.resolve(rules, am_url, am_user, am_api_key, unit_info)
+
+
+def run_preflight(config_file, target):
+    """Validate a transfer source before it is started, if the directory where
+    the transfer source location is mounted locally is set with
+    ``preflightroot`` in the config file.
+
+    :returns: List of the problems found, empty if the transfer source is
+              valid or cannot be validated.
+    """
+    config = get_config(config_file)
+    root = config.get("preflightroot")
+    if not root:
+        return []
+    from transfers import preflight
+
+    return preflight.validate(
+        os.path.join(fsencode(root), target),
+        processes=config.getint("preflightprocesses"),
+        reject_empty_files=config.getboolean("preflightrejectempty"),
+    )
+
+
+def fingerprint_candidate(config_file, target):
+    """Fingerprint a transfer source, if ``fingerprint`` and ``preflightroot``
+    are set in the config file.
+
+    :returns: Tuple of the fingerprints of ``target``, or None if they are not
+              recorded.
+    """
+    config = get_config(config_file)
+    mode = config.get("fingerprint")
+    root = config.get("preflightroot")
+    if not mode or not root:
+        return None
+    from transfers import fingerprint
+
+    try:
+        return fingerprint.fingerprint(
+            os.path.join(fsencode(root), target),
+            mode,
+            processes=config.getint("preflightprocesses"),
+        )
+    except (IOError, OSError) as err:
+        LOGGER.warning("Cannot fingerprint %s: %s", target, err)
+        return None
+
+
+def inspect_candidate(config_file, target):
+    """Run the pre-flight validation of a transfer source and fingerprint it,
+    the parts of ``check_candidate`` which do not use the database.
+
+    :returns: Tuple of the problems found and the fingerprints of ``target``,
+              or None.
+    """
+    problems = run_preflight(config_file, target)
+    if problems:
+        return problems, None
+    return problems, fingerprint_candidate(config_file, target)
+
+
+def candidate_status(target, problems, fingerprints):
+    """Return the outcome of ``check_candidate`` given the result of
+    ``inspect_candidate``, looking up the duplicates of ``target`` in the
+    database.
+    """
+    if problems:
+        return "REJECTED", "; ".join(problems), None
+    duplicate = None
+    if fingerprints:
+        from transfers import fingerprint
+
+        duplicate = fingerprint.find_duplicate(target, *fingerprints)
+    if duplicate:
+        return "HELD", "duplicate of {}".format(fsdecode(duplicate)), fingerprints
+    return None, None, fingerprints
+
+
+def check_candidate(config_file, target):
+    """Run the pre-flight validation and the duplicate check on a transfer
+    source before it is started.
+
+    :returns: Tuple of the status to record the transfer source with, None if
+              it can be started, the reason for it and the fingerprints of the
+              transfer source to record once started, or None.
+    """
+    return candidate_status(target, *inspect_candidate(config_file, target))
+
+
+def record_unstarted_candidate(target, status, reason):
+    """Record a transfer source rejected or held by ``check_candidate``."""
+    if status == "HELD":
+        LOGGER.warning("Holding %s for review, %s", target, reason)
+        models.transfer_held(target)
+    else:
+        LOGGER.warning("Rejecting %s: %s", target, reason)
+        models.transfer_rejected(target)
+
+
+def get_transfer_type(
+    config_file, ss_url, ss_user, ss_api_key, ts_location_uuid, target, transfer_type
+):
+    """Return the type of the transfer to start from ``target``, detecting it
+    if ``transfer_type`` is ``auto``.
+    """
+    if transfer_type != "auto":
+        return transfer_type
+    from transfers import transfertypes
+
+    config = get_config(config_file)
+    overrides_file = config.get("transfertypes")
+    if overrides_file:
+        detected = transfertypes.match_override(
+            transfertypes.load_overrides(overrides_file), target
+        )
+        if detected:
+            return detected
+    root = config.get("preflightroot")
+    if root:
+        detected = transfertypes.inspect_local(os.path.join(fsencode(root), target))
+    else:
+        detected = transfertypes.inspect_listing(
+            ss_url,
+            ss_user,
+            ss_api_key,
+            ts_location_uuid,
+            target,
+            is_dir=target in SOURCE_DIRECTORIES,
+        )
+    return detected or transfertypes.STANDARD
+
+
 def get_accession_id(dirname):
     """
     Call get-accession-number and return literal_eval stdout as accession ID.
@@ -281,6 +445,7 @@ def get_next_transfer(
     depth,
     processed,
     see_files,
+    archived=None,
 ):
     """
     Helper to find the first directory that doesn't have an associated
@@ -301,47 +466,40 @@ def get_next_transfer(
                              those currently processing and completed.
     :param bool see_files:   Return files as well as folders to become
                              transfers.
+    :param set archived:     Digests of the paths of the archived units, see
+                             models.get_archived_digests. The paths are looked
+                             up in the database if None.
     :returns:                Path relative to TS Location of the new transfer.
     """
-    # Get sorted list from source directory.
-    url = ss_url + "/api/v2/location/" + ts_location_uuid + "/browse/"
-    params = {"username": ss_user, "api_key": ss_api_key}
-    if path_prefix:
-        params["path"] = base64.b64encode(path_prefix)
-    browse_info = utils._call_url_json(url, params)
-    if isinstance(browse_info, int):
-        if errors.error_lookup(browse_info) is not None:
-            LOGGER.error(
-                "Error when browsing location: %s", errors.error_lookup(browse_info)
-            )
-            return None
+    browse_info = _browse(ss_url, ss_user, ss_api_key, ts_location_uuid, path_prefix)
     if browse_info is None:
         return None
-    if see_files:
-        entries = browse_info["entries"]
-    else:
-        entries = browse_info["directories"]
-    entries = [base64.b64decode(e.encode("utf8")) for e in entries]
-    LOGGER.debug("Entries: %s", entries)
-    LOGGER.info("Total files or folders in transfer source location: %s", len(entries))
-    entries = [os.path.join(path_prefix, e) for e in entries]
+    key = "entries" if see_files else "directories"
+    LOGGER.info(
+        "Total files or folders in transfer source location: %s",
+        len(browse_info[key]),
+    )
+    entries = _iter_entries(path_prefix, browse_info[key])
     # If at the correct depth, check if any of these have not been made into
     # transfers yet
     if depth <= 1:
-        # Find the directories that are not already in the DB using sets
-        entries = set(entries) - processed
-        LOGGER.debug("New transfer candidates: %s", entries)
-        LOGGER.info("Unprocessed entries to choose from: %s", len(entries))
-        # Sort, take the first
-        entries = sorted(list(entries))
-        if not entries:
+        # Keep the first of the entries not already in the DB, going through
+        # them one at a time rather than holding copies of the listing.
+        target = target_entry = None
+        count = 0
+        for path, entry in _iter_unprocessed(entries, processed, archived):
+            count += 1
+            if target is None or path < target:
+                target, target_entry = path, entry
+        LOGGER.info("Unprocessed entries to choose from: %s", count)
+        if target is None:
             LOGGER.info("All potential transfers in %s have been created.", path_prefix)
             return None
-        target = entries[0]
+        _remember_target(target, target_entry, browse_info)
         return target
     else:  # if depth > 1
         # Recurse on each directory
-        for entry in entries:
+        for entry, _ in entries:
             LOGGER.debug("New path: %s", entry)
             target = get_next_transfer(
                 ss_url=ss_url,
@@ -352,18 +510,140 @@ def get_next_transfer(
                 depth=depth - 1,
                 processed=processed,
                 see_files=see_files,
+                archived=archived,
             )
             if target:
                 return target
     return None
 
 
+def iter_candidates(
+    ss_url,
+    ss_user,
+    ss_api_key,
+    ts_location_uuid,
+    path_prefix,
+    depth,
+    processed,
+    see_files,
+):
+    """Yield the paths and sizes, None if unknown, of all the transfer sources
+    not processed yet, in the order ``get_next_transfer`` returns them. The
+    parameters are the same.
+    """
+    browse_info = _browse(ss_url, ss_user, ss_api_key, ts_location_uuid, path_prefix)
+    if browse_info is None:
+        return
+    entries = _iter_entries(
+        path_prefix, browse_info["entries" if see_files else "directories"]
+    )
+    if depth <= 1:
+        for path, entry in sorted(_iter_unprocessed(entries, processed)):
+            yield path, _entry_size(browse_info, path, entry)
+        return
+    for entry, _ in entries:
+        for candidate in iter_candidates(
+            ss_url,
+            ss_user,
+            ss_api_key,
+            ts_location_uuid,
+            entry,
+            depth - 1,
+            processed,
+            see_files,
+        ):
+            yield candidate
+
+
+def _browse(ss_url, ss_user, ss_api_key, ts_location_uuid, path_prefix):
+    """Return the listing of a transfer source directory by the Storage
+    Service, or None on error.
+    """
+    url = ss_url + "/api/v2/location/" + ts_location_uuid + "/browse/"
+    params = {"username": ss_user, "api_key": ss_api_key}
+    if path_prefix:
+        params["path"] = base64.b64encode(path_prefix)
+    browse_info = utils._call_url_json(url, params)
+    if isinstance(browse_info, int):
+        if errors.error_lookup(browse_info) is not None:
+            LOGGER.error(
+                "Error when browsing location: %s", errors.error_lookup(browse_info)
+            )
+            return None
+    return browse_info
+
+
+def _iter_entries(path_prefix, encoded_entries):
+    """Yield the paths of the entries of a transfer source directory listed by
+    the Storage Service, with their encoded name, decoding them as they are
+    needed.
+    """
+    for entry in encoded_entries:
+        yield os.path.join(path_prefix, base64.b64decode(entry.encode("utf8"))), entry
+
+
+def _iter_unprocessed(entries, processed, archived=None, chunk_size=500):
+    """Yield the entries from ``_iter_entries`` whose path is neither in
+    ``processed`` nor archived, looking up the archived paths by chunks unless
+    their digests are given in ``archived``.
+    """
+    chunk = []
+    for entry in entries:
+        if entry[0] in processed:
+            continue
+        chunk.append(entry)
+        if len(chunk) >= chunk_size:
+            for new_entry in _drop_archived(chunk, archived):
+                yield new_entry
+            chunk = []
+    for new_entry in _drop_archived(chunk, archived):
+        yield new_entry
+
+
+def _drop_archived(entries, archived=None):
+    if archived is not None:
+        return [
+            entry for entry in entries if models.path_digest(entry[0]) not in archived
+        ]
+    archived = models.get_archived_paths([path for path, _ in entries])
+    return [entry for entry in entries if entry[0] not in archived]
+
+
+def _remember_target(target, entry, browse_info):
+    """Keep whether the next transfer source is a directory and its size, for
+    the watchdog to compare units of similar sizes.
+    """
+    if entry in browse_info["directories"]:
+        SOURCE_DIRECTORIES.add(target)
+    size = _entry_size(browse_info, target, entry)
+    if size is not None:
+        SOURCE_SIZES[target] = size
+
+
+def _entry_size(browse_info, path, entry):
+    """Return the size of an entry of a transfer source directory listed by
+    the Storage Service, or None if it is not listed.
+    """
+    properties = browse_info.get("properties") or {}
+    # Depending on its version, the Storage Service encodes the names in
+    # base64 like the entries.
+    entry_properties = properties.get(
+        entry, properties.get(fsdecode(os.path.basename(path)))
+    )
+    try:
+        return int(entry_properties["size"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
 def call_start_transfer_endpoint(
     am_url, am_user, am_api_key, target, transfer_type, accession, ts_location_uuid
 ):
     """Make the call to the start_transfer endpoint and return the unapproved
     directory name, and current (absolute path), of the transfer as a tuple.
     """
+    import requests
+
     url = "{}/api/transfer/start_transfer/".format(am_url)
     params = {"username": am_user, "api_key": am_api_key}
     target_name = os.path.basename(target)
@@ -375,7 +655,13 @@ def call_start_transfer_endpoint(
         "row_ids[]": [""],
     }
     LOGGER.debug("URL: %s; Params: %s; Data: %s", url, params, data)
-    response = requests.post(url, params=params, data=data)
+    breaker = circuitbreaker.get_breaker(am_url)
+    try:
+        response = requests.post(url, params=params, data=data)
+    except requests.exceptions.ConnectionError:
+        breaker.record_failure()
+        raise
+    breaker.record_success()
     LOGGER.debug("Response: %s", response)
     try:
         resp_json = response.json()
@@ -434,18 +720,44 @@ def start_transfer(
     :returns: Tuple of Transfer information about the new transfer or None on
               error.
     """
-    # Retrieve the next transfer to process.
+    # Retrieve the next transfer to process. If several workers share the
+    # database, skip the paths claimed by the others and claim the target so
+    # that no other worker starts it as well.
+    # Leave the transfer source alone while the transfers cannot be started.
+    if not circuitbreaker.get_breaker(am_url).available():
+        LOGGER.warning("Not starting a transfer while %s is unavailable", am_url)
+        return None
+    worker = get_setting(config_file, "workerid")
     processed = models.get_processed_transfer_paths()
-    target = get_next_transfer(
-        ss_url=ss_url,
-        ss_user=ss_user,
-        ss_api_key=ss_api_key,
-        ts_location_uuid=ts_location_uuid,
-        path_prefix=ts_path,
-        depth=depth,
-        processed=processed,
-        see_files=see_files,
-    )
+    if worker:
+        lease = get_config(config_file).getint("workerlease", defaults.WORKER_LEASE)
+        processed |= models.get_claimed_paths(exclude_worker=worker)
+    while True:
+        target = get_next_transfer(
+            ss_url=ss_url,
+            ss_user=ss_user,
+            ss_api_key=ss_api_key,
+            ts_location_uuid=ts_location_uuid,
+            path_prefix=ts_path,
+            depth=depth,
+            processed=processed,
+            see_files=see_files,
+        )
+        if target and worker and not models.claim_path(target, worker, lease):
+            LOGGER.info("%s has been claimed by another worker", target)
+            processed.add(target)
+            continue
+        if not target:
+            break
+        status, reason, fingerprints = check_candidate(config_file, target)
+        if not status:
+            break
+        # Move on to the next candidate rather than spend a pipeline cycle on
+        # a transfer bound to fail or already ingested.
+        record_unstarted_candidate(target, status, reason)
+        if worker:
+            models.release_claim(target, worker)
+        processed.add(target)
     if not target:
         # Report the location UUID.
         LOGGER.info(
@@ -454,6 +766,16 @@ def start_transfer(
         )
         return None
     LOGGER.info("Starting with %s", target)
+    transfer_type = get_transfer_type(
+        config_file,
+        ss_url,
+        ss_user,
+        ss_api_key,
+        ts_location_uuid,
+        target,
+        transfer_type,
+    )
+    LOGGER.info("Transfer type: %s", transfer_type)
     # Get accession ID
     accession = get_accession_id(target)
     LOGGER.info("Accession ID: %s", accession)
@@ -471,6 +793,8 @@ def start_transfer(
     if not transfer_name:
         LOGGER.info("Cannot begin transfer with target name: %s", target)
         models.transfer_failed_to_start(target)
+        if worker:
+            models.release_claim(target, worker)
         return None
     # Run all pre-transfer scripts on the unapproved transfer directory.
     LOGGER.info("Attempting to run pre-transfer scripts on: %s", transfer_name)
@@ -493,12 +817,21 @@ def start_transfer(
             LOGGER.info("Approved %s", result)
             # Store the absolute path to help users to determine what type
             # the transfer is, and where something it is.
-            new_transfer = models.add_new_transfer(uuid=result, path=target)
+            new_transfer = models.add_new_transfer(
+                uuid=result,
+                path=target,
+                transfer_type=transfer_type,
+                size=SOURCE_SIZES.get(target),
+            )
+            if fingerprints:
+                models.add_fingerprint(target, *fingerprints, uuid=result)
             LOGGER.info("New transfer: %s", new_transfer)
             break
         LOGGER.info("Failed transfer approval, try %s of %s", i + 1, retry_count)
     else:
         new_transfer = models.failed_to_approve(path=target)
+        if worker:
+            models.release_claim(target, worker)
         LOGGER.warning("Transfer not approved: %s", transfer_name)
         return None
     # Start transfer completed successfully.
@@ -512,6 +845,9 @@ def approve_transfer(dirname, url, am_api_key, am_user):
 
     :returns: UUID of the approved transfer or None.
     """
+    from amclient import AMClient
+
+    circuitbreaker.guard_amclient()
     LOGGER.info("Approving %s", dirname)
     time.sleep(6)
     am = AMClient(am_url=url, am_user_name=am_user, am_api_key=am_api_key)
@@ -554,7 +890,7 @@ def approve_transfer(dirname, url, am_api_key, am_user):
     return approved.get("uuid")
 
 
-def main(
+def run_cycle(
     am_user,
     am_api_key,
     ss_user,
@@ -569,43 +905,21 @@ def main(
     hide_on_complete=False,
     delete_on_complete=False,
     config_file=None,
-    log_level="INFO",
 ):
-    """Primary entry point for the automation tools script."""
-    loggingconfig.setup(
-        log_level, get_setting(config_file, "logfile", defaults.TRANSFER_LOG_FILE)
-    )
-
-    LOGGER.info("Automation tools waking up")
+    """Check the status of the current unit and start a new transfer if it is
+    no longer being processed.
 
-    # Check for evidence that this is already running
-    default_pidfile = os.path.join(THIS_DIR, "pid.lck")
-    pid_file = get_setting(config_file, "pidfile", default_pidfile)
-    try:
-        # Open PID file only if it doesn't exist for read/write
-        f = os.fdopen(os.open(pid_file, os.O_CREAT | os.O_EXCL | os.O_RDWR), "w")
-    except OSError:
-        LOGGER.error(
-            "This script is already running. To override this "
-            "behavior and start a new run, remove %s",
-            pid_file,
-        )
-        return 0
-    else:
-        pid = os.getpid()
-        f.write(str(pid))
-        f.close()
-
-    # Create a database session to work with.
-    create_db_session(config_file)
-
-    # Create the callback to automatically remove pid.lck on script completion.
-    setup_automation_execution(pid_file=pid_file)
+    :param config_file: Path of the configuration file, or the Config
+                        returned by ``transfers.config.get_config``.
+    :returns: Exit code for the automation tools script.
+    """
+    from sqlalchemy.orm.exc import NoResultFound
 
     # Check status of last unit
+    worker = get_setting(config_file, "workerid")
     current_unit = None
     try:
-        current_unit = models.get_current_unit()
+        current_unit = models.get_current_unit(worker=worker)
         unit_uuid = current_unit.uuid
         unit_type = current_unit.unit_type
     except NoResultFound:
@@ -617,18 +931,20 @@ def main(
     else:
         LOGGER.info("Current unit: %s", current_unit)
         # Get status
-        status_info = get_status(
-            am_url,
-            am_user,
-            am_api_key,
-            ss_url,
-            ss_user,
-            ss_api_key,
-            unit_uuid,
-            unit_type,
-            hide_on_complete,
-            delete_on_complete,
-        )
+        with loggingconfig.context(unit=unit_uuid, stage="status"):
+            status_info = get_status(
+                am_url,
+                am_user,
+                am_api_key,
+                ss_url,
+                ss_user,
+                ss_api_key,
+                unit_uuid,
+                unit_type,
+                hide_on_complete,
+                delete_on_complete,
+                get_setting(config_file, "deletiontrashdir"),
+            )
         LOGGER.info("Status info: %s", status_info)
         if not status_info:
             LOGGER.error("Could not fetch status for %s. Exiting.", unit_uuid)
@@ -642,15 +958,33 @@ def main(
             )
             return None
 
-    # If processing, exit
+    # Keep hold of the current unit while it is being processed.
+    if worker and status in ("PROCESSING", "USER_INPUT"):
+        models.claim_path(
+            current_unit.path,
+            worker,
+            get_config(config_file).getint("workerlease", defaults.WORKER_LEASE),
+        )
+
+    # If processing, exit, unless the unit is hung and recorded as failed
     if status == "PROCESSING":
-        LOGGER.info("Current transfer still processing, nothing to do.")
-        return 0
+        if not watchdog.Watchdog.from_config(config_file).check(current_unit):
+            LOGGER.info("Current transfer still processing, nothing to do.")
+            return 0
+        status = "FAILED"
 
-    # If waiting on input, send email, exit
+    # If waiting on input, make the choice if a rule matches the prompt,
+    # otherwise send email, exit
     elif status == "USER_INPUT":
-        LOGGER.info("Waiting on user input, running scripts in user-input directory.")
         microservice = status_info.get("microservice", "")
+        with loggingconfig.context(unit=unit_uuid, stage="user-input"):
+            resolved = resolve_user_input(
+                config_file, am_url, am_user, am_api_key, status_info
+            )
+        if resolved:
+            models.update_unit_microservice(current_unit, microservice)
+            return 0
+        LOGGER.info("Waiting on user input, running scripts in user-input directory.")
         run_scripts(
             "user-input",
             config_file,
@@ -668,21 +1002,194 @@ def main(
     # If failed, rejected, completed etc, start new transfer
     if current_unit:
         models.update_unit_current(current_unit, False)
-    new_transfer = start_transfer(
+        if worker:
+            models.release_claim(current_unit.path, worker)
+    with loggingconfig.context(stage="start"):
+        new_transfer = start_transfer(
+            ss_url,
+            ss_user,
+            ss_api_key,
+            ts_uuid,
+            ts_path,
+            depth,
+            am_url,
+            am_user,
+            am_api_key,
+            transfer_type,
+            see_files,
+            config_file,
+        )
+    return 0 if new_transfer else 1
+
+
+def process_completed_units(
+    config_file, am_url, am_user, am_api_key, hide_on_complete, delete_on_complete
+):
+    """Deal with the units queued to be deleted or hidden during the run,
+    once its changes have been committed.
+    """
+    config = get_config(config_file)
+
+    # Deleting source files can take a long time so leave it to the deletion
+    # worker and finish without waiting for it.
+    if delete_on_complete:
+        from transfers import deletion
+
+        max_attempts = config.getint("deletionattempts", deletion.DEFAULT_MAX_ATTEMPTS)
+        if models.get_pending_deletions(max_attempts):
+            deletion.spawn_worker(config.path)
+
+    # Hide completed units in the dashboard now that the next transfer is on
+    # its way.
+    if hide_on_complete:
+        from transfers import cleanup
+
+        cleanup.hide_units(
+            am_url,
+            am_user,
+            am_api_key,
+            workers=config.getint("hideworkers", cleanup.DEFAULT_WORKERS),
+        )
+
+
+def write_plan(
+    ss_url,
+    ss_user,
+    ss_api_key,
+    ts_uuid,
+    ts_path,
+    depth,
+    see_files,
+    plan_file,
+    config_file=None,
+):
+    """Write the plan of the transfers left to start to ``plan_file``, ``-``
+    for the standard output, and print its summary.
+
+    :returns: Exit code for the automation tools script.
+    """
+    from transfers import plan
+
+    create_db_session(config_file)
+    candidates = iter_candidates(
         ss_url,
         ss_user,
         ss_api_key,
         ts_uuid,
         ts_path,
         depth,
-        am_url,
-        am_user,
-        am_api_key,
-        transfer_type,
+        models.get_processed_transfer_paths(),
         see_files,
+    )
+    if plan_file == "-":
+        summary = plan.write_plan(candidates, sys.stdout, plan.get_history())
+        summary_file = sys.stderr
+    else:
+        with open(plan_file, "w") as out:
+            summary = plan.write_plan(candidates, out, plan.get_history())
+        summary_file = sys.stdout
+    for line in plan.format_summary(summary):
+        print(line, file=summary_file)
+    models.cleanup_session()
+    return 0
+
+
+def main(
+    am_user,
+    am_api_key,
+    ss_user,
+    ss_api_key,
+    ts_uuid,
+    ts_path,
+    depth,
+    am_url,
+    ss_url,
+    transfer_type,
+    see_files,
+    hide_on_complete=False,
+    delete_on_complete=False,
+    config_file=None,
+    log_level="INFO",
+    plan_file=None,
+):
+    """Primary entry point for the automation tools script."""
+    # The --hide and --delete-on-complete options can also be set in the
+    # config file.
+    config = get_config(
         config_file,
+        args={"hide": hide_on_complete, "deleteoncomplete": delete_on_complete},
+    )
+    hide_on_complete = config.getboolean("hide")
+    delete_on_complete = config.getboolean("deleteoncomplete")
+    loggingconfig.setup(
+        log_level, config.get("logfile", defaults.TRANSFER_LOG_FILE), config=config
     )
-    return 0 if new_transfer else 1
+
+    # Planning only reads the transfer source and the database, so it can run
+    # alongside the automation tools.
+    if plan_file:
+        return write_plan(
+            ss_url,
+            ss_user,
+            ss_api_key,
+            ts_uuid,
+            ts_path,
+            depth,
+            see_files,
+            plan_file,
+            config_file=config,
+        )
+
+    LOGGER.info("Automation tools waking up")
+    started = time.time()
+
+    # Make sure this is the only run. The lock is released by the kernel if
+    # the process dies, so a lock file left behind does not block later runs.
+    default_pidfile = os.path.join(THIS_DIR, "pid.lck")
+    lock = runlock.RunLock(
+        config.get("pidfile", default_pidfile),
+        lease=config.getint("locklease", runlock.DEFAULT_LEASE),
+    )
+    if not lock.acquire():
+        LOGGER.error("This script is already running, see %s", lock.path)
+        return 0
+
+    # Create a database session to work with.
+    create_db_session(config)
+    setup_circuit_breakers(config)
+    httpmetrics.install()
+
+    # Create the callback to release the lock on script completion.
+    setup_automation_execution(lock)
+
+    # Check the current unit and start a new transfer if needed. The changes
+    # made to the database along the way are committed together.
+    with models.unit_of_work():
+        result = run_cycle(
+            am_user,
+            am_api_key,
+            ss_user,
+            ss_api_key,
+            ts_uuid,
+            ts_path,
+            depth,
+            am_url,
+            ss_url,
+            transfer_type,
+            see_files,
+            hide_on_complete=hide_on_complete,
+            delete_on_complete=delete_on_complete,
+            config_file=config,
+        )
+    circuitbreaker.save(models.transfer_session)
+
+    process_completed_units(
+        config, am_url, am_user, am_api_key, hide_on_complete, delete_on_complete
+    )
+    LOGGER.info(httpmetrics.summary(time.time() - started))
+    httpmetrics.save(models.transfer_session)
+
+    return result
 
 
 if __name__ == "__main__":
@@ -690,6 +1197,11 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     log_level = loggingconfig.set_log_level(args.log_level, args.quiet, args.verbose)
+    profiling.start(
+        args,
+        "transfer",
+        get_config(args.config_file).get("logfile", defaults.TRANSFER_LOG_FILE),
+    )
 
     sys.exit(
         main(
@@ -708,5 +1220,6 @@ if __name__ == "__main__":
             delete_on_complete=args.delete_on_complete,
             config_file=args.config_file,
             log_level=log_level,
+            plan_file=args.plan,
         )
     )
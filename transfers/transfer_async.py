@@ -7,158 +7,669 @@ Automate Transfers.
 Helper script to automate running transfers through Archivematica.
 
 Similar to ``transfers.transfer`` but using the new `/api/v2beta` API when
-possible.
+possible. The package API starts transfers without an approval step, so
+several transfers are kept in the pipeline at once: the status of the units
+being processed is checked concurrently, and packages are created
+concurrently for as many new transfers as the pipeline has capacity for.
+Requires Python 3.
 """
 
 from __future__ import print_function, unicode_literals
 
+import asyncio
 import base64
+import functools
+import logging
 import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
 
 # Allow execution as an executable and the script to be run at package level
 # by ensuring that it can see itself.
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from transfers import transfer
+from transfers import (
+    circuitbreaker,
+    decisions,
+    defaults,
+    httpmetrics,
+    loggingconfig,
+    models,
+    profiling,
+    runlock,
+    watchdog,
+)
+from transfers.config import get_config
 from transfers.loggingconfig import set_log_level
-from transfers.models import Unit
 from transfers.transferargs import get_parser
-from transfers.transfer import LOGGER, get_next_transfer, get_accession_id, main
-from transfers.utils import fsencode
+from transfers.transfer import (
+    SOURCE_SIZES,
+    candidate_status,
+    create_db_session,
+    get_accession_id,
+    get_next_transfer,
+    get_transfer_type,
+    get_user_input_rules,
+    inspect_candidate,
+    process_completed_units,
+    record_unstarted_candidate,
+    run_scripts,
+    setup_automation_execution,
+    setup_circuit_breakers,
+    write_plan,
+)
+from transfers.utils import fsdecode, fsencode
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__))
+
+LOGGER = logging.getLogger("transfers")
+
+# Number of units kept in the pipeline at once, one like transfers.transfer
+# unless asked otherwise.
+DEFAULT_CAPACITY = 1
+
+# Number of concurrent requests made to Archivematica and the Storage Service.
+DEFAULT_CONCURRENCY = 8
+
+# Number of units whose changes are committed to the database together.
+DEFAULT_BATCH_SIZE = 20
+
+# Statuses of the units still being processed by the pipeline.
+ACTIVE_STATUSES = ("PROCESSING", "USER_INPUT")
 
 
 class DashboardAPIError(Exception):
     """Dashboard API error."""
 
 
-def _api_create_package(
-    am_url,
+class Engine(object):
+    """Check and start transfers concurrently.
+
+    The HTTP requests are made from a pool of threads sharing persistent
+    connections, and awaited from the event loop. The database is only used
+    from the event loop thread, which gives the functions run in the pool what
+    they need from it, and the changes are committed in batches.
+    """
+
+    def __init__(
+        self,
+        am_url,
+        am_user,
+        am_api_key,
+        ss_url,
+        ss_user,
+        ss_api_key,
+        concurrency=DEFAULT_CONCURRENCY,
+        batch_size=DEFAULT_BATCH_SIZE,
+    ):
+        self.am_url = am_url
+        self.am_user = am_user
+        self.am_api_key = am_api_key
+        self.ss_url = ss_url
+        self.ss_user = ss_user
+        self.ss_api_key = ss_api_key
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=concurrency)
+        self.http.mount("http://", adapter)
+        self.http.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.semaphore = None
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.http.close()
+
+    async def _call(self, func, *args, **kwargs):
+        """Run a blocking function in the thread pool."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs)
+        )
+
+    def _send(self, method, url, **kwargs):
+        """Make a request, failing fast while the server is unavailable."""
+        breaker = circuitbreaker.get_breaker(url)
+        if not breaker.allow():
+            raise requests.exceptions.ConnectionError(
+                "{} is unavailable".format(breaker.endpoint)
+            )
+        try:
+            response = getattr(self.http, method)(url, **kwargs)
+        except requests.exceptions.ConnectionError:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        return response
+
+    def _get(self, url, params):
+        LOGGER.debug("Method: GET; URL: %s; params: %s;", url, params)
+        response = self._send("get", url, params=params)
+        LOGGER.debug("Response: %s", response)
+        response.raise_for_status()
+        return response.json()
+
+    def create_package(self, name, package_type, accession, ts_location_uuid, path):
+        """Create a package, which starts a transfer straight away."""
+        url = self.am_url + "/api/v2beta/package/"
+        headers = {
+            "Authorization": "ApiKey {}:{}".format(self.am_user, self.am_api_key)
+        }
+        data = {
+            "name": fsdecode(name),
+            "type": package_type,
+            "accession": accession,
+            "path": base64.b64encode(fsencode(ts_location_uuid) + b":" + path).decode(
+                "ascii"
+            ),
+        }
+        LOGGER.debug("URL: %s; Data: %s", url, data)
+        response = self._send("post", url, headers=headers, json=data)
+        LOGGER.debug("Response: %s", response)
+        response.raise_for_status()
+        resp_json = response.json()
+        error = resp_json.get("error")
+        if error:
+            raise DashboardAPIError(error)
+        if not resp_json.get("id"):
+            raise DashboardAPIError("No package id in {}".format(resp_json))
+        return resp_json
+
+    def fetch_status(self, unit_type, unit_uuid, check_stored=False):
+        """Get the status of a unit from Archivematica, following a completed
+        transfer to its SIP.
+
+        :param bool check_stored: Also check whether a completed SIP has been
+                                  stored in the Storage Service.
+        :returns: Dict with the type, UUID and status of the unit, the status
+                  of its transfer if the unit has become a SIP, and whether it
+                  has been stored.
+        """
+        params = {"username": self.am_user, "api_key": self.am_api_key}
+        url = "{}/api/{}/status/{}/".format(self.am_url, unit_type, unit_uuid)
+        result = {
+            "unit_type": unit_type,
+            "uuid": unit_uuid,
+            "info": self._get(url, params),
+            "transfer": None,
+            "stored": False,
+        }
+        info = result["info"]
+        if (
+            unit_type == "transfer"
+            and info.get("status") == "COMPLETE"
+            and info.get("sip_uuid") not in (None, "BACKLOG")
+        ):
+            url = "{}/api/ingest/status/{}/".format(self.am_url, info["sip_uuid"])
+            result.update(
+                unit_type="ingest",
+                uuid=info["sip_uuid"],
+                info=self._get(url, params),
+                transfer=info,
+            )
+        if (
+            check_stored
+            and result["unit_type"] == "ingest"
+            and result["info"].get("status") == "COMPLETE"
+        ):
+            url = "{}/api/v2/file/{}/".format(self.ss_url, result["uuid"])
+            package = self._get(
+                url, {"username": self.ss_user, "api_key": self.ss_api_key}
+            )
+            result["stored"] = package.get("status") == "UPLOADED"
+        return result
+
+    async def check_unit(self, unit, check_stored=False):
+        unit_type, unit_uuid = unit.unit_type, unit.uuid
+        async with self.semaphore:
+            try:
+                result = await self._call(
+                    self.fetch_status, unit_type, unit_uuid, check_stored
+                )
+            except (requests.exceptions.RequestException, ValueError) as err:
+                LOGGER.error("Unable to get the status of %s: %s", unit, err)
+                result = None
+        return unit, result
+
+    async def start_transfer(
+        self, target, transfer_type, ts_location_uuid, config_file=None
+    ):
+        async with self.semaphore:
+            try:
+                transfer_type = await self._call(
+                    get_transfer_type,
+                    config_file,
+                    self.ss_url,
+                    self.ss_user,
+                    self.ss_api_key,
+                    ts_location_uuid,
+                    target,
+                    transfer_type,
+                )
+                accession = await self._call(get_accession_id, target)
+                LOGGER.info("Accession ID of %s: %s", target, accession)
+                result = await self._call(
+                    self.create_package,
+                    os.path.basename(target),
+                    transfer_type,
+                    accession,
+                    ts_location_uuid,
+                    target,
+                )
+                package_id = result["id"]
+            except requests.exceptions.ConnectionError as err:
+                LOGGER.error("Unable to start transfer from %s: %s", target, err)
+                return target, False, transfer_type
+            except (
+                requests.exceptions.RequestException,
+                ValueError,
+                DashboardAPIError,
+            ) as err:
+                LOGGER.error("Unable to start transfer from %s: %s", target, err)
+                return target, None, transfer_type
+        LOGGER.info(
+            "Package created for %s (%s): %s", target, transfer_type, package_id
+        )
+        return target, package_id, transfer_type
+
+    async def decide(self, rules, unit_info):
+        if not rules:
+            return None
+        async with self.semaphore:
+            return await self._call(
+                decisions.decide,
+                rules,
+                self.am_url,
+                self.am_user,
+                self.am_api_key,
+                unit_info,
+            )
+
+    async def handle_user_input(self, user_input, config_file=None):
+        """Make the choices at the user input prompts matched by the rules
+        set in the config file, and run the user input scripts for the rest.
+
+        :param list user_input: Status of each unit waiting on user input,
+                                with whether it is the first time at the
+                                prompt ("True" or "False").
+        """
+        rules = get_user_input_rules(config_file)
+        outcomes = await asyncio.gather(
+            *[self.decide(rules, unit_info) for unit_info, _ in user_input]
+        )
+        with models.unit_of_work():
+            handled = [
+                decisions.record(unit_info, outcome)
+                for (unit_info, _), outcome in zip(user_input, outcomes)
+            ]
+        await asyncio.gather(
+            *[
+                self._call(
+                    run_scripts,
+                    "user-input",
+                    config_file,
+                    unit_info.get("microservice", ""),
+                    first_time,
+                    unit_info["path"],
+                    unit_info["uuid"],
+                    unit_info["name"],
+                    unit_info["type"],
+                )
+                for (unit_info, first_time), done in zip(user_input, handled)
+                if not done
+            ]
+        )
+
+    def find_targets(
+        self, ts_location_uuid, ts_path, depth, see_files, processed, archived, count
+    ):
+        """Return up to ``count`` paths to start transfers from, given the
+        paths processed and the digests of the paths archived.
+        """
+        targets = []
+        while len(targets) < count:
+            target = get_next_transfer(
+                self.ss_url,
+                self.ss_user,
+                self.ss_api_key,
+                ts_location_uuid,
+                ts_path,
+                depth,
+                processed,
+                see_files,
+                archived,
+            )
+            if not target:
+                break
+            processed.add(target)
+            targets.append(target)
+        return targets
+
+    async def record(self, coroutines, record):
+        """Pass the results of ``coroutines`` to ``record`` as they complete,
+        committing the changes to the database every ``batch_size`` results.
+        """
+        batch = []
+        for next_result in asyncio.as_completed(coroutines):
+            batch.append(await next_result)
+            if len(batch) >= self.batch_size:
+                with models.unit_of_work():
+                    for result in batch:
+                        record(*result)
+                batch = []
+        with models.unit_of_work():
+            for result in batch:
+                record(*result)
+
+    async def run_cycle(
+        self,
+        ts_location_uuid,
+        ts_path,
+        depth,
+        transfer_type,
+        see_files,
+        capacity=DEFAULT_CAPACITY,
+        hide_on_complete=False,
+        delete_on_complete=False,
+        trash_dir=None,
+        worker=None,
+        lease=defaults.WORKER_LEASE,
+        config_file=None,
+    ):
+        """Check the units in the pipeline and start new transfers up to its
+        capacity.
+
+        :returns: Exit code for the automation tools script.
+        """
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        watcher = watchdog.Watchdog.from_config(config_file)
+        active = []
+        user_input = []
+        failures = []
+
+        def record_status(unit, result):
+            if result is None:
+                # Check again on the next run.
+                active.append(unit)
+                failures.append(unit)
+                return
+            status = _record_status(
+                unit, result, hide_on_complete, delete_on_complete, trash_dir
+            )
+            if status == "PROCESSING" and watcher.check(unit):
+                status = "FAILED"
+            if status in ACTIVE_STATUSES:
+                active.append(unit)
+                # Keep hold of the unit while it is being processed.
+                if worker:
+                    models.claim_path(unit.path, worker, lease)
+            else:
+                models.update_unit_current(unit, False)
+                if worker:
+                    models.release_claim(unit.path, worker)
+            if status == "USER_INPUT":
+                info = result["info"]
+                microservice = info.get("microservice", "")
+                user_input.append((info, str(microservice != unit.microservice)))
+                models.update_unit_microservice(unit, microservice)
+
+        units = models.get_current_units(worker=worker)
+        LOGGER.info("Checking the status of %s units", len(units))
+        with loggingconfig.context(stage="status"):
+            await self.record(
+                [self.check_unit(unit, delete_on_complete) for unit in units],
+                record_status,
+            )
+        if user_input:
+            LOGGER.info("%s units waiting on user input", len(user_input))
+            with loggingconfig.context(stage="user-input"):
+                await self.handle_user_input(user_input, config_file)
+
+        available = capacity - len(active)
+        if available <= 0:
+            LOGGER.info("%s units processing, nothing to start.", len(active))
+            return 1 if failures else 0
+        if not circuitbreaker.get_breaker(self.am_url).available():
+            LOGGER.warning(
+                "Not starting transfers while %s is unavailable", self.am_url
+            )
+            return 1
+
+        processed = models.get_processed_transfer_paths()
+        if worker:
+            processed |= models.get_claimed_paths(exclude_worker=worker)
+        targets = await self._call(
+            self.find_targets,
+            ts_location_uuid,
+            ts_path,
+            depth,
+            see_files,
+            processed,
+            models.get_archived_digests(),
+            available,
+        )
+        if worker:
+            with models.unit_of_work():
+                targets = [
+                    target
+                    for target in targets
+                    if models.claim_path(target, worker, lease)
+                ]
+        if not targets:
+            LOGGER.info(
+                "All potential transfers in Location ID: %s have been created.",
+                ts_location_uuid,
+            )
+            return 1 if failures else 0
+        # Validated and fingerprinted in the pool, looked up in the database
+        # from here.
+        inspections = await asyncio.gather(
+            *[self._call(inspect_candidate, config_file, target) for target in targets]
+        )
+        fingerprints = {}
+        with models.unit_of_work():
+            for target, inspection in zip(targets, inspections):
+                status, reason, target_fingerprints = candidate_status(
+                    target, *inspection
+                )
+                if not status:
+                    fingerprints[target] = target_fingerprints
+                    continue
+                record_unstarted_candidate(target, status, reason)
+                if worker:
+                    models.release_claim(target, worker)
+        targets = [target for target in targets if target in fingerprints]
+        LOGGER.info("Starting %s transfers", len(targets))
+
+        def record_transfer(target, transfer_uuid, transfer_type):
+            if not transfer_uuid:
+                failures.append(target)
+                # False if Archivematica could not be reached, in which case
+                # the transfer is tried again on a later run.
+                if transfer_uuid is None:
+                    models.transfer_failed_to_start(target)
+                if worker:
+                    models.release_claim(target, worker)
+                return
+            unit = models.add_new_transfer(
+                transfer_uuid,
+                target,
+                transfer_type=transfer_type,
+                size=SOURCE_SIZES.get(target),
+            )
+            if fingerprints[target]:
+                models.add_fingerprint(
+                    target, *fingerprints[target], uuid=transfer_uuid
+                )
+            LOGGER.info("New transfer: %s", unit)
+
+        with loggingconfig.context(stage="start"):
+            await self.record(
+                [
+                    self.start_transfer(
+                        target, transfer_type, ts_location_uuid, config_file
+                    )
+                    for target in targets
+                ],
+                record_transfer,
+            )
+        return 1 if failures else 0
+
+
+def _record_status(unit, result, hide_on_complete, delete_on_complete, trash_dir):
+    """Record the status of a unit fetched by ``Engine.fetch_status``.
+
+    :returns: Status of the unit.
+    """
+    if result["transfer"] is not None:
+        LOGGER.info("%s is a complete transfer, now SIP %s", unit, result["uuid"])
+        if hide_on_complete:
+            models.queue_hide(uuid=unit.uuid, unit_type="transfer")
+        models.update_unit_type_and_uuid(
+            unit=unit, unit_type="ingest", uuid=result["uuid"]
+        )
+    status = result["info"].get("status")
+    models.update_unit_status(unit, status)
+    LOGGER.info("%s status: %s", unit, status)
+    if hide_on_complete and status == "COMPLETE":
+        LOGGER.info("Queueing %s to be hidden in dashboard", unit)
+        models.queue_hide(uuid=unit.uuid, unit_type=unit.unit_type)
+    if delete_on_complete and result["stored"]:
+        from transfers import deletion
+
+        LOGGER.info("Queueing source files of %s for deletion", unit)
+        deletion.schedule_deletion(unit.path, trash_dir=trash_dir)
+    return status
+
+
+def main(
     am_user,
     am_api_key,
-    name,
-    package_type,
-    accession,
-    ts_location_uuid,
-    ts_path,
-):
-    url = am_url + "/api/v2beta/package/"
-    headers = {"Authorization": "ApiKey {}:{}".format(am_user, am_api_key)}
-    data = {
-        "name": name,
-        "type": package_type,
-        "accession": accession,
-        "path": base64.b64encode(fsencode(ts_location_uuid) + b":" + ts_path),
-    }
-    LOGGER.debug("URL: %s; Headers: %s, Data: %s", url, headers, data)
-    response = requests.post(url, headers=headers, json=data)
-    response.raise_for_status()
-    LOGGER.debug("Response: %s", response)
-    resp_json = response.json()
-    error = resp_json.get("error")
-    if error:
-        raise DashboardAPIError(error)
-    return resp_json
-
-
-def _start_transfer(
-    ss_url,
     ss_user,
     ss_api_key,
-    ts_location_uuid,
+    ts_uuid,
     ts_path,
     depth,
     am_url,
-    am_user,
-    am_api_key,
+    ss_url,
     transfer_type,
     see_files,
-    session,
+    hide_on_complete=False,
+    delete_on_complete=False,
+    capacity=None,
+    concurrency=None,
+    config_file=None,
+    log_level="INFO",
+    plan_file=None,
 ):
-    """
-    Start a new transfer.
-
-    This is an early implementation and an alternative to
-    ``transfer.start_transfer`` that uses the new ``/api/v2beta/package`` API.
-    Because transfers start immediately we don't run the scripts inside the
-    pre-transfer directory like ``transfer.start_transfer`` does.
-
-    :param ss_url: URL of the Storage Sevice to query
-    :param ss_user: User on the Storage Service for authentication
-    :param ss_api_key: API key for user on the Storage Service for
-                       authentication
-    :param ts_location_uuid: UUID of the transfer source Location
-    :param ts_path: Relative path inside the Location to work with.
-    :param depth: Depth relative to ts_path to create a transfer from. Should
-                  be 1 or greater.
-    :param am_url: URL of Archivematica pipeline to start transfer on
-    :param am_user: User on Archivematica for authentication
-    :param am_api_key: API key for user on Archivematica for authentication
-    :param bool see_files: If true, start transfers from files as well as
-                           directories
-    :param session: SQLAlchemy session with the DB
-    :returns: Tuple of Transfer information about the new transfer or None on
-              error.
-    """
-    # Start new transfer
-    completed = {x[0] for x in session.query(Unit.path).all()}
-    target = get_next_transfer(
+    """Primary entry point for the asynchronous automation tools script."""
+    config = get_config(
+        config_file,
+        args={
+            "hide": hide_on_complete,
+            "deleteoncomplete": delete_on_complete,
+            "capacity": capacity,
+            "concurrency": concurrency,
+        },
+    )
+    hide_on_complete = config.getboolean("hide")
+    delete_on_complete = config.getboolean("deleteoncomplete")
+    loggingconfig.setup(
+        log_level, config.get("logfile", defaults.TRANSFER_LOG_FILE), config=config
+    )
+    if plan_file:
+        return write_plan(
+            ss_url,
+            ss_user,
+            ss_api_key,
+            ts_uuid,
+            ts_path,
+            depth,
+            see_files,
+            plan_file,
+            config_file=config,
+        )
+
+    LOGGER.info("Automation tools waking up")
+    started = time.time()
+
+    lock = runlock.RunLock(
+        config.get("pidfile", os.path.join(THIS_DIR, "pid.lck")),
+        lease=config.getint("locklease", runlock.DEFAULT_LEASE),
+    )
+    if not lock.acquire():
+        LOGGER.error("This script is already running, see %s", lock.path)
+        return 0
+    create_db_session(config)
+    setup_circuit_breakers(config)
+    httpmetrics.install()
+    setup_automation_execution(lock)
+
+    engine = Engine(
+        am_url,
+        am_user,
+        am_api_key,
         ss_url,
         ss_user,
         ss_api_key,
-        ts_location_uuid,
-        ts_path,
-        depth,
-        completed,
-        see_files,
+        concurrency=config.getint("concurrency", DEFAULT_CONCURRENCY),
+        batch_size=config.getint("batchsize", DEFAULT_BATCH_SIZE),
     )
-    if not target:
-        LOGGER.warning(
-            "All potential transfers in %s have been created. Exiting", ts_path
-        )
-        return None
-    LOGGER.info("Starting with %s", target)
-    # Get accession ID
-    accession = get_accession_id(target)
-    LOGGER.info("Accession ID: %s", accession)
-
+    loop = asyncio.new_event_loop()
     try:
-        result = _api_create_package(
-            am_url,
-            am_user,
-            am_api_key,
-            os.path.basename(target),
-            transfer_type,
-            accession,
-            ts_location_uuid,
-            target,
-        )
-    except (requests.exceptions.HTTPError, ValueError, DashboardAPIError) as err:
-        LOGGER.error("Unable to start transfer: %s", err)
-        new_transfer = Unit(
-            path=target, unit_type="transfer", status="FAILED", current=False
+        result = loop.run_until_complete(
+            engine.run_cycle(
+                ts_uuid,
+                ts_path,
+                depth,
+                transfer_type,
+                see_files,
+                capacity=config.getint("capacity", DEFAULT_CAPACITY),
+                hide_on_complete=hide_on_complete,
+                delete_on_complete=delete_on_complete,
+                trash_dir=config.get("deletiontrashdir"),
+                worker=config.get("workerid"),
+                lease=config.getint("workerlease", defaults.WORKER_LEASE),
+                config_file=config,
+            )
         )
-        session.add(new_transfer)
-        return None
+    finally:
+        loop.close()
+        engine.close()
+    circuitbreaker.save(models.transfer_session)
 
-    LOGGER.info("Package created: %s", result["id"])
-    new_transfer = Unit(
-        uuid=result["id"], path=target, unit_type="transfer", current=True
+    process_completed_units(
+        config, am_url, am_user, am_api_key, hide_on_complete, delete_on_complete
     )
-    LOGGER.info("New transfer: %s", new_transfer)
-    session.add(new_transfer)
-
-    return new_transfer
+    LOGGER.info(httpmetrics.summary(time.time() - started))
+    httpmetrics.save(models.transfer_session)
+    return result
 
 
 if __name__ == "__main__":
     parser = get_parser(__doc__)
+    parser.add_argument(
+        "--capacity",
+        type=int,
+        help="Number of units to keep in the pipeline at once. "
+        "Default: %s" % DEFAULT_CAPACITY,
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        help="Number of concurrent requests. Default: %s" % DEFAULT_CONCURRENCY,
+    )
     args = parser.parse_args()
-
-    # Override ``start_transfer`` function.
-    transfer.start_transfer = _start_transfer
+    profiling.start(
+        args,
+        "transfer_async",
+        get_config(args.config_file).get("logfile", defaults.TRANSFER_LOG_FILE),
+    )
 
     sys.exit(
         main(
@@ -174,6 +685,11 @@ if __name__ == "__main__":
             transfer_type=args.transfer_type,
             see_files=args.files,
             hide_on_complete=args.hide,
+            delete_on_complete=args.delete_on_complete,
+            capacity=args.capacity,
+            concurrency=args.concurrency,
+            config_file=args.config_file,
             log_level=set_log_level(args.log_level, args.quiet, args.verbose),
+            plan_file=args.plan,
         )
     )
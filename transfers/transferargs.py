@@ -2,6 +2,7 @@
 
 import argparse
 
+from transfers import profiling
 from transfers.defaults import DEF_AM_URL, DEF_SS_URL
 from transfers.utils import fsencode
 
@@ -84,9 +85,10 @@ def get_parser(doc):
         help="Type of transfer to start. "
         "One of: 'standard' "
         "(default), 'unzipped bag', "
-        "'zipped bag', 'dspace'.",
+        "'zipped bag', 'dspace', or 'auto' to detect the type of each "
+        "transfer.",
         default="standard",
-        choices=["standard", "unzipped bag", "zipped bag", "dspace"],
+        choices=["standard", "unzipped bag", "zipped bag", "dspace", "auto"],
     )
     parser.add_argument(
         "--files",
@@ -105,6 +107,13 @@ def get_parser(doc):
         help="If set, delete transfer source files after "
         "ingest successfully completes.",
     )
+    parser.add_argument(
+        "--plan",
+        metavar="FILE",
+        help="Write the transfers left to start, in order, to FILE as NDJSON "
+        "('-' for the standard output) with a summary and projected completion "
+        "time, without starting anything.",
+    )
     parser.add_argument(
         "-c",
         "--config-file",
@@ -130,5 +139,6 @@ def get_parser(doc):
         default=None,
         help="Set the debugging output level. This will " "override -q and -v",
     )
+    profiling.add_arguments(parser)
 
     return parser
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+"""Detect the type of the transfers to start from a mixed transfer source.
+
+With ``--transfer-type auto``, the type of each transfer source is found
+before the transfer is started:
+
+* A directory holding a ``bagit.txt`` or ``bag-info.txt`` file is an unzipped
+  bag.
+* A directory holding DSpace exports (``ITEM@*.zip``), or such an export on
+  its own, is a DSpace transfer.
+* A ZIP file is a zipped bag. When it can be opened locally, it must hold a
+  ``bagit.txt`` or ``bag-info.txt`` file, otherwise it is a standard transfer.
+* Anything else is a standard transfer.
+
+The transfer source is inspected on disk when its location is mounted locally
+(``preflightroot`` in the config file), otherwise through the Storage Service.
+Types can be forced with a JSON file, set with ``transfertypes`` in the config
+file, holding a list of objects with the following keys:
+
+* ``path``: Glob pattern the path of the transfer source, relative to the
+  transfer source location, has to match.
+* ``type``: Type of the transfers started from the matching paths.
+
+The first matching entry applies.
+"""
+
+import base64
+import fnmatch
+import json
+import logging
+import os
+
+from transfers import errors, utils
+from transfers.utils import fsdecode, fsencode
+
+LOGGER = logging.getLogger("transfers")
+
+STANDARD = "standard"
+UNZIPPED_BAG = "unzipped bag"
+ZIPPED_BAG = "zipped bag"
+DSPACE = "dspace"
+TRANSFER_TYPES = (STANDARD, UNZIPPED_BAG, ZIPPED_BAG, DSPACE)
+
+BAG_FILES = ("bagit.txt", "bag-info.txt")
+DSPACE_PATTERN = "ITEM@*.zip"
+
+# Overrides by path and modification time of the file they were read from.
+_OVERRIDES = {}
+
+
+def load_overrides(path):
+    """Read the list of ``(pattern, type)`` overrides from the JSON file at
+    ``path``.
+
+    The overrides are read again only if the file has changed.
+    """
+    key = (path, os.path.getmtime(path))
+    if key not in _OVERRIDES:
+        with open(path) as overrides_file:
+            entries = json.load(overrides_file)
+        overrides = []
+        for index, entry in enumerate(entries):
+            try:
+                pattern, transfer_type = entry["path"], entry["type"]
+            except (KeyError, TypeError):
+                raise ValueError(
+                    "Entry {} in {} needs a path and a type".format(index, path)
+                )
+            if transfer_type not in TRANSFER_TYPES:
+                raise ValueError(
+                    "Invalid transfer type in {}: {}".format(path, transfer_type)
+                )
+            overrides.append((pattern, transfer_type))
+        LOGGER.info("Loaded %s transfer type overrides from %s", len(overrides), path)
+        _OVERRIDES[key] = overrides
+    return _OVERRIDES[key]
+
+
+def match_override(overrides, target):
+    """Return the type of the first override matching ``target``, or None."""
+    target = fsdecode(target)
+    for pattern, transfer_type in overrides:
+        if fnmatch.fnmatchcase(target, pattern):
+            return transfer_type
+    return None
+
+
+def classify(name, children=None, members=None):
+    """Return the type of a transfer source.
+
+    :param name: Name of the directory or file.
+    :param list children: Names of the entries of the directory, None if the
+                          transfer source is a file.
+    :param list members: Names of the files in the ZIP file, if known.
+    """
+    name = fsdecode(name)
+    if children is not None:
+        children = [fsdecode(child) for child in children]
+        if any(child in BAG_FILES for child in children):
+            return UNZIPPED_BAG
+        if any(fnmatch.fnmatch(child, DSPACE_PATTERN) for child in children):
+            return DSPACE
+        return STANDARD
+    if fnmatch.fnmatch(name, DSPACE_PATTERN):
+        return DSPACE
+    if not name.lower().endswith(".zip"):
+        return STANDARD
+    if members is None:
+        return ZIPPED_BAG
+    for member in members:
+        if os.path.basename(fsdecode(member).rstrip("/")) in BAG_FILES:
+            return ZIPPED_BAG
+    return STANDARD
+
+
+def inspect_local(path):
+    """Return the type of the transfer source at ``path`` on disk, or None if
+    it cannot be read.
+    """
+    import zipfile
+
+    path = fsencode(path)
+    name = os.path.basename(path)
+    try:
+        if os.path.isdir(path):
+            return classify(name, children=os.listdir(path))
+        if not fsdecode(name).lower().endswith(".zip"):
+            return classify(name)
+        with open(path, "rb") as zip_file:
+            return classify(name, members=zipfile.ZipFile(zip_file).namelist())
+    except (IOError, OSError, zipfile.BadZipfile) as err:
+        LOGGER.warning("Cannot inspect %s: %s", fsdecode(path), err)
+        return None
+
+
+def inspect_listing(ss_url, ss_user, ss_api_key, ts_location_uuid, target, is_dir):
+    """Return the type of a transfer source from its listing by the Storage
+    Service, or None if it cannot be listed.
+    """
+    name = os.path.basename(fsencode(target))
+    if not is_dir:
+        return classify(name)
+    url = ss_url + "/api/v2/location/" + ts_location_uuid + "/browse/"
+    params = {
+        "username": ss_user,
+        "api_key": ss_api_key,
+        "path": base64.b64encode(fsencode(target)),
+    }
+    browse_info = utils._call_url_json(url, params)
+    if not isinstance(browse_info, dict):
+        LOGGER.warning(
+            "Cannot list %s: %s", fsdecode(target), errors.error_lookup(browse_info)
+        )
+        return None
+    children = [base64.b64decode(e.encode("utf8")) for e in browse_info["entries"]]
+    return classify(name, children=children)
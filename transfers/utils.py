@@ -5,11 +5,7 @@
 import logging
 import sys
 
-import requests
-import urllib3
-from six import binary_type, text_type
-
-from transfers import errors
+from transfers import circuitbreaker, errors
 
 
 LOGGER = logging.getLogger("transfers")
@@ -19,9 +15,13 @@ METHOD_POST = "POST"
 METHOD_DELETE = "DELETE"
 
 
+@circuitbreaker.guard
 def _call_url_json(url, params=None, method=METHOD_GET, headers=None, assume_json=True):
     """Helper to GET a URL where the expected response is 200 with JSON.
 
+    Fails fast with ``errors.ERR_SERVER_CONN`` while the server is known to be
+    unavailable, see ``transfers.circuitbreaker``.
+
     :param str url: URL to call
     :param dict params: Params to pass as HTTP query string or JSON body
     :param str method: HTTP method (e.g., 'GET')
@@ -31,6 +31,11 @@ def _call_url_json(url, params=None, method=METHOD_GET, headers=None, assume_jso
     :returns: Dict of the returned JSON or an integer error
             code to be looked up
     """
+    # Imported here so that scripts which end before making any requests do
+    # not pay for importing them.
+    import requests
+    import urllib3
+
     method = method.upper()
     LOGGER.debug("URL: %s; params: %s; method: %s", url, params, method)
     try:
@@ -69,6 +74,8 @@ def _call_url_json(url, params=None, method=METHOD_GET, headers=None, assume_jso
 try:
     from os import fsencode, fsdecode
 except ImportError:
+    from six import binary_type, text_type
+
     # Cribbed & modified from Python3's OS module to support Python2
     def fsencode(filename):
         """Encode path-like filename to the filesystem encoding.
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Find Hung Units.
+
+A unit can stay in PROCESSING forever, e.g. when the MCP client processing it
+crashes, and the automation tools then wait for it indefinitely. The age of a
+unit still processing is compared with a percentile of the processing times
+of the units completed before it with the same transfer type and a transfer
+source of a similar size. Units older than that are reported in the log and,
+if ``watchdogaction`` is ``fail`` in the config file, recorded as failed so
+that the next transfer can start.
+
+Run on its own, this module reports the age of the current units.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import bisect
+import datetime
+import logging
+import math
+import os
+import sys
+
+# Allow execution as an executable and the script to be run at package level
+# by ensuring that it can see itself.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transfers import models
+from transfers.config import get_config
+
+LOGGER = logging.getLogger("transfers")
+
+ACTION_REPORT = "report"
+ACTION_FAIL = "fail"
+
+DEFAULT_PERCENTILE = 95
+# A unit is hung once it is older than the percentile times this factor.
+DEFAULT_FACTOR = 2.0
+# Number of similar units needed before judging whether a unit is hung.
+DEFAULT_MIN_SAMPLES = 10
+
+# Bounds, in bytes, of the bands of sizes that units are compared within.
+SIZE_BANDS = (10**8, 10**9, 10**10, 10**11)
+
+
+def size_band(size):
+    """Return the smallest size included and the size excluded of the band of
+    ``size``, None standing for no bound.
+    """
+    if size is None:
+        return None, None
+    index = bisect.bisect_right(SIZE_BANDS, size)
+    lower = SIZE_BANDS[index - 1] if index else None
+    upper = SIZE_BANDS[index] if index < len(SIZE_BANDS) else None
+    return lower, upper
+
+
+def percentile(values, pct):
+    """Return the nearest-rank percentile ``pct`` of ``values``."""
+    ordered = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[max(rank, 1) - 1]
+
+
+class Watchdog(object):
+    """Check the units still processing against the units completed before."""
+
+    def __init__(
+        self,
+        percentile=DEFAULT_PERCENTILE,
+        factor=DEFAULT_FACTOR,
+        min_samples=DEFAULT_MIN_SAMPLES,
+        action=ACTION_REPORT,
+    ):
+        if action not in (ACTION_REPORT, ACTION_FAIL):
+            raise ValueError("Invalid watchdog action: {}".format(action))
+        self.percentile = percentile
+        self.factor = factor
+        self.min_samples = min_samples
+        self.action = action
+        # Thresholds by transfer type and size band.
+        self._thresholds = {}
+
+    @classmethod
+    def from_config(cls, config_file):
+        """Return a Watchdog with the settings of the config file."""
+        config = get_config(config_file)
+        return cls(
+            percentile=float(config.get("watchdogpercentile", DEFAULT_PERCENTILE)),
+            factor=float(config.get("watchdogfactor", DEFAULT_FACTOR)),
+            min_samples=config.getint("watchdogminsamples", DEFAULT_MIN_SAMPLES),
+            action=config.get("watchdogaction", ACTION_REPORT),
+        )
+
+    def threshold(self, unit):
+        """Return the age, in seconds, past which ``unit`` is hung, or None if
+        too few similar units have completed to tell.
+        """
+        band = size_band(unit.size)
+        key = (unit.transfer_type, band)
+        if key not in self._thresholds:
+            durations = models.get_durations(unit.transfer_type, *band)
+            if len(durations) < self.min_samples:
+                self._thresholds[key] = None
+            else:
+                self._thresholds[key] = (
+                    percentile(durations, self.percentile) * self.factor
+                )
+        return self._thresholds[key]
+
+    def age(self, unit, now=None):
+        """Return the time, in seconds, since ``unit`` was started, or None
+        for units started before it was recorded.
+        """
+        if unit.started is None:
+            return None
+        now = now or datetime.datetime.utcnow()
+        return (now - unit.started).total_seconds()
+
+    def is_hung(self, unit, now=None):
+        """Return whether a unit still processing is hung, reporting it in
+        the log if so.
+        """
+        age = self.age(unit, now)
+        threshold = self.threshold(unit)
+        if age is None or threshold is None or age <= threshold:
+            return False
+        LOGGER.warning(
+            "%s has been processing for %s, similar units take up to %s",
+            unit,
+            datetime.timedelta(seconds=int(age)),
+            datetime.timedelta(seconds=int(threshold)),
+        )
+        return True
+
+    def check(self, unit, now=None):
+        """Check a unit still processing and record it as failed if it is
+        hung and the action is ``fail``.
+
+        :returns: True if the unit has been recorded as failed.
+        """
+        if not self.is_hung(unit, now) or self.action != ACTION_FAIL:
+            return False
+        LOGGER.warning("Recording %s as failed to free up its slot", unit)
+        models.update_unit_status(unit, "FAILED")
+        return True
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return "unknown"
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+
+def report(config_file=None):
+    """Print the age of the current units and the age past which they are
+    considered hung.
+    """
+    config = get_config(config_file)
+    models.init_session(**config.database_options())
+    watchdog = Watchdog.from_config(config)
+    now = datetime.datetime.utcnow()
+    for unit in models.get_current_units():
+        print(
+            "{} {}: age {}, threshold {}{}".format(
+                unit.uuid,
+                unit.status,
+                _format_seconds(watchdog.age(unit, now)),
+                _format_seconds(watchdog.threshold(unit)),
+                ", HUNG" if watchdog.is_hung(unit, now) else "",
+            )
+        )
+    models.cleanup_session()
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--config-file", metavar="FILE", help="Configuration file(log/db/PID files)"
+    )
+    args = parser.parse_args()
+    sys.exit(report(args.config_file))